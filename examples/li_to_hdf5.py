@@ -3,21 +3,24 @@
 import sys
 from datetime import datetime
 
+import numpy as np
 import pymoku.dataparser
 import h5py
 
 if len(sys.argv) != 3:
-	print("Usage: li_to_csv.py infile.li outfile.hd5")
+	print("Usage: li_to_hdf5.py infile.li outfile.hd5")
 	exit(1)
 
+# Writes one row per record with one column per channel. LIDataFileReader.export gives a
+# compound dataset with a time column and every element of multi-element records instead.
 reader = pymoku.dataparser.LIDataFileReader(sys.argv[1])
 writer = h5py.File(sys.argv[2], 'w')
 ncols = reader.nch
 
 set_name = 'moku:datalog'
 
-# Start with storage for 100 items, it'll be expanded as we add data. We don't know the
-# length of the data set to begin with.
+# Start with storage for 100 items, it'll be resized to fit each block of records as it's added.
+# We don't know the length of the data set to begin with.
 writer.create_dataset(set_name, (100,ncols), maxshape=(None,ncols))
 writer[set_name].attrs['timestep'] = reader.deltat
 writer[set_name].attrs['start_secs'] = reader.starttime
@@ -26,16 +29,12 @@ writer[set_name].attrs['instrument'] = reader.instr
 writer[set_name].attrs['instrument_version'] = reader.instrv
 
 i = 0
-for record in reader:
-	curlen = len(writer[set_name])
-	if curlen <= i:
-		# Exponential allocation strategy, works fairly well for different sized files.
-		# We truncate to the correct length at the end anyway.
-		writer[set_name].resize((2*curlen, ncols))
-
-	writer[set_name][i,:] = record[:ncols]
-	i += 1
+for t, chs in reader.iter_blocks():
+	writer[set_name].resize((i + len(t), ncols))
+	writer[set_name][i:,:] = np.column_stack(chs)
+	i += len(t)
 
 # Truncate the file to the correct length
 writer[set_name].resize((i, ncols))
+reader.close()
 writer.close()
@@ -1,6 +1,6 @@
 
 
-import socket, select, struct, logging
+import socket, select, struct, logging, zlib, time, collections, threading
 import os.path
 import zmq
 
@@ -22,11 +22,505 @@ class NotDeployedException(MokuException): """Tried to perform an action on an I
 class FrameTimeout(MokuException): """No new :any:`DataFrame` arrived within the given timeout"""; pass
 class NoDataException(MokuException): """A request has been made for data but none will be generated """; pass
 
-# Chosen to trade off number of network transactions with memory usage.
-# 4MB is a little larger than a bitstream so those uploads aren't chunked.
+# Chosen to trade off number of network transactions with memory usage. Used for the
+# transfers made one request at a time (see pymoku.aio) and as the read size when
+# checksumming local files.
 _FS_CHUNK_SIZE = 1024 * 1024 * 4
 
-class Moku(object):
+# Uploads are pipelined, with this many smaller chunks in flight at once so the
+# link is kept busy while the next chunk is read from disk.
+_FS_PIPE_CHUNK_SIZE = 1024 * 1024
+_FS_PIPE_WINDOW = 4
+
+# Register reads and writes are packed with a single Struct for the whole request,
+# compiled the first time each format and length is seen.
+_reg_structs = {}
+
+def _reg_struct(fmt, n):
+	try:
+		return _reg_structs[fmt, n]
+	except KeyError:
+		st = _reg_structs[fmt, n] = struct.Struct('<' + fmt * n)
+		return st
+
+class _MokuProtocol(object):
+	# Wire format of the Moku control protocol. Each operation is split in to building the
+	# request packet and parsing the reply, so the same encoding is shared by the blocking
+	# Moku class and the asyncio client in pymoku.aio; they only differ in how the packets
+	# are carried.
+	def _get_seq(self):
+		self._seq = (self._seq + 1) % 256
+		return self._seq
+
+	def _pkt_read_regs(self, commands):
+		packet_data = bytearray([0x47, 0x00, len(commands)])
+		packet_data += _reg_struct('B', len(commands)).pack(*commands)
+		return packet_data
+
+	def _parse_read_regs(self, ack, commands):
+		t, err, l = struct.unpack('<BBB', ack[:3])
+
+		if t != 0x47 or l != len(commands) or err:
+			raise NetworkError()
+
+		vals = _reg_struct('BI', l).unpack_from(ack, 3)
+		return list(zip(vals[0::2], vals[1::2]))
+
+	def _pkt_write_regs(self, commands):
+		packet_data = bytearray([0x47, 0x00, len(commands)])
+		packet_data += _reg_struct('BI', len(commands)).pack(*[ v for r, d in commands for v in (r + 0x80, d) ])
+		return packet_data
+
+	def _parse_write_regs(self, ack):
+		t, err, l = struct.unpack('<BBB', ack[:3])
+
+		if t != 0x47 or err or l:
+			raise NetworkError()
+
+	def _pkt_deploy(self, instr_id):
+		return bytearray([0x43, instr_id, 0x00])
+
+	def _parse_deploy(self, ack):
+		t, err = struct.unpack('<BB', ack[:2])
+
+		if t != 0x43 or err:
+			raise DeployException("Deploy Error %d" % err)
+
+		# Return bitstream version
+		return struct.unpack("<H", ack[3:5])[0]
+
+	def _pkt_get_properties(self, properties):
+		if len(properties) > 255:
+			raise InvalidOperationException("Properties request too long (%d)" % len(properties))
+		pkt = bytearray([0x46, self._get_seq(), len(properties)])
+
+		for p in properties:
+			pkt += bytearray([1, len(p)]) # Read action
+			pkt += p.encode('ascii')
+			pkt += bytearray([0]) # No data for reads
+
+		return pkt
+
+	def _pkt_get_property_section(self, section):
+		pkt = struct.pack("<BBBBB", 0x46, self._get_seq(), 1, 3, len(section))
+		pkt += section.encode('ascii')
+		pkt += bytearray([0]) # No data for reads
+		return pkt
+
+	def _pkt_set_properties(self, properties):
+		if len(properties) > 255:
+			raise InvalidOperationException("Properties request too long (%d)" % len(properties))
+		pkt = struct.pack("<BBB", 0x46, self._get_seq(), len(properties))
+
+		for p, d in properties:
+			pkt += bytearray([2, len(p)])
+			pkt += p.encode('ascii')
+			pkt += bytearray([len(d)])
+			pkt += d.encode('ascii')
+
+		return pkt
+
+	def _parse_properties(self, reply, expect_seq):
+		# Reads and writes have the same reply, writes have the new value echoed back
+		ret = []
+
+		hdr, seq, stat, nr = struct.unpack("<BBBB", reply[:4])
+		reply = reply[4:]
+
+		if hdr != 0x46 or seq != expect_seq:
+			raise NetworkError("Bad header %d or sequence %d/%d" %(hdr, seq, expect_seq))
+
+		p, d = '', ''
+		for n in range(nr):
+			plen = ord(reply[:1]); reply = reply[1:]
+			p = reply[:plen].decode('ascii'); reply = reply[plen:]
+			dlen = ord(reply[:1]); reply = reply[1:]
+			d = reply[:dlen].decode('ascii'); reply = reply[dlen:]
+
+			if stat == 0:
+				ret.append((p, d))
+			else:
+				break
+
+		# Reply should just contain the \r\n by this time.
+
+		if stat:
+			# An error will have exactly one property reply, the property that caused
+			# the error with empty data
+			raise InvalidOperationException("Property Read Error, status %d on property %s" % (stat, p))
+
+		return ret
+
+	def _pkt_stream_prep(self, ch1, ch2, start, end, timestep, tag, binstr, procstr, fmtstr, hdrstr, fname, ftype='csv', use_sd=True):
+		mp = 'e' if use_sd else 'i'
+
+		if start < 0 or end < start:
+			raise ValueOutOfRangeException("Invalid start/end times: %s/%s" %(str(start), str(end)))
+
+		try:
+			ftype = { 'bin' : 0, 'csv' : 1, 'net' : 3, 'plot' : 4 }[ftype]
+		except KeyError:
+			raise ValueOutOfRangeException("Invalid file type %s" % ftype)
+
+		# TODO: Support multiple file types simultaneously
+		flags = 1 << (2 + ftype)
+		flags |= int(ch2) << 1
+		flags |= int(ch1)
+
+		pkt = struct.pack("<BBB", 0x53, self._get_seq(), 1)
+		pkt += tag.encode('ascii')
+		pkt += mp.encode('ascii')
+		pkt += struct.pack("<IIBd", start, end, flags, timestep)
+		pkt += struct.pack("<H", len(fname))
+		pkt += fname.encode('ascii')
+		pkt += struct.pack("<H", len(binstr))
+		pkt += binstr.encode('ascii')
+
+		# Build up a single procstring with "|" as a delimiter
+		# TODO: Allow empty procstrings
+		procstr_pkt = ''
+		for i,ch in enumerate([ch1,ch2]):
+			if ch:
+				if len(procstr_pkt):
+					procstr_pkt += '|'
+				procstr_pkt += procstr[i]
+
+		pkt += struct.pack("<H", len(procstr_pkt))
+		pkt += procstr_pkt.encode('ascii')
+
+		pkt += struct.pack("<H", len(fmtstr))
+		pkt += fmtstr.encode('ascii')
+		pkt += struct.pack("<H", len(hdrstr))
+		pkt += hdrstr.encode('ascii')
+
+		return pkt
+
+	def _parse_stream_prep(self, reply):
+		hdr, seq, ae, stat = struct.unpack("<BBBB", reply[:4])
+
+		if stat not in [ 1, 2 ]:
+			raise StreamException("Stream start exception %d" % stat)
+
+	def _pkt_stream_start(self):
+		return struct.pack("<BBB", 0x53, self._get_seq(), 4)
+
+	def _parse_stream_start(self, reply):
+		hdr, seq, ae, stat = struct.unpack("<BBBB", reply[:4])
+
+		return stat
+
+	def _pkt_stream_stop(self):
+		return struct.pack("<BBB", 0x53, self._get_seq(), 2)
+
+	def _parse_stream_stop(self, reply):
+		hdr, seq, ae, stat, bt = struct.unpack("<BBBBQ", reply[:12])
+
+		return stat
+
+	def _pkt_stream_status(self):
+		return struct.pack("<BBB", 0x53, self._get_seq(), 3)
+
+	def _parse_stream_status(self, reply):
+		hdr, seq, ae, stat, bt, trems, treme, flags, fname_len = struct.unpack("<BBBBQiiBH", reply[:23])
+		fname = reply[23:23 + fname_len].decode('ascii')
+		return stat, bt, trems, treme, fname
+
+	def _fs_packet(self, action, data):
+		pkt = struct.pack("<BQB", 0x49, len(data) + 1, action)
+		pkt += data
+		return pkt
+
+	def _fs_parse_reply(self, reply):
+		hdr, l = struct.unpack("<BQ", reply[:9])
+		pkt = reply[9:]
+
+		if l != len(pkt):
+			raise NetworkError("Unexpected file reply length %d/%d" % (l, len(pkt)))
+
+		act, status = struct.unpack("BB", pkt[:2])
+
+		if status:
+			raise NetworkError("File receive error %d" % status)
+
+		return pkt[2:]
+
+	def _fs_pkt_name(self, action, mp, fname, extra=b''):
+		fname = mp + ":" + fname
+
+		pkt = bytearray([len(fname)])
+		pkt += fname.encode('ascii')
+		pkt += extra
+
+		return self._fs_packet(action, pkt)
+
+	def _fs_pkt_list(self, mp, calculate_checksums=False):
+		flags = 1 if calculate_checksums else 0
+
+		data = mp.encode('ascii')
+		data += bytearray([flags])
+		return self._fs_packet(5, data)
+
+	def _fs_parse_list(self, reply):
+		reply = self._fs_parse_reply(reply)
+
+		n = struct.unpack("<H", reply[:2])[0]
+		reply = reply[2:]
+
+		names = []
+
+		for i in range(n):
+			chk, bl, fl = struct.unpack("<IQB", reply[:13])
+			names.append((reply[13 : fl + 13].decode('ascii'), chk, bl))
+
+			reply = reply[fl + 13 :]
+
+		return names
+
+	def _pkt_fwload(self):
+		return bytearray([0x52, 0x01])
+
+	def _parse_fwload(self, reply):
+		hdr, reply = struct.unpack("<BB", reply)
+
+		if reply:
+			raise InvalidOperationException("Firmware update failure %d", reply)
+
+
+class _Download(object):
+	# State of one file being downloaded by Moku._download_files. Data goes in to a file
+	# preallocated to the full size, localname + '.part', and the amount completed is
+	# recorded alongside in localname + '.resume' so an interrupted download can pick up
+	# where it left off. The CRC32 is accumulated as data arrives and, if known, checked
+	# before the file is moved in to place.
+	def __init__(self, mp, fname, localname, size, crc=None, resume=True):
+		self.mp = mp
+		self.fname = fname
+		self.localname = localname
+		self.size = size
+		self.crc = crc
+		self.resume = resume
+
+		self.partname = localname + '.part'
+		self.resumename = localname + '.resume'
+		self.file = None
+		self.chk = 0
+
+	def matches_local(self):
+		# True if the local file is already a complete copy
+		if self.crc is None or not os.path.exists(self.localname) or os.path.getsize(self.localname) != self.size:
+			return False
+
+		chk = 0
+		with open(self.localname, 'rb') as f:
+			for d in iter(lambda: f.read(_FS_CHUNK_SIZE), b''):
+				chk = zlib.crc32(d, chk)
+
+		return chk & 0xffffffff == self.crc
+
+	def open(self):
+		# Prepare the local file, returning the offsets of the chunks still required
+		start = 0
+		if self.resume and os.path.exists(self.partname) and os.path.getsize(self.partname) == self.size:
+			try:
+				with open(self.resumename, 'rb') as f:
+					start = min(struct.unpack("<Q", f.read(8))[0], self.size)
+			except (IOError, OSError, struct.error):
+				start = 0
+
+		if not start:
+			with open(self.partname, 'wb') as f:
+				f.truncate(self.size)
+
+		self.file = open(self.partname, 'r+b')
+
+		# Checksum what we already have, the rest is added as it arrives
+		self.chk = 0
+		while self.file.tell() < start:
+			self.chk = zlib.crc32(self.file.read(min(start - self.file.tell(), _FS_CHUNK_SIZE)), self.chk)
+
+		return range(start, self.size, _FS_PIPE_CHUNK_SIZE)
+
+	def write(self, off, data):
+		# Chunks must arrive in order for the checksum and resume point to be valid
+		self.file.seek(off)
+		self.file.write(data)
+		self.file.flush()
+		self.chk = zlib.crc32(data, self.chk)
+
+		with open(self.resumename, 'wb') as r:
+			r.write(struct.pack("<Q", off + len(data)))
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def finish(self):
+		self.close()
+
+		if self.crc is not None and self.crc != self.chk & 0xffffffff:
+			for n in [self.partname, self.resumename]:
+				if os.path.exists(n):
+					os.remove(n)
+			raise NetworkError("Download of %s failed checksum verification" % self.fname)
+
+		if os.path.exists(self.resumename):
+			os.remove(self.resumename)
+
+		if os.path.exists(self.localname):
+			os.remove(self.localname)
+
+		os.rename(self.partname, self.localname)
+
+class _ReqConnection(object):
+	# Control connection on a REQ socket. Only one request may be outstanding, so the send
+	# is deferred until the reply is wanted and requests from different threads take turns.
+	def __init__(self, ctx, addr):
+		self._skt = ctx.socket(zmq.REQ)
+		self._skt.setsockopt(zmq.LINGER, 5000)
+		self._skt.connect(addr)
+		self._lock = threading.Lock()
+
+	def set_timeout(self, send, recv):
+		self._skt.setsockopt(zmq.SNDTIMEO, send)
+		self._skt.setsockopt(zmq.RCVTIMEO, recv)
+
+	def request(self, pkt):
+		return pkt
+
+	def reply(self, req):
+		with self._lock:
+			self._skt.send(req)
+			return self._skt.recv()
+
+	def abandon(self, req):
+		pass
+
+	def close(self):
+		self._skt.close()
+
+
+class _Request(object):
+	__slots__ = ['type', 'seq', 'timeout', 'reply', 'abandoned', 'lost']
+
+	def __init__(self, pkt, timeout):
+		self.type, self.seq = bytearray(pkt[:2])
+		self.timeout = timeout
+		self.reply = None
+		self.abandoned = False
+		self.lost = False
+
+
+class _MuxConnection(object):
+	# Control connection on a DEALER socket, allowing any number of requests to be in flight
+	# from any thread. Replies are matched to requests by message type and, for messages that
+	# carry one, the sequence byte. Others are matched to the oldest outstanding request of
+	# the same type; the device answers in order so this is always the right one.
+	#
+	# That only holds while every outstanding request is still going to be answered, so when
+	# one times out the socket is replaced and everything else in flight on it fails too.
+	#
+	# The socket is only touched with the lock held. Whichever thread is waiting receives
+	# for everyone, polling in short slices so other threads can get a send in.
+	_SEQUENCED = [0x46, 0x53]
+	_POLL_SLICE = 10
+
+	def __init__(self, ctx, addr):
+		self._ctx = ctx
+		self._addr = addr
+		self._lock = threading.Lock()
+		self._waiting = collections.defaultdict(collections.deque)
+		self._send_timeout = -1
+		self._recv_timeout = 10000
+		self._connect()
+
+	def _connect(self):
+		self._skt = self._ctx.socket(zmq.DEALER)
+		self._skt.setsockopt(zmq.LINGER, 5000)
+		self._skt.setsockopt(zmq.SNDTIMEO, self._send_timeout)
+		self._skt.connect(self._addr)
+
+	def _reset(self):
+		# Late replies on the old socket can no longer be told apart, so drop it along with
+		# every request still waiting on it.
+		self._skt.close(linger=0)
+
+		for waiting in self._waiting.values():
+			for req in waiting:
+				req.lost = True
+
+		self._waiting.clear()
+		self._connect()
+
+	def set_timeout(self, send, recv):
+		self._send_timeout = send
+		self._skt.setsockopt(zmq.SNDTIMEO, send)
+		self._recv_timeout = recv
+
+	def request(self, pkt):
+		req = _Request(pkt, self._recv_timeout)
+
+		with self._lock:
+			# Empty delimiter frame in place of the one a REQ socket would add
+			self._skt.send_multipart([b'', pkt])
+			self._waiting[req.type].append(req)
+
+		return req
+
+	def reply(self, req):
+		deadline = time.time() + req.timeout / 1000.0
+
+		while True:
+			with self._lock:
+				if req.reply is not None:
+					return req.reply
+
+				if req.lost:
+					raise NetworkError("Connection reset while waiting for reply to request type 0x%02x" % req.type)
+
+				remaining = deadline - time.time()
+
+				if remaining <= 0:
+					self._reset()
+					raise NetworkError("Timed out waiting for reply to request type 0x%02x" % req.type)
+
+				if self._skt.poll(min(remaining * 1000, self._POLL_SLICE), zmq.POLLIN):
+					self._dispatch(self._skt.recv_multipart()[-1])
+
+	def abandon(self, req):
+		# The reply to this request is no longer wanted and will be dropped when it arrives
+		with self._lock:
+			req.abandoned = True
+
+	def _dispatch(self, reply):
+		t, seq = bytearray(reply[:2])
+		waiting = self._waiting.get(t)
+
+		if not waiting:
+			log.warning("Dropping unexpected reply of type 0x%02x", t)
+			return
+
+		if t in self._SEQUENCED:
+			for req in waiting:
+				if req.seq == seq:
+					break
+			else:
+				log.warning("Dropping reply of type 0x%02x with unknown sequence %d", t, seq)
+				return
+		else:
+			req = waiting[0]
+
+		waiting.remove(req)
+
+		if not req.abandoned:
+			req.reply = reply
+
+	def close(self):
+		self._skt.close()
+
+
+
+class Moku(_MokuProtocol):
 	"""
 	Core class representing a connection to a physical Moku:Lab unit.
 
@@ -35,20 +529,24 @@ class Moku(object):
 	"""
 	PORT = 27184
 
-	def __init__(self, ip_addr):
+	def __init__(self, ip_addr, multiplex=False):
 		"""Create a connection to the Moku:Lab unit at the given IP address
 
 		:type ip_addr: string
-		:param ip_addr: The address to connect to. This should be in IPv4 dotted notation."""
+		:param ip_addr: The address to connect to. This should be in IPv4 dotted notation.
+		:type multiplex: bool
+		:param multiplex: Allow several requests to be in flight at once, so for example data logger
+			status can be polled from one thread while a file operation is in progress in another.
+			By default requests are carried strictly one at a time."""
 		self._ip = ip_addr
 		self._seq = 0
 		self._instrument = None
 		self._known_mokus = []
+		self._fs_generic = collections.deque()
 
 		self._ctx = zmq.Context()
-		self._conn = self._ctx.socket(zmq.REQ)
-		self._conn.setsockopt(zmq.LINGER, 5000)
-		self._conn.connect("tcp://%s:%d" % (self._ip, Moku.PORT))
+		conn = _MuxConnection if multiplex else _ReqConnection
+		self._conn = conn(self._ctx, "tcp://%s:%d" % (self._ip, Moku.PORT))
 
 		self._set_timeout()
 
@@ -124,7 +622,7 @@ class Moku(object):
 			try:
 				m = Moku(ip)
 				ser = m.get_serial()
-			except zmq.error.Again:
+			except (zmq.error.Again, NetworkError):
 				return False
 			finally:
 				if m is not None:
@@ -154,7 +652,7 @@ class Moku(object):
 			try:
 				m = Moku(ip)
 				n = m.get_name()
-			except zmq.error.Again:
+			except (zmq.error.Again, NetworkError):
 				return False
 			finally:
 				if m is not None:
@@ -175,41 +673,34 @@ class Moku(object):
 		if not short:
 			base *= 2
 
-		self._conn.setsockopt(zmq.SNDTIMEO, base) # A send should always be quick
-		self._conn.setsockopt(zmq.RCVTIMEO, 2 * base) # A receive might need to wait on processing
-
+		# A send should always be quick, a receive might need to wait on processing
+		self._conn.set_timeout(base, 2 * base)
 
-	def _get_seq(self):
-		self._seq = (self._seq + 1) % 256
-		return self._seq
-
-	def _read_regs(self, commands):
-		packet_data = bytearray([0x47, 0x00, len(commands)])
-		packet_data += b''.join([struct.pack('<B', x) for x in commands])
 
-		self._conn.send(packet_data)
-		ack = self._conn.recv()
+	def _transact(self, pkt):
+		req = self._conn.request(pkt)
 
-		t, err, l = struct.unpack('<BBB', ack[:3])
+		try:
+			return self._conn.reply(req)
+		finally:
+			self._conn.abandon(req)
 
-		if t != 0x47 or l != len(commands) or err:
-			raise NetworkError()
+	def _pipeline(self, pkts):
+		# Send all the requests before waiting on any of them, returning the replies in order.
+		# The device still carries them out one after the other.
+		reqs = [ self._conn.request(pkt) for pkt in pkts ]
 
-		return [struct.unpack('<BI', ack[x:x + 5]) for x in range(3, len(commands) * 5, 5)]
+		try:
+			return [ self._conn.reply(req) for req in reqs ]
+		finally:
+			for req in reqs:
+				self._conn.abandon(req)
 
+	def _read_regs(self, commands):
+		return self._parse_read_regs(self._transact(self._pkt_read_regs(commands)), commands)
 
 	def _write_regs(self, commands):
-		packet_data = bytearray([0x47, 0x00, len(commands)])
-		packet_data += b''.join([struct.pack('<BI', x[0] + 0x80, x[1]) for x in commands])
-
-		self._conn.send(packet_data)
-		ack = self._conn.recv()
-
-		t, err, l = struct.unpack('<BBB', ack[:3])
-
-		if t != 0x47 or err or l:
-			raise NetworkError()
-
+		self._parse_write_regs(self._transact(self._pkt_write_regs(commands)))
 
 	def _deploy(self):
 		if self._instrument is None:
@@ -219,139 +710,30 @@ class Moku(object):
 		# seconds on the device. Set an appropriately long timeout for this case.
 		self._set_timeout(short=False)
 
-		self._conn.send(bytearray([0x43, self._instrument.id, 0x00]))
-		ack = self._conn.recv()
-
-		self._set_timeout(short=True)
-
-		t, err = struct.unpack('<BB', ack[:2])
-
-		if t != 0x43 or err:
-			raise DeployException("Deploy Error %d" % err)
+		try:
+			bsv = self._parse_deploy(self._transact(self._pkt_deploy(self._instrument.id)))
+		finally:
+			self._set_timeout(short=True)
 
 		self._set_property_single('ipad.name', socket.gethostname())
 
-		# Return bitstream version
-		return struct.unpack("<H", ack[3:5])[0]
+		return bsv
 
 	def _get_properties(self, properties):
-		ret = []
-
-		if len(properties) > 255:
-			raise InvalidOperationException("Properties request too long (%d)" % len(properties))
-		pkt = bytearray([0x46, self._get_seq(), len(properties)])
-
-		for p in properties:
-			pkt += bytearray([1, len(p)]) # Read action
-			pkt += p.encode('ascii')
-			pkt += bytearray([0]) # No data for reads
-
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-
-		hdr, seq, stat, nr = struct.unpack("<BBBB", reply[:4])
-		reply = reply[4:]
-
-		if hdr != 0x46 or seq != self._seq:
-			raise NetworkError("Bad header %d or sequence %d/%d" %(hdr, seq, self._seq))
-
-		p, d = '', ''
-		for n in range(nr):
-			plen = ord(reply[:1]); reply = reply[1:]
-			p = reply[:plen].decode('ascii'); reply = reply[plen:]
-			dlen = ord(reply[:1]); reply = reply[1:]
-			d = reply[:dlen].decode('ascii'); reply = reply[dlen:]
-
-			if stat == 0:
-				ret.append((p, d))
-			else:
-				break
-
-		# Reply should just contain the \r\n by this time.
-
-		if stat:
-			# An error will have exactly one property reply, the property that caused
-			# the error with empty data
-			raise InvalidOperationException("Property Read Error, status %d on property %s" % (stat, p))
-
-		return ret
+		pkt = self._pkt_get_properties(properties)
+		return self._parse_properties(self._transact(pkt), pkt[1])
 
 	def _get_property_section(self, section):
-		ret = []
-
-		pkt = struct.pack("<BBBBB", 0x46, self._get_seq(), 1, 3, len(section))
-		pkt += section.encode('ascii')
-		pkt += bytearray([0]) # No data for reads
-
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-		hdr, seq, stat, nr = struct.unpack("<BBBB", reply[:4])
-		reply = reply[4:]
-
-		if hdr != 0x46 or seq != self._seq:
-			raise NetworkError("Bad header %d or sequence %d/%d" %(hdr, seq, self._seq))
-
-		p, d = '',''
-		for n in range(nr):
-			plen = ord(reply[:1]); reply = reply[1:]
-			p = reply[:plen].decode('ascii'); reply = reply[plen:]
-			dlen = ord(reply[:1]); reply = reply[1:]
-			d = reply[:dlen].decode('ascii'); reply = reply[dlen:]
-
-			if stat == 0:
-				ret.append((p, d))
-			else:
-				break
-
-		if stat:
-			# An error will have exactly one property reply, the property that caused
-			# the error with empty data
-			raise InvalidOperationException("Property Read Error, status %d on property %s" % (stat, p))
-
-		return ret
+		pkt = self._pkt_get_property_section(section)
+		return self._parse_properties(self._transact(pkt), pkt[1])
 
 	def _get_property_single(self, prop):
 		r = self._get_properties([prop])
 		return r[0][1]
 
 	def _set_properties(self, properties):
-		ret = []
-		if len(properties) > 255:
-			raise InvalidOperationException("Properties request too long (%d)" % len(properties))
-		pkt = struct.pack("<BBB", 0x46, self._get_seq(), len(properties))
-
-		for p, d in properties:
-			pkt += bytearray([2, len(p)])
-			pkt += p.encode('ascii')
-			pkt += bytearray([len(d)])
-			pkt += d.encode('ascii')
-
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-		hdr, seq, stat, nr = struct.unpack("<BBBB", reply[:4])
-		reply = reply[4:]
-
-		if hdr != 0x46 or seq != self._seq:
-			raise NetworkError("Bad header %d or sequence %d/%d" %(hdr, seq, self._seq))
-
-		for n in range(nr):
-			plen = ord(reply[:1]); reply = reply[1:]
-			p = reply[:plen].decode('ascii'); reply = reply[plen:]
-			dlen = ord(reply[:1]); reply = reply[1:]
-			d = reply[:dlen].decode('ascii'); reply = reply[dlen:]
-
-			if stat == 0:
-				# Writes have the new value echoed back
-				ret.append((p, d))
-			else:
-				break
-
-		if stat:
-			# An error will have exactly one property reply, the property that caused
-			# the error with empty data
-			raise InvalidOperationException("Property Read Error, status %d on property %s" % (stat, p))
-
-		return ret
+		pkt = self._pkt_set_properties(properties)
+		return self._parse_properties(self._transact(pkt), pkt[1])
 
 	def _set_property_single(self, prop, val):
 		r = self._set_properties([(prop, val)])
@@ -359,227 +741,220 @@ class Moku(object):
 
 
 	def _stream_prep(self, ch1, ch2, start, end, timestep, tag, binstr, procstr, fmtstr, hdrstr, fname, ftype='csv', use_sd=True):
-		mp = 'e' if use_sd else 'i'
-
-		if start < 0 or end < start:
-			raise ValueOutOfRangeException("Invalid start/end times: %s/%s" %(str(start), str(end)))
-
-		try:
-			ftype = { 'bin' : 0, 'csv' : 1, 'net' : 3, 'plot' : 4 }[ftype]
-		except KeyError:
-			raise ValueOutOfRangeException("Invalid file type %s" % ftype)
-
-		# TODO: Support multiple file types simultaneously
-		flags = 1 << (2 + ftype)
-		flags |= int(ch2) << 1
-		flags |= int(ch1)
-
-		pkt = struct.pack("<BBB", 0x53, 0, 1) #TODO: Proper sequence number
-		pkt += tag.encode('ascii')
-		pkt += mp.encode('ascii')
-		pkt += struct.pack("<IIBd", start, end, flags, timestep)
-		pkt += struct.pack("<H", len(fname))
-		pkt += fname.encode('ascii')
-		pkt += struct.pack("<H", len(binstr))
-		pkt += binstr.encode('ascii')
-
-		# Build up a single procstring with "|" as a delimiter
-		# TODO: Allow empty procstrings
-		procstr_pkt = ''
-		for i,ch in enumerate([ch1,ch2]):
-			if ch:
-				if len(procstr_pkt):
-					procstr_pkt += '|'
-				procstr_pkt += procstr[i]
-
-		pkt += struct.pack("<H", len(procstr_pkt))
-		pkt += procstr_pkt.encode('ascii')
-
-		pkt += struct.pack("<H", len(fmtstr))
-		pkt += fmtstr.encode('ascii')
-		pkt += struct.pack("<H", len(hdrstr))
-		pkt += hdrstr.encode('ascii')
-
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-
-		hdr, seq, ae, stat = struct.unpack("<BBBB", reply[:4])
-
-		if stat not in [ 1, 2 ]:
-			raise StreamException("Stream start exception %d" % stat)
+		pkt = self._pkt_stream_prep(ch1, ch2, start, end, timestep, tag, binstr, procstr, fmtstr, hdrstr, fname, ftype, use_sd)
+		self._parse_stream_prep(self._transact(pkt))
 
 	def _stream_start(self):
-		pkt = struct.pack("<BBB", 0x53, 0, 4)
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-
-		hdr, seq, ae, stat = struct.unpack("<BBBB", reply[:4])
-
-		return stat		
+		return self._parse_stream_start(self._transact(self._pkt_stream_start()))
 
 	def _stream_stop(self):
-		pkt = struct.pack("<BBB", 0x53, 0, 2)
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-
-		hdr, seq, ae, stat, bt = struct.unpack("<BBBBQ", reply[:12])
-
-		return stat
+		return self._parse_stream_stop(self._transact(self._pkt_stream_stop()))
 
 	def _stream_status(self):
-		pkt = struct.pack("<BBB", 0x53, 0, 3)
-		self._conn.send(pkt)
-		reply = self._conn.recv()
-
-		hdr, seq, ae, stat, bt, trems, treme, flags, fname_len = struct.unpack("<BBBBQiiBH", reply[:23])
-		fname = reply[23:23 + fname_len].decode('ascii')
-		return stat, bt, trems, treme, fname
+		return self._parse_stream_status(self._transact(self._pkt_stream_status()))
 
 	def _fs_send_generic(self, action, data):
-		pkt = struct.pack("<BQB", 0x49, len(data) + 1, action)
-		pkt += data
-		self._conn.send(pkt)
+		self._fs_generic.append(self._conn.request(self._fs_packet(action, data)))
 
 	def _fs_receive_generic(self, action):
-		reply = self._conn.recv()
-		hdr, l = struct.unpack("<BQ", reply[:9])
-		pkt = reply[9:]
+		return self._fs_parse_reply(self._conn.reply(self._fs_generic.popleft()))
 
-		if l != len(pkt):
-			raise NetworkError("Unexpected file reply length %d/%d" % (l, len(pkt)))
 
-		act, status = struct.unpack("BB", pkt[:2])
-
-		if status:
-			raise NetworkError("File receive error %d" % status)
-
-		return pkt[2:]
+	def _send_file(self, mp, localname):
+		return self._upload_file(mp, localname)[0]
+
+	def _upload_file(self, mp, localname, window=_FS_PIPE_WINDOW):
+		# Upload a file with up to window chunks awaiting acknowledgement at once. This needs
+		# its own DEALER socket as the main REQ socket only allows one request outstanding;
+		# the device still replies to each request in order. The CRC32 is calculated as the
+		# file is sent so it can be verified without reading the file again.
+		#
+		# Returns the remote file name and the CRC.
+		remotename = os.path.basename(localname)
+		fname = (mp + ":" + remotename).encode('ascii')
 
+		skt = self._ctx.socket(zmq.DEALER)
+		skt.setsockopt(zmq.LINGER, 0)
+		skt.setsockopt(zmq.SNDTIMEO, 10000)
+		skt.setsockopt(zmq.RCVTIMEO, 20000)
+		skt.connect("tcp://%s:%d" % (self._ip, Moku.PORT))
 
-	def _send_file(self, mp, localname):
-		self._set_timeout(short=False)
+		crc = 0
 		i = 0
-		with open(localname, 'rb') as f:
-			while True:
-				data = f.read(_FS_CHUNK_SIZE)
-
-				if not len(data):
-					break
+		outstanding = 0
 
-				remotename = os.path.basename(localname)
+		try:
+			with open(localname, 'rb') as f:
+				while True:
+					data = f.read(_FS_PIPE_CHUNK_SIZE)
 
-				fname = mp + ":" + remotename
+					if len(data):
+						crc = zlib.crc32(data, crc)
 
-				pkt = bytearray([len(fname)])
-				pkt += fname.encode('ascii')
-				pkt += struct.pack("<QQ", i, len(data))
-				pkt += data
+						pkt = bytearray([len(fname)])
+						pkt += fname
+						pkt += struct.pack("<QQ", i, len(data))
+						pkt += data
 
-				self._fs_send_generic(2, pkt)
-				self._fs_receive_generic(2)
+						# Empty delimiter frame in place of the one a REQ socket would add
+						skt.send_multipart([b'', self._fs_packet(2, pkt)], copy=False)
+						outstanding += 1
+						i += len(data)
 
-				i += len(data)
+					elif not outstanding:
+						break
 
-		self._set_timeout(short=True)
+					# Wait for acks once the window is full, or drain them at the end
+					if outstanding >= window or not len(data):
+						self._fs_parse_reply(skt.recv_multipart()[-1])
+						outstanding -= 1
+		finally:
+			skt.close()
 
 		# Once all chunks have been uploaded, finalise the file on the
 		# device making it available for use
-		self._fs_finalise_fromlocal(mp, localname)
+		self._fs_finalise(mp, remotename, i)
 
-		return remotename
+		return remotename, crc & 0xffffffff
 
 	def _receive_file(self, mp, fname, l):
-		qfname = mp + ":" + fname
-		self._set_timeout(short=False)
-		print("Receiving file qfname %s" % qfname)
-		i = 0
-		with open(fname, "wb") as f:
-			if l == 0:
-				# A zero length file implies transfer the entire file
-				# So we get the the file size
-				l = self._fs_size(mp, fname)
-			while i < l:
-				to_transfer = min(l, _FS_CHUNK_SIZE)
-				pkt = bytearray([len(qfname)])
-				pkt += qfname.encode('ascii')
-				pkt += struct.pack("<QQ", i, to_transfer)
+		# A zero length implies transfer the entire file
+		return self._download_file(mp, fname, size=l or None, resume=False)
+
+	def _download_file(self, mp, fname, localname=None, size=None, crc=None, resume=True, progress=None, window=_FS_PIPE_WINDOW):
+		# Download a single file, see _download_files. progress, if given, is called with
+		# (bytes done, total bytes, bytes/sec).
+		if size is None:
+			size = self._fs_size(mp, fname)
+
+		dl = _Download(mp, fname, localname or fname, size, crc, resume)
+		cb = (lambda name, done, total, rate: progress(done, total, rate)) if progress else None
+
+		self._download_files([dl], progress=cb, window=window)
+
+		return dl.localname
+
+	def _download_files(self, downloads, progress=None, window=_FS_PIPE_WINDOW):
+		# Download a set of files (_Download objects) with up to window chunk requests in
+		# flight at once, on a DEALER socket as for _upload_file. The window spans file
+		# boundaries so the link stays busy while each file is finished off and the next one
+		# opened. Each file is only opened when its first chunk is requested and is closed as
+		# soon as it's complete, so only those in the window are open at once. Files already
+		# present locally with the right size and checksum are skipped, and the largest are
+		# fetched first so the small ones fill in at the end.
+		#
+		# progress, if given, is called after each chunk with (file name, bytes done, file
+		# size, aggregate bytes/sec). Returns a dict of transfer statistics.
+		stats = { 'files': 0, 'skipped': 0, 'bytes': 0, 'seconds': 0, 'rate': 0 }
+
+		todo = []
+		for dl in downloads:
+			if dl.matches_local():
+				log.debug("%s:%s is up to date, skipping", dl.mp, dl.fname)
+				stats['skipped'] += 1
+			else:
+				todo.append(dl)
 
-				self._fs_send_generic(1, pkt)
+		todo.sort(key=lambda dl: -dl.size)
 
-				reply = self._fs_receive_generic(1)
-				dl = struct.unpack("<Q", reply[:8])[0]
+		def _requests():
+			# All chunk requests, in order, with an end marker for each file
+			for dl in todo:
+				for off in dl.open():
+					yield dl, off, min(dl.size - off, _FS_PIPE_CHUNK_SIZE)
+				yield dl, None, 0
 
-				f.write(reply[8:])
+		requests = _requests()
+		requested = False
 
-				i += to_transfer
+		skt = self._ctx.socket(zmq.DEALER)
+		skt.setsockopt(zmq.LINGER, 0)
+		skt.setsockopt(zmq.SNDTIMEO, 10000)
+		skt.setsockopt(zmq.RCVTIMEO, 20000)
+		skt.connect("tcp://%s:%d" % (self._ip, Moku.PORT))
 
-		self._set_timeout(short=True)
+		pending = collections.deque()
+		t0 = time.time()
 
+		try:
+			while not requested or len(pending):
+				while not requested and len(pending) < window:
+					try:
+						dl, off, n = next(requests)
+					except StopIteration:
+						requested = True
+						break
+
+					if off is None:
+						# Everything for this file has been requested, finish it once its
+						# last chunk is in.
+						pending.append((dl, None, 0))
+						continue
+
+					qfname = (dl.mp + ":" + dl.fname).encode('ascii')
+					pkt = bytearray([len(qfname)])
+					pkt += qfname
+					pkt += struct.pack("<QQ", off, n)
+
+					skt.send_multipart([b'', self._fs_packet(1, pkt)])
+					pending.append((dl, off, n))
+
+				if not len(pending):
+					break
 
-	def _fs_chk(self, mp, fname):
-		fname = mp + ":" + fname
+				# Replies come back in the order they were requested
+				dl, off, n = pending.popleft()
 
-		pkt = bytearray([len(fname)])
-		pkt += fname.encode('ascii')
-		self._fs_send_generic(3, pkt)
+				if off is None:
+					dl.finish()
+					stats['files'] += 1
+					continue
 
-		return struct.unpack("<I", self._fs_receive_generic(3))[0]
+				reply = self._fs_parse_reply(skt.recv_multipart()[-1])
+				data = reply[8:]
 
-	def _fs_size(self, mp, fname):
-		fname = mp + ":" + fname
+				if len(data) != n:
+					raise NetworkError("Short read of %s at %d (%d/%d)" % (dl.fname, off, len(data), n))
 
-		pkt = bytearray([len(fname)])
-		pkt += fname.encode('ascii')
-		self._fs_send_generic(4, pkt)
+				dl.write(off, data)
+				stats['bytes'] += n
 
-		return struct.unpack("<Q", self._fs_receive_generic(4))[0]
+				if progress:
+					progress(dl.fname, off + n, dl.size, stats['bytes'] / max(time.time() - t0, 1e-9))
+		finally:
+			skt.close()
+			for dl in todo:
+				dl.close()
 
-	def _fs_list(self, mp, calculate_checksums=False):
-		flags = 1 if calculate_checksums else 0
+		stats['seconds'] = time.time() - t0
+		stats['rate'] = stats['bytes'] / 1e6 / max(stats['seconds'], 1e-9)
 
-		data = mp.encode('ascii')
-		data += bytearray([flags])
-		self._fs_send_generic(5, data)
-
-		reply = self._fs_receive_generic(5)
+		log.info("Downloaded %d files (%d skipped), %.1fMB at %.2fMB/s", stats['files'], stats['skipped'], stats['bytes'] / 1e6, stats['rate'])
 
-		n = struct.unpack("<H", reply[:2])[0]
-		reply = reply[2:]
+		return stats
 
-		names = []
+	def _fs_chk(self, mp, fname):
+		return struct.unpack("<I", self._fs_parse_reply(self._transact(self._fs_pkt_name(3, mp, fname))))[0]
 
-		for i in range(n):
-			chk, bl, fl = struct.unpack("<IQB", reply[:13])
-			names.append((reply[13 : fl + 13].decode('ascii'), chk, bl))
+	def _fs_size(self, mp, fname):
+		return struct.unpack("<Q", self._fs_parse_reply(self._transact(self._fs_pkt_name(4, mp, fname))))[0]
 
-			reply = reply[fl + 13 :]
+	def _fs_list(self, mp, calculate_checksums=False):
+		return self._fs_parse_list(self._transact(self._fs_pkt_list(mp, calculate_checksums)))
 
-		return names
+	def _fs_list_mounts(self, mps, calculate_checksums=False):
+		# Listings for several mount points, requested together so that checksumming on one
+		# isn't held up waiting for the round trip from another.
+		replies = self._pipeline([ self._fs_pkt_list(mp, calculate_checksums) for mp in mps ])
+		return [ self._fs_parse_list(r) for r in replies ]
 
 	def _fs_free(self, mp):
-		self._fs_send_generic(6, mp.encode('ascii'))
-
-		t, f = struct.unpack("<QQ", self._fs_receive_generic(6))
+		t, f = struct.unpack("<QQ", self._fs_parse_reply(self._transact(self._fs_packet(6, mp.encode('ascii')))))
 
 		return t, f
 
-
 	def _fs_finalise(self, mp, fname, fsize):
-		fname = mp + ":" + fname
-		pkt = bytearray([len(fname)])
-		pkt += fname.encode('ascii')
-		pkt += struct.pack('<Q', fsize)
-
-		self._fs_send_generic(7, pkt)
-
-		reply = self._fs_receive_generic(7)
-
-
-	def _fs_finalise_fromlocal(self, mp, localname):
-		fsize = os.path.getsize(localname)
-		remotename = os.path.basename(localname)
-
-		return self._fs_finalise(mp, remotename, fsize)
+		self._fs_parse_reply(self._transact(self._fs_pkt_name(7, mp, fname, struct.pack('<Q', fsize))))
 
 
 	def delete_bitstream(self, path):
@@ -600,26 +975,18 @@ class Moku(object):
 		self.load_persistent(path)
 
 	def load_persistent(self, path):
-		import zlib
 		log.debug("Loading bitstream %s", path)
-		rname = self._send_file('b', path)
+		rname, chk2 = self._upload_file('b', path)
 
 		log.debug("Verifying upload")
 
 		chk = self._fs_chk('b', rname)
 
-		with open(path, 'rb') as fp:
-			chk2 = zlib.crc32(fp.read()) & 0xffffffff
-
 		if chk != chk2:
 			raise NetworkError("Bitstream upload failed checksum verification.")
 
 	def _trigger_fwload(self):
-		self._conn.send(bytearray([0x52, 0x01]))
-		hdr, reply = struct.unpack("<BB", self._conn.recv())
-
-		if reply:
-			raise InvalidOperationException("Firmware update failure %d", reply)
+		self._parse_fwload(self._transact(self._pkt_fwload()))
 
 	def load_firmware(self, path):
 		"""
@@ -743,7 +1110,8 @@ class Moku(object):
 
 		running = instr()
 		running.attach_moku(self)
-		running.sync_registers()
+		# Only the registers that back the instrument's attributes mean anything to us
+		running.sync_registers(running._accessor_regs())
 		running.set_running(True)
 		self._instrument = running
 		return running
@@ -6,11 +6,12 @@ import select, socket, struct, sys
 import os, os.path
 import logging, time, threading
 import zmq
+import numpy as np
 
-from collections import deque
+from collections import deque, namedtuple, OrderedDict
 from queue import Queue, Empty
 
-from pymoku import Moku, FrameTimeout, NotDeployedException, InvalidOperationException, NoDataException, dataparser
+from pymoku import Moku, _Download, FrameTimeout, NotDeployedException, InvalidOperationException, NoDataException, dataparser
 
 from . import _instrument
 
@@ -25,6 +26,44 @@ DL_STATE_OVERFLOW	= 5
 DL_STATE_BUSY		= 6
 DL_STATE_STOPPED	= 7
 
+_DL_ERRORS = {
+	DL_STATE_INVAL		: "Invalid Parameters for Datalogger Operation",
+	DL_STATE_FSFULL		: "Target Filesystem Full",
+	DL_STATE_OVERFLOW	: "Session overflowed, sample rate too fast.",
+	DL_STATE_BUSY		: "Tried to start a logging session while one was already running.",
+}
+
+class DataloggerStatus(namedtuple('DataloggerStatus', ['state', 'logged', 'to_start', 'to_end', 'filename'])):
+	"""
+	Snapshot of the state of a data logging session, as returned by :any:`datalogger_status`.
+
+	This is a tuple of *(state, logged, to start, to end, filename)* so can be unpacked as before,
+	but the derived values are also available as attributes so one snapshot can answer all of
+	them with a single request to the Moku.
+	"""
+	__slots__ = ()
+
+	@property
+	def busy(self):
+		""" True if the datalogger isn't ready to start a new session """
+		return self.state != DL_STATE_NONE
+
+	@property
+	def completed(self):
+		""" True if the datalogger isn't expecting to log any more data """
+		return self.state not in [DL_STATE_RUNNING, DL_STATE_WAITING]
+
+	@property
+	def error(self):
+		""" String describing the current error, or *None* if the session is not in error """
+		return _DL_ERRORS.get(self.state)
+
+	@property
+	def remaining(self):
+		""" Seconds to/since session start and end """
+		return self.to_start, self.to_end
+
+
 class FrameQueue(Queue):
 	def put(self, item, block=True, timeout=None):
 		""" Behaves the same way as default except that instead of raising Full, it
@@ -69,6 +108,73 @@ class FrameQueue(Queue):
 		self.queue = deque(maxlen=maxsize)
 
 
+def _nan_to_none(a):
+	# NumPy frame data as a list, with invalid (NaN) samples as None as in list mode
+	return np.where(np.isnan(a), None, a).tolist()
+
+
+class ScaleCache(object):
+	"""
+	Scaling data used to render frames, one entry per instrument state.
+
+	Each entry is stored against a state ID along with a fingerprint of the configuration it was
+	calculated from. State IDs are only 8 bits so wrap quickly; reusing an ID for a different
+	configuration always replaces its entry, while committing an unchanged configuration reuses the
+	scales already calculated for it.
+
+	The Moku sends frames in state order, so once a frame from one state has been rendered no frames
+	from earlier states remain in flight and their entries are dropped. At most *maxlen* states are
+	kept regardless, so a long run of commits without frames can't grow the cache either.
+	"""
+	def __init__(self, maxlen=32):
+		self.maxlen = maxlen
+		self._states = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __contains__(self, stateid):
+		return stateid in self._states
+
+	def __getitem__(self, stateid):
+		return self._states[stateid][1]
+
+	def __len__(self):
+		return len(self._states)
+
+	def put(self, stateid, fingerprint, calculate):
+		""" Store the scales for a state, calling *calculate* to find them unless a state with the same
+		fingerprint is already held. Returns the scales. """
+		with self._lock:
+			scales = next((s for f, s in self._states.values() if f == fingerprint), None)
+
+		if scales is None:
+			scales = calculate()
+
+		with self._lock:
+			self._states.pop(stateid, None)
+			self._states[stateid] = (fingerprint, scales)
+
+			while len(self._states) > self.maxlen:
+				self._states.popitem(last=False)
+
+		return scales
+
+	def get(self, stateid):
+		""" Return the scales with which to render a frame from the given state, or *None* if they're
+		not known. Entries for all earlier states are dropped. """
+		with self._lock:
+			if stateid not in self._states:
+				return None
+
+			while next(iter(self._states)) != stateid:
+				self._states.popitem(last=False)
+
+			return self._states[stateid][1]
+
+	def clear(self):
+		with self._lock:
+			self._states.clear()
+
+
 class DataFrame(object):
 	"""
 	Superclass representing a full frame of some kind of data. This class is never used directly,
@@ -162,10 +268,42 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 
 		self._strparser = None
 
+		# Datalogger status is cached for a short time so that a monitoring loop asking several
+		# questions about it in a row only costs a single request.
+		self.datalogger_status_ttl = 0.1
+		self._dlstatus = None
+		self._dlstatus_time = 0
+		self._dlstatus_lock = threading.Lock()
+		self._dllisteners = []
+		self._dlpoll_worker = None
+		self._dlpoll_interval = 0
+		self._dlpoll_stop = threading.Event()
+
+	def _scales_fingerprint(self):
+		# Identifies the configuration that frame scales are calculated from: the registers as last
+		# committed, less the state ID itself. Instruments whose scales also depend on settings that
+		# aren't held in registers add those.
+		return tuple(self._remoteregs[:_instrument.REG_STATE] + self._remoteregs[_instrument.REG_STATE + 1:])
+
 	def set_frame_class(self, frame_class, **frame_kwargs):
 		self.frame_class = frame_class
 		self.frame_kwargs = frame_kwargs
 
+	def set_numpy_frames(self, enable=True):
+		""" Return frame data as NumPy arrays rather than lists.
+
+		Decoding a frame in to arrays is far quicker than building lists, which matters at high frame
+		rates. Invalid samples are NaN rather than *None*. Takes effect from the next frame.
+
+		:type enable: bool
+		:param enable: Use NumPy arrays
+
+		:raises InvalidOperationException: if this instrument doesn't produce data frames."""
+		if getattr(self, 'frame_class', None) is None:
+			raise InvalidOperationException("%s doesn't produce data frames" % type(self).__name__)
+
+		self.set_frame_class(self.frame_class, **dict(self.frame_kwargs, use_numpy=bool(enable)))
+
 	def flush(self):
 		""" Clear the Frame Buffer.
 		This is normally not required as one can simply wait for the correctly-generated frames to propagate through
@@ -291,7 +429,7 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 		# We have to be in this mode anyway because of the above check, but rewriting this register and committing
 		# is necessary in order to reset the channel buffers on the device and flush them of old data.
 		self.x_mode = _instrument.ROLL
-		self.commit()
+		self.commit(force=True)
 
 		self._moku._stream_prep(ch1=ch1, ch2=ch2, start=start, end=start + duration, timestep=self.timestep,
 			binstr=self.binstr, procstr=self.procstr, fmtstr=self.fmtstr, hdrstr=self.hdrstr,
@@ -301,6 +439,7 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 			self._dlsub_init(self.tag)
 
 		self._moku._stream_start()
+		self._dlstatus_time = 0
 
 	def datalogger_start_single(self, use_sd=True, ch1=True, ch2=False, filetype='csv'):
 		""" Grab all currently-recorded data at full rate.
@@ -350,20 +489,25 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 			self._dlsub_init(self.tag)
 
 		self._moku._stream_start()
+		self._dlstatus_time = 0
 
 	def datalogger_stop(self):
 		""" Stop a recording session previously started with :py:func:`datalogger_start`"""
 		if self._moku is None: raise NotDeployedException()
 		# TODO: Handle errors
 		self._moku._stream_stop()
+		self._dlstatus_time = 0
 
 		self._dlsub_destroy()
 
-	def datalogger_status(self):
+	def datalogger_status(self, max_age=None):
 		""" Return the status of the most recent recording session to be started.
 		This is still valid after the stream has stopped, in which case the status will reflect that it's safe
 		to start a new session.
 
+		The status is fetched from the Moku at most once every *datalogger_status_ttl* seconds (0.1 by
+		default), or less often if :any:`datalogger_poll_start` is keeping it up to date in the background.
+
 		Returns a tuple of state variables:
 
 		- **status** -- Current datalogger state
@@ -383,10 +527,78 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 		- **DL_STATE_BUSY** -- An attempt was made to start a session when one was already running
 		- **DL_STATE_STOPPED** -- A session has successfully completed.
 
-		:rtype: int, int, int, int
-		:return: status, logged, to start, to end."""
+		:type max_age: float
+		:param max_age: Oldest cached status, in seconds, that may be returned. Zero always asks the Moku.
+
+		:rtype: :any:`DataloggerStatus`
+		:return: status, logged, to start, to end, filename."""
 		if self._moku is None: raise NotDeployedException()
-		return self._moku._stream_status()
+
+		if max_age is None:
+			max_age = self.datalogger_status_ttl + self._dlpoll_interval
+
+		with self._dlstatus_lock:
+			if self._dlstatus is not None and time.time() - self._dlstatus_time <= max_age:
+				return self._dlstatus
+
+			prev, status = self._dlstatus, DataloggerStatus(*self._moku._stream_status())
+			self._dlstatus, self._dlstatus_time = status, time.time()
+
+		if prev is not None and prev.state != status.state:
+			log.debug("Datalogger state %d -> %d", prev.state, status.state)
+			for listener in list(self._dllisteners):
+				try:
+					listener(prev, status)
+				except Exception:
+					log.exception("Datalogger status listener")
+
+		return status
+
+	def datalogger_add_listener(self, listener):
+		""" Register a function to be called when the datalogger state changes.
+
+		The function is called with the previous and new :any:`DataloggerStatus`, for example when a
+		session goes from *DL_STATE_RUNNING* to *DL_STATE_OVERFLOW* or *DL_STATE_FSFULL*. Changes are
+		seen whenever the status is fetched, so use :any:`datalogger_poll_start` to be told promptly.
+		Listeners are called from whichever thread fetched the status."""
+		self._dllisteners.append(listener)
+
+	def datalogger_remove_listener(self, listener):
+		""" Stop calling a function previously registered with :any:`datalogger_add_listener`. """
+		self._dllisteners.remove(listener)
+
+	def datalogger_poll_start(self, interval=0.5):
+		""" Keep the datalogger status up to date in the background.
+
+		While polling, :any:`datalogger_status` and the functions built on it return the most recent
+		status without making a request of their own.
+
+		:type interval: float
+		:param interval: Seconds between status requests."""
+		if self._moku is None: raise NotDeployedException()
+		self.datalogger_poll_stop()
+
+		self._dlpoll_interval = interval
+		self._dlpoll_stop.clear()
+		self._dlpoll_worker = threading.Thread(target=self._dlpoll, args=(interval,))
+		self._dlpoll_worker.daemon = True
+		self._dlpoll_worker.start()
+
+	def datalogger_poll_stop(self):
+		""" Stop updating the datalogger status in the background. """
+		if self._dlpoll_worker is not None:
+			self._dlpoll_stop.set()
+			self._dlpoll_worker.join()
+			self._dlpoll_worker = None
+
+		self._dlpoll_interval = 0
+
+	def _dlpoll(self, interval):
+		while not self._dlpoll_stop.wait(interval):
+			try:
+				self.datalogger_status(max_age=0)
+			except Exception:
+				log.exception("Datalogger status poll")
 
 	def datalogger_remaining(self):
 		""" Returns number of seconds from session start and end.
@@ -396,15 +608,14 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 
 		:rtype: int, int
 		:return: to start, to end"""
-		d1, d2, start, end, fname = self.datalogger_status()
-		return start, end
+		return self.datalogger_status().remaining
 
 	def datalogger_samples(self):
 		""" Returns number of samples captures in this datalogging session.
 
 		:rtype: int
 		:returns: sample count"""
-		return self.datalogger_status()[1]
+		return self.datalogger_status().logged
 
 	def datalogger_busy(self):
 		""" Returns the readiness of the datalogger to start a new session.
@@ -415,7 +626,7 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 		If the datalogger is busy, the time remaining may be queried to see how long it might be
 		until it has finished what it's doing, or it can be forcibly stopped with a call to
 		:any:`datalogger_stop`."""
-		return self.datalogger_status()[0] != DL_STATE_NONE
+		return self.datalogger_status().busy
 
 	def datalogger_completed(self):
 		""" Returns whether or not the datalogger is expecting to log any more data.
@@ -423,87 +634,108 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 		If the log is completed then the results files are ready to be uploaded or simply
 		read off the SD card. At most one subsequent :any:`datalogger_get_samples` call
 		will return without timeout."""
-		return self.datalogger_status()[0] not in [DL_STATE_RUNNING, DL_STATE_WAITING]
+		return self.datalogger_status().completed
 
 	def datalogger_filename(self):
 		""" Returns the current base filename of the logging session.
 
 		The base filename doesn't include the file extension as multiple files might be
 		recorded simultaneously with different extensions."""
-		return str(self.datalogger_status()[4]).strip()
+		return str(self.datalogger_status().filename).strip()
 
 	def datalogger_error(self):
 		""" Returns a string representing the current error, or *None* if the session is not in error."""
-		code = self.datalogger_status()[0]
-
-		if code in [DL_STATE_NONE, DL_STATE_RUNNING, DL_STATE_WAITING, DL_STATE_STOPPED]:
-			return None
-		elif code == DL_STATE_INVAL:
-			return "Invalid Parameters for Datalogger Operation"
-		elif code == DL_STATE_FSFULL:
-			return "Target Filesystem Full"
-		elif code == DL_STATE_OVERFLOW:
-			return "Session overflowed, sample rate too fast."
-		elif code == DL_STATE_BUSY:
-			return "Tried to start a logging session while one was already running."
-
-	def datalogger_upload(self):
+		return self.datalogger_status().error
+
+	def datalogger_upload(self, progress=None):
 		""" Load most recently recorded data files from the Moku to the local PC.
 
-		:raises NotDeployedException: if the instrument is not yet operational.
-		:raises InvalidOperationException: if no files are present."""
-		import re
+		Downloads are verified against the Moku's checksum of each file. An interrupted download
+		is resumed from where it left off the next time this is called, and files that have
+		already been downloaded intact aren't transferred again.
+
+		:type progress: callable
+		:param progress: Called as each part of a file arrives with the file name, the number of
+			bytes downloaded so far, the file size and the overall transfer rate in bytes/second.
+
+		:rtype: dict
+		:return: Transfer statistics: the number of files downloaded (*files*) and already present
+			(*skipped*), the number of *bytes* transferred, the time taken in *seconds* and the
+			overall *rate* in MB/s.
 
+		:raises NotDeployedException: if the instrument is not yet operational.
+		:raises InvalidOperationException: if no files are present.
+		:raises NetworkError: if a download fails verification."""
 		if self._moku is None: raise NotDeployedException()
 
-		uploaded = 0
 		target = self.datalogger_filename()
-		# Check internal and external storage
-		for mp in ['i', 'e']:
-			for f in self._moku._fs_list(mp):
-				if str(f[0]).startswith(target):
-					# Don't overwrite existing files of the name name. This would be nicer
-					# if we could pass receive_file a local filename to save to, but until
-					# that change is made, just move the clashing file out of the way.
-					if os.path.exists(f[0]):
-						i = 1
-						while os.path.exists(f[0] + ("-%d" % i)):
-							i += 1
-
-						os.rename(f[0], f[0] + ("-%d" % i))
-
-					# Data length of zero uploads the whole file
-					self._moku._receive_file(mp, f[0], 0)
-					uploaded += 1
-
-		if not uploaded:
-			raise InvalidOperationException("Log files not present")
-		else:
-			log.debug("Uploaded %d files", uploaded)
 
-	def datalogger_upload_all(self):
+		files = self._datalogger_list(lambda f: str(f).startswith(target))
+		localnames = set([ dl.localname for dl in files ])
+
+		for dl in files:
+			# Don't overwrite existing files of the same name, move them out of the way of
+			# this download and any other in the set.
+			if os.path.exists(dl.localname) and not dl.matches_local():
+				i = 1
+				while os.path.exists(dl.localname + ("-%d" % i)) or dl.localname + ("-%d" % i) in localnames:
+					i += 1
+
+				os.rename(dl.localname, dl.localname + ("-%d" % i))
+
+		return self._datalogger_download(files, progress)
+
+	def datalogger_upload_all(self, progress=None):
 		""" Load all recorded data files from the Moku to the local PC.
 
+		All files are transferred in one session. Files that have already been downloaded intact
+		aren't transferred again.
+
+		:type progress: callable
+		:param progress: As for :any:`datalogger_upload`
+
+		:rtype: dict
+		:return: Transfer statistics, as for :any:`datalogger_upload`
+
 		:raises NotDeployedException: if the instrument is not yet operational.
-		:raises InvalidOperationException: if no files are present."""
+		:raises InvalidOperationException: if no files are present.
+		:raises NetworkError: if a download fails verification."""
 		import re
 
 		if self._moku is None: raise NotDeployedException()
 
-		uploaded = 0
+		files = self._datalogger_list(lambda f: re.match(r"datalog-.*\.[a-z]{2,3}", f))
+
+		return self._datalogger_download(files, progress)
+
+	def _datalogger_list(self, match):
+		# Downloads for the files on internal and external storage whose names match. A name
+		# that's on both is saved from external storage with the mount point added, so the two
+		# copies don't share a local (or partial) file.
+		files = []
+		localnames = set()
+		mps = ['i', 'e']
+		for mp, listing in zip(mps, self._moku._fs_list_mounts(mps, calculate_checksums=True)):
+			for fname, chk, size in listing:
+				if match(fname):
+					localname = fname
+					if localname in localnames:
+						base, ext = os.path.splitext(fname)
+						localname = "%s-%s%s" % (base, mp, ext)
 
-		for mp in ['e', 'i']:
-			files = self._moku._fs_list(mp)
-			for f in files:
-				if re.match("datalog-.*\.[a-z]{2,3}", f[0]):
-					# Data length of zero uploads the whole file
-					self._moku._receive_file(mp, f, 0)
-					uploaded += 1
+					localnames.add(localname)
+					files.append(_Download(mp, fname, localname, size, chk))
 
-		if not uploaded:
+		return files
+
+	def _datalogger_download(self, files, progress):
+		if not len(files):
 			raise InvalidOperationException("Log files not present")
-		else:
-			log.debug("Uploaded %d files", uploaded)
+
+		stats = self._moku._download_files(files, progress=progress)
+		log.debug("Uploaded %d files, %d already present (%.2fMB/s)", stats['files'], stats['skipped'], stats['rate'])
+
+		return stats
 
 	def datalogger_get_samples(self, timeout=None):
 		""" Returns samples currently being streamed to the network.
@@ -569,6 +801,7 @@ class FrameBasedInstrument(_instrument.MokuInstrument):
 			self._fr_worker.start()
 			self._hb_worker.start()
 		elif not state and prev_state:
+			self.datalogger_poll_stop()
 			self._fr_worker.join()
 			self._hb_worker.join()
 
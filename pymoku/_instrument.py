@@ -4,7 +4,7 @@ import threading, collections, time, struct, socket, logging
 from functools import partial
 from types import MethodType
 
-from pymoku import NotDeployedException, ValueOutOfRangeException
+from pymoku import MokuException, NotDeployedException, ValueOutOfRangeException
 
 REG_CTL 	= 0
 REG_STAT	= 1
@@ -89,49 +89,45 @@ def _upsgn(i, width):
 	return i - 2**width
 
 
-def to_reg_signed(_offset, _len, allow_set=None, allow_range=None, xform=lambda x: x):
-	""" Returns a callable that will pack a new signed data value in to a register.
-	Designed as shorthand for common use in instrument register accessor lists. Supports
-	single and compound registers (i.e. data values that span more than one register).
+def _to_reg(_offset, _len, allow_set, allow_range, xform, pack):
+	# Common to the signed and unsigned setters; everything that doesn't depend on the value is
+	# worked out here, once, rather than on every call.
+	mask = ((1 << _len) - 1) << _offset
 
-	:param _offset: Offset of data field in the register (set)
-	:param _len: Length of data field in the register (set)
-	:param allow_set: Set containing all valid values of the data field.
-	:param allow_range: a two-tuple specifying the bounds of the data value.
-	:param xform: a callable that translates the user value written to the attribute to the register value"""
-	# TODO: This signed and the below unsigned share all but one line of code, should consolidate
-	def __ss(val, old):
-		val = xform(val)
-		mask = ((1 << _len) - 1) << _offset
+	if allow_set and allow_range:
+		raise MokuException("Can't check against both ranges and sets")
 
-		if allow_set and allow_range:
-			raise MokuException("Can't check against both ranges and sets")
+	lo, hi = allow_range or (None, None)
+
+	def __s(val, old):
+		if xform is not None:
+			val = xform(val)
 
 		if allow_set and val not in allow_set:
 			return None
-		elif allow_range and (val < allow_range[0] or val > allow_range[1]):
+		elif allow_range and (val < lo or val > hi):
 			return None
 
-		v = _sgn(val, _len) << _offset
+		v = pack(val, _len) << _offset
 
-		try:
+		if not isinstance(old, (list, tuple)):
 			return (old & ~mask) | v
-		except TypeError:
-			r = []
-			for o in reversed(old):
-				r.insert(0, (o & ~mask) | v & 0xFFFFFFFF)
 
-				v = v >> 32
-				mask = mask >> 32
+		r = []
+		m = mask
+		for o in reversed(old):
+			r.insert(0, (o & ~m) | v & 0xFFFFFFFF)
 
-			return tuple(r)
+			v = v >> 32
+			m = m >> 32
 
+		return tuple(r)
 
-	return __ss
+	return __s
 
 
-def to_reg_unsigned(_offset, _len, allow_set=None, allow_range=None, xform=lambda x: x):
-	""" Returns a callable that will pack a new unsigned data value or bitfield in to a register.
+def to_reg_signed(_offset, _len, allow_set=None, allow_range=None, xform=None):
+	""" Returns a callable that will pack a new signed data value in to a register.
 	Designed as shorthand for common use in instrument register accessor lists. Supports
 	single and compound registers (i.e. data values that span more than one register).
 
@@ -140,34 +136,20 @@ def to_reg_unsigned(_offset, _len, allow_set=None, allow_range=None, xform=lambd
 	:param allow_set: Set containing all valid values of the data field.
 	:param allow_range: a two-tuple specifying the bounds of the data value.
 	:param xform: a callable that translates the user value written to the attribute to the register value"""
+	return _to_reg(_offset, _len, allow_set, allow_range, xform, _sgn)
 
-	def __us(val, old):
-		val = xform(val)
-		mask = ((1 << _len) - 1) << _offset
-
-		if allow_set and allow_range:
-			raise MokuException("Can't check against both ranges and sets")
-
-		if allow_set and val not in allow_set:
-			return None
-		elif allow_range and (val < allow_range[0] or val > allow_range[1]):
-			return None
 
-		v = _usgn(val, _len) << _offset
-
-		try:
-			return (old & ~mask) | v
-		except TypeError:
-			r = []
-			for o in reversed(old):
-				r.insert(0, (o & ~mask) | v & 0xFFFFFFFF)
-
-				v = v >> 32
-				mask = mask >> 32
-
-			return tuple(r)
+def to_reg_unsigned(_offset, _len, allow_set=None, allow_range=None, xform=None):
+	""" Returns a callable that will pack a new unsigned data value or bitfield in to a register.
+	Designed as shorthand for common use in instrument register accessor lists. Supports
+	single and compound registers (i.e. data values that span more than one register).
 
-	return __us
+	:param _offset: Offset of data field in the register (set)
+	:param _len: Length of data field in the register (set)
+	:param allow_set: Set containing all valid values of the data field.
+	:param allow_range: a two-tuple specifying the bounds of the data value.
+	:param xform: a callable that translates the user value written to the attribute to the register value"""
+	return _to_reg(_offset, _len, allow_set, allow_range, xform, _usgn)
 
 
 def to_reg_bool(_offset):
@@ -179,7 +161,7 @@ def to_reg_bool(_offset):
 	return to_reg_unsigned(_offset, 1, allow_set=[0,1], xform=int)
 
 
-def from_reg_signed(_offset, _len, xform=lambda x: x):
+def from_reg_signed(_offset, _len, xform=None):
 	""" Returns a callable that will unpack a signed data value from a register bitfield.
 	Designed as shorthand for common use in instrument register accessor lists. Supports
 	single and compound registers (i.e. data values that span more than one register).
@@ -191,20 +173,21 @@ def from_reg_signed(_offset, _len, xform=lambda x: x):
 	mask = ((1 << _len) - 1) << _offset
 
 	def __sg(reg):
-		try:
-			return xform(_upsgn((reg & mask) >> _offset, _len))
-		except TypeError:
+		if isinstance(reg, (list, tuple)):
 			v = 0
 			for r in reg:
 				v |= r
 				v <<= 32
+		else:
+			v = reg
 
-			return xform(_upsgn((v & mask) >> _offset, _len))
+		v = _upsgn((v & mask) >> _offset, _len)
+		return v if xform is None else xform(v)
 
 	return __sg
 
 
-def from_reg_unsigned(_offset, _len, xform=lambda x: x):
+def from_reg_unsigned(_offset, _len, xform=None):
 	""" Returns a callable that will unpack an unsigned data value from a register bitfield.
 	Designed as shorthand for common use in instrument register accessor lists. Supports
 	single and compound registers (i.e. data values that span more than one register).
@@ -215,15 +198,16 @@ def from_reg_unsigned(_offset, _len, xform=lambda x: x):
 	mask = ((1 << _len) - 1) << _offset
 
 	def __ug(reg):
-		try:
-			return xform((reg & mask) >> _offset)
-		except TypeError:
+		if isinstance(reg, (list, tuple)):
 			v = 0
 			for r in reg:
 				v <<= 32
 				v |= r
+		else:
+			v = reg
 
-			return xform((v & mask) >> _offset)
+		v = (v & mask) >> _offset
+		return v if xform is None else xform(v)
 
 	return __ug
 
@@ -238,68 +222,132 @@ def from_reg_bool(_offset):
 
 
 
+class _RegAccessor(object):
+	# Data descriptor for an instrument attribute backed by a single register. Reads see the
+	# locally set value if there is one, otherwise the last value known to be on the Moku;
+	# writes are held locally until the next commit.
+	__slots__ = ['name', 'reg', 'set_xform', 'get_xform']
+
+	def __init__(self, name, reg, set_xform, get_xform):
+		self.name = name
+		self.reg = reg
+		self.set_xform = set_xform
+		self.get_xform = get_xform
+
+	def __get__(self, obj, cls=None):
+		if obj is None:
+			return self
+
+		if self.get_xform is None:
+			raise AttributeError("Attribute %s is write-only" % self.name)
+
+		v = obj._localregs[self.reg]
+		if v is None:
+			v = obj._remoteregs[self.reg] or 0
+
+		return self.get_xform(v)
+
+	def __set__(self, obj, data):
+		if self.set_xform is None:
+			raise AttributeError("Attribute %s is read-only" % self.name)
+
+		reg = self.reg
+		old = obj._localregs[reg]
+		if old is None:
+			old = obj._remoteregs[reg] or 0
+
+		new = self.set_xform(data, old)
+		if new is None:
+			raise ValueOutOfRangeException("Reg %d Data %d" % (reg, data))
+
+		obj._localregs[reg] = new
+		obj._dirty.add(reg)
+
+
+class _CompoundRegAccessor(_RegAccessor):
+	# As above, for an attribute spanning a tuple of registers
+	__slots__ = []
+
+	def _current(self, obj):
+		return [ obj._localregs[r] if obj._localregs[r] is not None else obj._remoteregs[r] or 0 for r in self.reg ]
+
+	def __get__(self, obj, cls=None):
+		if obj is None:
+			return self
+
+		if self.get_xform is None:
+			raise AttributeError("Attribute %s is write-only" % self.name)
+
+		return self.get_xform(self._current(obj))
+
+	def __set__(self, obj, data):
+		if self.set_xform is None:
+			raise AttributeError("Attribute %s is read-only" % self.name)
+
+		new = self.set_xform(data, self._current(obj))
+		if new is None:
+			raise ValueOutOfRangeException("Regs %s Data %d" % (str(self.reg), data))
+
+		for r, n in zip(self.reg, new):
+			obj._localregs[r] = n
+			obj._dirty.add(r)
+
+
 class MokuInstrument(object):
 	"""Superclass for all Instruments that may be attached to a :any:`Moku` object.
 
 	Should never be instantiated directly; instead, instantiate the subclass of the instrument
 	you wish to run (e.g. :any:`Oscilloscope`, :any:`SignalGenerator`)"""
 
+	_accessor_dict = {}
+
 	def __init__(self):
 		""" Must be called as the first line from any child implementations. """
-		self._accessor_dict = {}
 		self._moku = None
 		self._remoteregs = [None]*128
 		self._localregs = [None]*128
+		self._dirty = set()
 		self._running = False
+		self._commit_stats = { 'commits': 0, 'writes': 0, 'registers': 0, 'suppressed': 0 }
 		self._stateid = 0
 
 		self.id = 0
 		self.type = "Dummy Instrument"
 
-		self._register_accessors(_instr_reg_handlers)
-
-	def _register_accessors(self, accessor_dict):
-		self._accessor_dict.update(accessor_dict)
-
-	def _accessor_get(self, reg, get_xform):
-		# Return local if present. Support a single register or a tuple of registers
-		try:
-			c = [ self._localregs[r] if self._localregs[r] is not None else self._remoteregs[r] or 0 for r in reg ]
-			if all(i is not None for i in c): return get_xform(c)
-		except TypeError:
-			c = self._localregs[reg] if self._localregs[reg] is not None else self._remoteregs[reg] or 0
-			if c is not None: return get_xform(c)
-
-	def _accessor_set(self, reg, set_xform, data):
-		# Support a single register or a tuple of registers
-		try:
-			old = [ self._localregs[r] if self._localregs[r] is not None else self._remoteregs[r] or 0 for r in reg ]
-		except TypeError:
-			old = self._localregs[reg] if self._localregs[reg] is not None else self._remoteregs[reg] or 0
-
-		new = set_xform(data, old)
-		if new is None:
-			raise ValueOutOfRangeException("Reg %d Data %d" % (reg, data))
-
-		try:
-			for r, n in zip(reg, new):
-				self._localregs[r] = n
-		except TypeError:
-			self._localregs[reg] = new
-
-	def __getattr__(self, name):
-		if name != '_accessor_dict' and name in self._accessor_dict:
-			reg, set_xform, get_xform = self._accessor_dict[name]
-			return self._accessor_get(reg, get_xform)
-		else:
-			raise AttributeError("No Attribute %s" % name)
-
-	def __setattr__(self, name, value):
-		if name != '_accessor_dict' and name in self._accessor_dict:
-			reg, set_xform, get_xform = self._accessor_dict[name]
-			return self._accessor_set(reg, set_xform, value)
-		else:
-			return super(MokuInstrument, self).__setattr__(name, value)
+	@classmethod
+	def _register_accessors(cls, accessor_dict):
+		# Turn an accessor table in to attributes of the class. This is done once, after the
+		# class and its table have been defined, so accessing one of these attributes is no
+		# more expensive than a property. The class's _accessor_dict is the union of its own
+		# table and those of all its bases.
+		accessors = {}
+		for base in reversed(cls.__mro__):
+			accessors.update(base.__dict__.get('_accessor_dict', {}))
+		accessors.update(accessor_dict)
+		cls._accessor_dict = accessors
+
+		for name, (reg, set_xform, get_xform) in accessor_dict.items():
+			acc = _CompoundRegAccessor if isinstance(reg, (list, tuple)) else _RegAccessor
+			setattr(cls, name, acc(name, reg, set_xform, get_xform))
+
+	def _accessor_regs(self, names=None):
+		# Sorted list of the registers behind the given attribute names, or all of them. Plain
+		# register numbers are passed through.
+		regs = set()
+		for name in (self._accessor_dict if names is None else names):
+			if name in self._accessor_dict:
+				reg = self._accessor_dict[name][0]
+			elif isinstance(name, int):
+				reg = name
+			else:
+				raise AttributeError("No Attribute %s" % name)
+
+			try:
+				regs.update(reg)
+			except TypeError:
+				regs.add(reg)
+
+		return sorted(regs)
 
 	def set_defaults(self):
 		""" Can be extended in implementations to set initial state """
@@ -307,7 +355,7 @@ class MokuInstrument(object):
 	def attach_moku(self, moku):
 		self._moku = moku
 
-	def commit(self):
+	def commit(self, force=False):
 		"""
 		Apply all modified settings.
 
@@ -316,31 +364,73 @@ class MokuInstrument(object):
 		    This **must** be called after any *set_* or *synth_* function has been called, or control
 		    attributes have been directly set. This allows you to, for example, set multiple attributes
 		    controlling rendering or signal generation in separate calls but have them all take effect at once.
+
+		Only registers whose values differ from those last written to or read from the Moku are sent,
+		and if nothing has changed no request is made at all.
+
+		:type force: bool
+		:param force: Write every register that has been set since the last commit, even if its value is unchanged.
 		"""
 		if self._moku is None: raise NotDeployedException()
-		self._stateid = (self._stateid + 1) % 256 # Some statid docco says 8-bits, some 16.
-		self.state_id = self._stateid
-		self.state_id_alt = self._stateid
-
-		regs = [ (i, d) for i, d in enumerate(self._localregs) if d is not None ]
-		# TODO: Save this register set against stateid to be retrieved later
-		log.debug("Committing reg set %s", str(regs))
-		self._moku._write_regs(regs)
-		self._remoteregs = [ l if l is not None else r for l, r in zip(self._localregs, self._remoteregs)]
-		self._localregs = [None] * 128
-
-	def sync_registers(self):
+		stats = self._commit_stats
+		stats['commits'] += 1
+
+		if force or any(self._localregs[i] != self._remoteregs[i] for i in self._dirty):
+			self._stateid = (self._stateid + 1) % 256 # Some statid docco says 8-bits, some 16.
+			self.state_id = self._stateid
+			self.state_id_alt = self._stateid
+
+			regs = [ (i, self._localregs[i]) for i in sorted(self._dirty) if force or self._localregs[i] != self._remoteregs[i] ]
+			# TODO: Save this register set against stateid to be retrieved later
+			log.debug("Committing reg set %s", str(regs))
+			self._moku._write_regs(regs)
+
+			for i, d in regs:
+				self._remoteregs[i] = d
+
+			stats['writes'] += 1
+			stats['registers'] += len(regs)
+		else:
+			regs = []
+
+		stats['suppressed'] += len(self._dirty) - len(regs)
+
+		for i in self._dirty:
+			self._localregs[i] = None
+		self._dirty.clear()
+
+	@property
+	def commit_stats(self):
+		"""
+		Counts of the work done by :any:`commit` since the instrument was created:
+
+		- **commits** -- Calls to :any:`commit`
+		- **writes** -- Register writes sent to the Moku. Commits with no changes don't send one.
+		- **registers** -- Registers written
+		- **suppressed** -- Registers set locally but not written as their values were unchanged
+
+		:rtype: dict
+		"""
+		return dict(self._commit_stats)
+
+	def sync_registers(self, regs=None):
 		"""
 		Reload state from the Moku.
 
 		This should never have to be called explicitly, however in advanced operation where the
 		Moku state is being updated outside of pymoku, this will give the user access to those
 		modified states through their attributes or accessors
+
+		:type regs: list
+		:param regs: Register numbers and/or attribute names to reload, default all registers.
 		"""
 		if self._moku is None: raise NotDeployedException()
-		self._remoteregs = [ val for reg, val in self._moku._read_regs(list(range(128)))]
+		regs = list(range(128)) if regs is None else self._accessor_regs(regs)
+
+		for reg, val in self._moku._read_regs(regs):
+			self._remoteregs[reg] = val
 
-	def dump_remote_regs(self):
+	def dump_remote_regs(self, regs=None):
 		"""
 		Return the current register state of the Moku.
 
@@ -350,8 +440,12 @@ class MokuInstrument(object):
 
 		Unlike :any:`sync_registers`, no local state is updated to reflect these register values
 		and they are not made available through attributes or accessors.
+
+		:type regs: list
+		:param regs: Register numbers and/or attribute names to read, default all registers.
 		"""
-		return self._moku._read_regs(list(range(128)))
+		regs = list(range(128)) if regs is None else self._accessor_regs(regs)
+		return self._moku._read_regs(regs)
 
 	def set_running(self, state):
 		"""
@@ -364,6 +458,7 @@ class MokuInstrument(object):
 		self._running = state
 		reg = (INSTR_RST if not state else 0)
 		self._localregs[REG_CTL] = reg
+		self._dirty.add(REG_CTL)
 		self.commit()
 
 	def set_frontend(self, channel, fiftyr=False, atten=True, ac=False):
@@ -465,3 +560,5 @@ _instr_reg_handlers = {
 	'state_id':			(REG_STATE,	 	to_reg_unsigned(0, 8),		from_reg_unsigned(0, 8)),
 	'state_id_alt':		(REG_STATE,	 	to_reg_unsigned(16, 8),		from_reg_unsigned(16, 8)),
 }
+
+MokuInstrument._register_accessors(_instr_reg_handlers)
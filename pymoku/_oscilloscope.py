@@ -2,6 +2,8 @@
 import math
 import logging
 
+import numpy as np
+
 from ._instrument import *
 from . import _frame_instrument
 from . import _siggen
@@ -72,8 +74,12 @@ class VoltsFrame(_frame_instrument.DataFrame):
 
 	.. autoinstanceattribute:: pymoku._frame_instrument.VoltsFrame.waveformid
 		:annotation: = n
+
+	If the frame was created with *use_numpy* set (see :any:`set_numpy_frames`), the data
+	arrays are NumPy float arrays with invalid samples set to NaN. Otherwise they're lists with invalid
+	samples set to *None*.
 	"""
-	def __init__(self, scales):
+	def __init__(self, scales, use_numpy=False):
 		super(VoltsFrame, self).__init__()
 
 		#: Channel 1 data array in units of Volts. Present whether or not the channel is enabled, but the
@@ -84,16 +90,44 @@ class VoltsFrame(_frame_instrument.DataFrame):
 		self.ch2 = []
 
 		self.scales = scales
+		self.use_numpy = use_numpy
 
 	def __json__(self):
+		if self.use_numpy:
+			return { 'ch1': _frame_instrument._nan_to_none(self.ch1), 'ch2': _frame_instrument._nan_to_none(self.ch2) }
+
 		return { 'ch1': self.ch1, 'ch2' : self.ch2 }
 
+	def _process_numpy(self, scale1, scale2):
+		# One pass each to read the samples, convert to float and scale, rather than one per sample
+		dat = np.frombuffer(self.raw1, dtype='<i4')[:1024]
+		self.ch1_bits = dat.astype(np.float64)
+		self.ch1_bits[dat == -0x80000000] = np.nan
+		self.ch1 = self.ch1_bits * scale1
+
+		dat = np.frombuffer(self.raw2, dtype='<i4')[:1024]
+		self.ch2_bits = dat.astype(np.float64)
+		self.ch2_bits[dat == -0x80000000] = np.nan
+		self.ch2 = self.ch2_bits * scale2
+
 	def process_complete(self):
-		if self.stateid not in self.scales:
+		scales = self.scales.get(self.stateid)
+
+		if scales is None:
 			log.error("Can't render voltage frame, haven't saved calibration data for state %d", self.stateid)
 			return
 
-		scale1, scale2 = self.scales[self.stateid]
+		scale1, scale2 = scales
+
+		if self.use_numpy:
+			try:
+				self._process_numpy(scale1, scale2)
+			except ValueError:
+				log.exception("Oscilloscope packet")
+				self.frameid = None
+				self.complete = False
+
+			return True
 
 		try:
 			smpls = int(len(self.raw1) / 4)
@@ -145,7 +179,6 @@ class Oscilloscope(_frame_instrument.FrameBasedInstrument, _siggen.SignalGenerat
 	def __init__(self):
 		"""Create a new Oscilloscope instrument, ready to be attached to a Moku."""
 		super(Oscilloscope, self).__init__()
-		self._register_accessors(_osc_reg_handlers)
 
 		self.id = 1
 		self.type = "oscilloscope"
@@ -158,7 +191,7 @@ class Oscilloscope(_frame_instrument.FrameBasedInstrument, _siggen.SignalGenerat
 
 		self.decimation_rate = 1
 
-		self.scales = {}
+		self.scales = _frame_instrument.ScaleCache()
 
 		self.set_frame_class(VoltsFrame, scales=self.scales)
 
@@ -395,11 +428,9 @@ class Oscilloscope(_frame_instrument.FrameBasedInstrument, _siggen.SignalGenerat
 
 		return (g1, g2)
 
-	def commit(self):
-		super(Oscilloscope, self).commit()
-		self.scales[self._stateid] = self._calculate_scales()
-
-		# TODO: Trim scales dictionary, getting rid of old ids
+	def commit(self, force=False):
+		super(Oscilloscope, self).commit(force)
+		self.scales.put(self._stateid, self._scales_fingerprint(), self._calculate_scales)
 
 	# Bring in the docstring from the superclass for our docco.
 	commit.__doc__ = MokuInstrument.commit.__doc__
@@ -412,6 +443,9 @@ class Oscilloscope(_frame_instrument.FrameBasedInstrument, _siggen.SignalGenerat
 		except:
 			log.warning("Can't read calibration values.")
 
+		# Scales calculated against another Moku's calibration don't apply
+		self.scales.clear()
+
 	attach_moku.__doc__ = MokuInstrument.attach_moku.__doc__
 
 _osc_reg_handlers = {
@@ -432,7 +466,7 @@ _osc_reg_handlers = {
 
 	'hf_reject':		(REG_OSC_TRIGCTL,	to_reg_bool(12),			from_reg_bool(12)),
 	'hysteresis':		(REG_OSC_TRIGCTL,	to_reg_unsigned(16, 16),	from_reg_unsigned(16, 16)),
-	'trigger_level':	(REG_OSC_TRIGLVL,	to_reg_signed(0, 32),		to_reg_signed(0, 32)),
+	'trigger_level':	(REG_OSC_TRIGLVL,	to_reg_signed(0, 32),		from_reg_signed(0, 32)),
 
 	'loopback_mode_ch1':	(REG_OSC_ACTL,	to_reg_unsigned(0, 1, allow_set=[_OSC_LB_CLIP, _OSC_LB_ROUND]),
 											from_reg_unsigned(0, 1)),
@@ -444,3 +478,5 @@ _osc_reg_handlers = {
 
 	'decimation_rate':	(REG_OSC_DECIMATION,to_reg_unsigned(0, 32),	from_reg_unsigned(0, 32)),
 }
+
+Oscilloscope._register_accessors(_osc_reg_handlers)
@@ -54,7 +54,6 @@ class PhaseMeter_SignalGenerator(MokuInstrument):
 
 	def __init__(self):
 		super(PhaseMeter_SignalGenerator, self).__init__()
-		self._register_accessors(_pm_siggen_reg_hdl)
 
 		# Local/cached values
 		self.pm_out1_enable = False
@@ -103,6 +102,8 @@ _pm_siggen_reg_hdl = {
 											from_reg_unsigned(16,16, xform=lambda a: a / _PM_SG_AMPSCALE))
 }
 
+PhaseMeter_SignalGenerator._register_accessors(_pm_siggen_reg_hdl)
+
 class PhaseMeter(_frame_instrument.FrameBasedInstrument, PhaseMeter_SignalGenerator): #TODO Frame instrument may not be appropriate when we get streaming going.
 	""" PhaseMeter instrument object. This should be instantiated and attached to a :any:`Moku` instance.
 
@@ -131,7 +132,6 @@ class PhaseMeter(_frame_instrument.FrameBasedInstrument, PhaseMeter_SignalGenera
 	def __init__(self):
 		"""Create a new PhaseMeter instrument, ready to be attached to a Moku."""
 		super(PhaseMeter, self).__init__()
-		self._register_accessors(_pm_reg_handlers)
 		
 		self.id = 3
 		self.type = "phasemeter"
@@ -313,3 +313,5 @@ _pm_reg_handlers = {
 	'output_shift':			(REG_PM_OUTSHIFT, to_reg_unsigned(17,5),
 											from_reg_unsigned(17,5))
 }
+
+PhaseMeter._register_accessors(_pm_reg_handlers)
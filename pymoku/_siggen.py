@@ -89,7 +89,6 @@ class SignalGenerator(MokuInstrument):
 	def __init__(self):
 		""" Create a new SignalGenerator instance, ready to be attached to a Moku."""
 		super(SignalGenerator, self).__init__()
-		self._register_accessors(_siggen_reg_handlers)
 
 		self.id = 4
 		self.type = "signal_generator"
@@ -351,3 +350,5 @@ _siggen_reg_handlers = {
 	'out2_amp_pc':		(REG_SG_PRECLIP,	to_reg_unsigned(16, 16, xform=lambda a: a / _SG_AMPSCALE),
 											from_reg_unsigned(16, 16, xform=lambda a: a * _SG_AMPSCALE)),
 }
+
+SignalGenerator._register_accessors(_siggen_reg_handlers)
@@ -1,10 +1,14 @@
 import math
 import logging
+import threading
+
+import numpy as np
 
 from ._instrument import *
 from . import _frame_instrument
 
 from bisect import bisect_right
+from collections import OrderedDict
 
 log = logging.getLogger(__name__)
 
@@ -42,6 +46,12 @@ _SA_FFT_LENGTH		= 8192/2
 _SA_FREQ_SCALE		= 2**32 / _SA_ADC_SMPS
 _SA_INT_VOLTS_SCALE = (1.437*pow(2.0,-8.0))
 
+# Bin frequencies and their corrections depend on only a few settings, and sweeps tend to come
+# back to the same ones, so the most recently used are kept (see SpecAn._calculate_corrections).
+_SA_CORR_CACHE_SIZE	= 64
+_sa_corr_cache = OrderedDict()
+_sa_corr_lock = threading.Lock()
+
 '''
 	FILTER GAINS AND CORRECTION FACTORS
 '''
@@ -149,7 +159,7 @@ class SpectrumFrame(_frame_instrument.DataFrame):
 	.. autoinstanceattribute:: pymoku._frame_instrument.SpectrumFrame.waveformid
 		:annotation: = n
 	"""
-	def __init__(self, scales):
+	def __init__(self, scales, use_numpy=False):
 		super(SpectrumFrame, self).__init__()
 
 		#: Channel 1 data array in units of power. Present whether or not the channel is enabled, but the
@@ -164,75 +174,71 @@ class SpectrumFrame(_frame_instrument.DataFrame):
 
 		#: Obtain all data scaling factors relevant to current SpecAn configuration
 		self.scales = scales
+		self.use_numpy = use_numpy
+
+		# Scaling factors for the state this frame was rendered in
+		self._state_scales = None
 
 	def __json__(self):
+		if self.use_numpy:
+			return { 'ch1' : _frame_instrument._nan_to_none(self.ch1), 'ch2' : _frame_instrument._nan_to_none(self.ch2), 'fs' : self.fs }
+
 		return { 'ch1' : self.ch1, 'ch2' : self.ch2, 'fs' : self.fs }
 
-	# convert an RMS voltage to a power level (assuming 50Ohm load)
-	def _vrms_to_dbm(self, v):
-		return 10.0*math.log(v*v/50.0,10) + 30.0
+	def _process_channel(self, raw, corr, start, dbmoffset):
+		# SpecAn data is backwards because $(EXPLETIVE), also remove zeros for the sake of common
+		# display on a log axis. Invalid bins are NaN.
+		dat = np.frombuffer(raw, dtype='<i4')[:_SA_SCREEN_WIDTH][::-1]
+		bits = np.maximum(dat, 1).astype(np.float64)
+		bits[dat == -0x80000000] = np.nan
+
+		# Apply frequency dependent corrections and trim the invalid part of the frame
+		v = bits[start:-1] * corr[start:-1]
+
+		if dbmoffset is not None:
+			v = 20.0 * np.log10(v) + dbmoffset
+
+		return bits, v
 
 	def process_complete(self):
 
-		if self.stateid not in self.scales:
+		scales = self.scales.get(self.stateid)
+
+		if scales is None:
 			log.error("Can't render specan frame, haven't saved calibration data for state %d", self.stateid)
 			return
 
-		# Get scaling/correction factors based on current instrument configuration
-		scales = self.scales[self.stateid]
-		scale1 = scales['g1']
-		scale2 = scales['g2']
-		fs = scales['fs']
-		f1, f2 = scales['fspan']
-		fcorrs = scales['fcorrs']
-		dbmscale = scales['dbmscale']
+		# Everything that depends only on the instrument state, rather than the frame data, has
+		# been worked out in advance by SpecAn._calculate_scales
+		self._state_scales = scales
+		start = scales['start']
+		dbmoffset = scales['dbmoffset'] if scales['dbmscale'] else None
 
 		try:
-			# Find the starting index for the valid frame data
-			# SpecAn generally gives more than we ask for due to integer decimations
-			start_index = bisect_right(fs,f1)
-
 			# Set the frequency range of valid data in the current frame (same for both channels)
-			self.ch1_fs = fs[start_index:-1]
-			self.ch2_fs = fs[start_index:-1]
-
-			##################################
-			# Process Ch1 Data
-			##################################
-			smpls = int(len(self.raw1) / 4)
-			dat = struct.unpack('<' + 'i' * smpls, self.raw1)
-			dat = [ x if x != -0x80000000 else None for x in dat ]
-
-			# SpecAn data is backwards because $(EXPLETIVE), also remove zeros for the sake of common
-			# display on a log axis.
-			self.ch1_bits = [ max(float(x), 1) if x is not None else None for x in reversed(dat[:_SA_SCREEN_WIDTH]) ]
-
-			# Apply frequency dependent corrections
-			self.ch1 = [ self._vrms_to_dbm(a*c*scale1) if dbmscale else a*c*scale1 if a is not None else None for a,c in zip(self.ch1_bits, fcorrs)]
-
-			# Trim invalid part of frame
-			self.ch1 = self.ch1[start_index:-1]
-
-			##################################
-			# Process Ch2 Data
-			##################################
-			smpls = int(len(self.raw2) / 4)
-			dat = struct.unpack('<' + 'i' * smpls, self.raw2)
-			dat = [ x if x != -0x80000000 else None for x in dat ]
-
-			self.ch2_bits = [ max(float(x), 1) if x is not None else None for x in reversed(dat[:_SA_SCREEN_WIDTH]) ]
-
-			self.ch2 = [ self._vrms_to_dbm(a*c*scale2) if dbmscale else a*c*scale2 if a is not None else None for a,c in zip(self.ch2_bits, fcorrs)]
-			self.ch2 = self.ch2[start_index:-1]
+			self.ch1_fs = scales['fs'][start:-1]
+			self.ch2_fs = scales['fs'][start:-1]
 
-		except (IndexError, TypeError, struct.error):
+			bits1, ch1 = self._process_channel(self.raw1, scales['corr1'], start, dbmoffset)
+			bits2, ch2 = self._process_channel(self.raw2, scales['corr2'], start, dbmoffset)
+		except ValueError:
 			# If the data is bollocksed, force a reinitialisation on next packet
 			log.exception("SpecAn packet")
 			self.frameid = None
 			self.complete = False
+			return False
 
 		# A valid frame is there's at least one valid sample in each channel
-		return any(self.ch1) and any(self.ch2)
+		valid = np.any(np.nan_to_num(ch1) != 0) and np.any(np.nan_to_num(ch2) != 0)
+
+		if self.use_numpy:
+			self.ch1_bits, self.ch1 = bits1, ch1
+			self.ch2_bits, self.ch2 = bits2, ch2
+		else:
+			self.ch1_bits, self.ch1 = _frame_instrument._nan_to_none(bits1), _frame_instrument._nan_to_none(ch1)
+			self.ch2_bits, self.ch2 = _frame_instrument._nan_to_none(bits2), _frame_instrument._nan_to_none(ch2)
+
+		return valid
 
 	'''
 		Plotting helper functions
@@ -261,12 +267,11 @@ class SpectrumFrame(_frame_instrument.DataFrame):
 		# This function returns a format string for the x-axis ticks and x-coordinates along the frequency scale
 		# Use this to set an x-axis format during plotting of SpecAn frames
 
-		if self.stateid not in self.scales:
+		if self._state_scales is None:
 			log.error("Can't get x-axis format, haven't saved calibration data for state %d", self.stateid)
 			return
 
-		scales = self.scales[self.stateid]
-		f1, f2 = scales['fspan']
+		f1, f2 = self._state_scales['fspan']
 
 		fscale_str, fscale_const = self._get_freqScale(f2)
 
@@ -280,12 +285,11 @@ class SpectrumFrame(_frame_instrument.DataFrame):
 
 	def _get_yaxis_fmt(self,y,pos):
 
-		if self.stateid not in self.scales:
+		if self._state_scales is None:
 			log.error("Can't get current frequency format, haven't saved calibration data for state %d", self.stateid)
 			return
 
-		scales = self.scales[self.stateid]
-		dbm = scales['dbmscale']
+		dbm = self._state_scales['dbmscale']
 
 		yfmt = {
 			'linear' : '%.1f %s' % (y,'V'),
@@ -332,9 +336,8 @@ class SpecAn(_frame_instrument.FrameBasedInstrument):
 	def __init__(self):
 		"""Create a new Spectrum Analyser instrument, ready to be attached to a Moku."""
 		super(SpecAn, self).__init__()
-		self._register_accessors(_sa_reg_handlers)
 
-		self.scales = {}
+		self.scales = _frame_instrument.ScaleCache()
 		self.set_frame_class(SpectrumFrame, scales=self.scales)
 
 		self.id = 2
@@ -526,26 +529,56 @@ class SpecAn(_frame_instrument.FrameBasedInstrument):
 		buf_start_freq = demod_freq
 		buf_freq_step = bufspan/_SA_FFT_LENGTH
 
-		dev_stop_freq = buf_start_freq + (self.offset+4) * buf_freq_step
+		dev_stop_freq = buf_start_freq + (frame_offset+4) * buf_freq_step
 
 		return (dev_stop_freq - _SA_SCREEN_WIDTH * freq_step)
 
 	def _calculate_adc_freq_resp(self, f, atten):
-		frac_idx = f/(_SA_ADC_SMPS/2.0)
-
-		floatIndex = (len(_SA_ADC_FREQ_RESP_0) - 1) * min(max(frac_idx,0.0),1.0)
+		# f may be a single frequency or an array of them
+		frac_idx = np.clip(np.asarray(f) / (_SA_ADC_SMPS/2.0), 0.0, 1.0)
 		r = _SA_ADC_FREQ_RESP_20 if atten else _SA_ADC_FREQ_RESP_0
 
 		# Return linear interpolation of table values
-		correction = r[int(math.floor(floatIndex))] + (floatIndex - math.floor(floatIndex))*(r[int(math.ceil(floatIndex))] - r[int(math.floor(floatIndex))])
-		return correction
+		return np.interp((len(r) - 1) * frac_idx, np.arange(len(r)), r)
 
 	def _calculate_cic_freq_resp(self, f, dec, order):
-		freq = f/_SA_ADC_SMPS
+		freq = np.asarray(f) / _SA_ADC_SMPS
+
+		# sin(pi.f.dec) / (dec.sin(pi.f)), written in terms of sinc so that it's 1 at f = 0
+		return np.abs(np.sinc(freq * dec) / np.sinc(freq)) ** order
+
+	def _calculate_corrections(self, decimation, demod_freq, render_downsamp, frame_offset, atten):
+		# Returns the frequency of each screen bin and the frequency dependent correction for it.
+		# These are cached by configuration, so repeatedly committing the same settings doesn't
+		# recalculate them. The cache is shared by all instances so the corrections are read-only
+		# and each caller gets its own list of frequencies.
+		key = (decimation, demod_freq, render_downsamp, frame_offset, atten)
+
+		with _sa_corr_lock:
+			corrs = _sa_corr_cache.pop(key, None)
+			if corrs is not None:
+				_sa_corr_cache[key] = corrs
+
+		if corrs is None:
+			dev_start_freq = self._calculate_startFreq(decimation, demod_freq, render_downsamp, frame_offset)
+			dev_freq_step = self._calculate_freqStep(decimation, render_downsamp)
+			freqs = dev_start_freq + dev_freq_step * np.arange(_SA_SCREEN_WIDTH)
 
-		correction = 1.0 if (freq == 0.0) else pow(math.fabs(math.sin(math.pi*freq*dec)/(math.sin(math.pi*freq)*dec)),order)
+			# The CIC correction is only for CIC1 which is decimation=4 only, and 10th order
+			fcorrs = 1 / self._calculate_adc_freq_resp(freqs / ADC_SMP_RATE, atten)
+			if decimation < 4:
+				fcorrs /= self._calculate_cic_freq_resp(freqs / ADC_SMP_RATE, 4, 10)
 
-		return correction
+			fcorrs.flags.writeable = False
+			corrs = (tuple(freqs.tolist()), fcorrs)
+
+			with _sa_corr_lock:
+				_sa_corr_cache[key] = corrs
+
+				if len(_sa_corr_cache) > _SA_CORR_CACHE_SIZE:
+					_sa_corr_cache.popitem(last=False)
+
+		return list(corrs[0]), corrs[1]
 
 	def _calculate_scales(self):
 		"""
@@ -582,33 +615,30 @@ class SpecAn(_frame_instrument.FrameBasedInstrument):
 		g1 *= _SA_INT_VOLTS_SCALE * filt_gain * window_gain * self.rbw_ratio * (2**10)
 		g2 *= _SA_INT_VOLTS_SCALE * filt_gain * window_gain * self.rbw_ratio * (2**10)
 
-		# Find approximate frequency bin values
-		dev_start_freq = self._calculate_startFreq(self._total_decimation,self.demod,self.render_dds,self.offset)
-		dev_freq_step = self._calculate_freqStep(self._total_decimation, self.render_dds)
-		freqs = [ (dev_start_freq + dev_freq_step*i) for i in range(_SA_SCREEN_WIDTH)]
+		# Find approximate frequency bin values and their frequency dependent corrections
+		freqs, fcorrs = self._calculate_corrections(self._total_decimation, self.demod, self.render_dds, self.offset, True)
 
-		# Compute the frequency dependent correction arrays
-		# The CIC correction is only for CIC1 which is decimation=4 only, and 10th order
-		if(self._total_decimation >= 4):
-			fcorrs = [ (1/self._calculate_adc_freq_resp(f/ADC_SMP_RATE, True)) for f in freqs]
-		else:
-			fcorrs = [ (1/self._calculate_adc_freq_resp(f/ADC_SMP_RATE, True)/self._calculate_cic_freq_resp(f/ADC_SMP_RATE, 4, 10)) for f in freqs]
+		# Per-frame processing works straight from these: the combined correction vector for each
+		# channel, the index of the first valid bin (SpecAn generally gives more than we ask for due
+		# to integer decimations) and the offset that takes 20log10(Vrms) to dBm in to 50Ohm.
+		return {'g1': g1, 'g2': g2, 'fs': freqs, 'fcorrs': fcorrs, 'fspan': [self._f1_full, self._f2_full], 'dbmscale': self.dbmscale,
+				'corr1': fcorrs * g1, 'corr2': fcorrs * g2, 'start': bisect_right(freqs, self._f1_full),
+				'dbmoffset': 30.0 - 10.0 * math.log10(50.0)}
 
-		return {'g1': g1, 'g2': g2, 'fs': freqs, 'fcorrs': fcorrs, 'fspan': [self._f1_full, self._f2_full], 'dbmscale': self.dbmscale}
+	def _scales_fingerprint(self):
+		# The requested span and display units are local settings rather than registers
+		return super(SpecAn, self)._scales_fingerprint() + (self._f1_full, self._f2_full, self.dbmscale)
 
-
-	def commit(self):
+	def commit(self, force=False):
 		# Compute remaining control register values based on window, rbw and fspan
 		self._setup_controls()
 
 		# Push the controls through to the device
-		super(SpecAn, self).commit()
+		super(SpecAn, self).commit(force)
 
 		# Update the scaling factors for processing of incoming frames
 		# stateid allows us to track which scales correspond to which register state
-		self.scales[self._stateid] = self._calculate_scales()
-
-		# TODO: Trim scales dictionary, getting rid of old ids
+		self.scales.put(self._stateid, self._scales_fingerprint(), self._calculate_scales)
 
 	# Bring in the docstring from the superclass for our docco.
 	commit.__doc__ = MokuInstrument.commit.__doc__
@@ -618,6 +648,7 @@ class SpecAn(_frame_instrument.FrameBasedInstrument):
 
 		# The moku contains calibration data for various configurations
 		self.calibration = dict(self._moku._get_property_section("calibration"))
+		self.scales.clear()
 
 	attach_moku.__doc__ = MokuInstrument.attach_moku.__doc__
 
@@ -654,3 +685,5 @@ _sa_reg_handlers = {
 	'a2_sos2':			(REG_SA_SOS2_A2,	to_reg_signed(0, 18),		from_reg_signed(0, 18)),
 	'b1_sos2':			(REG_SA_SOS2_B1,	to_reg_signed(0, 18),		from_reg_signed(0, 18)),
 }
+
+SpecAn._register_accessors(_sa_reg_handlers)
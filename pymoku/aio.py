@@ -0,0 +1,254 @@
+""" asyncio client for the Moku:Lab control protocol.
+
+:any:`AsyncMoku` speaks exactly the same protocol as :any:`Moku` but every operation is a
+coroutine, so many devices can be monitored and controlled from a single event loop:
+
+	async def poll(ip):
+		m = await AsyncMoku.connect(ip)
+		try:
+			return await m.datalogger_status()
+		finally:
+			m.close()
+
+	statuses = loop.run_until_complete(asyncio.gather(*[ poll(ip) for ip in ips ]))
+
+Requires Python 3.5 or later.
+"""
+import asyncio, logging, os.path, struct
+import zmq, zmq.asyncio
+
+from pymoku import Moku, _MokuProtocol, _FS_CHUNK_SIZE
+from pymoku._frame_instrument import DataloggerStatus
+
+log = logging.getLogger(__name__)
+
+class AsyncMoku(_MokuProtocol):
+	"""
+	Awaitable connection to a Moku:Lab unit.
+
+	Covers device properties, register access, data logging sessions and the file system. Use
+	:any:`connect` to create one. Requests on one connection are carried one at a time, in the
+	order they're made; separate connections (to one device or many) proceed independently.
+	"""
+	PORT = Moku.PORT
+
+	def __init__(self, ip_addr, ctx=None):
+		"""Create a connection to the Moku:Lab unit at the given IP address.
+
+		:type ip_addr: string
+		:param ip_addr: The address to connect to. This should be in IPv4 dotted notation.
+		:type ctx: :any:`zmq.asyncio.Context`
+		:param ctx: Context in which to create the connection, defaults to the shared instance."""
+		self._ip = ip_addr
+		self._seq = 0
+		self._ctx = ctx or zmq.asyncio.Context.instance()
+		self._short = True
+		self._connect()
+
+		# A REQ socket must alternate send and receive, so only one request may be in
+		# progress at a time.
+		self._lock = asyncio.Lock()
+
+		self.serial = None
+		self.name = None
+
+	@classmethod
+	async def connect(cls, ip_addr, ctx=None):
+		""" Connect to a Moku:Lab and read its serial number.
+
+		:return: :any:`AsyncMoku`"""
+		m = cls(ip_addr, ctx)
+		await m.get_serial()
+		return m
+
+	def _connect(self):
+		self._conn = self._ctx.socket(zmq.REQ)
+		self._conn.setsockopt(zmq.LINGER, 5000)
+		self._conn.connect("tcp://%s:%d" % (self._ip, AsyncMoku.PORT))
+		self._set_timeout(self._short)
+
+	def _set_timeout(self, short=True):
+		self._short = short
+		base = 5000
+
+		if not short:
+			base *= 2
+
+		self._conn.setsockopt(zmq.SNDTIMEO, base) # A send should always be quick
+		self._conn.setsockopt(zmq.RCVTIMEO, 2 * base) # A receive might need to wait on processing
+
+	async def _transact(self, pkt):
+		async with self._lock:
+			try:
+				await self._conn.send(pkt)
+				return await self._conn.recv()
+			except BaseException:
+				# If the round trip was cut short, by cancellation or a timeout, the REQ socket is
+				# still waiting for its reply and would refuse any other request. Start again on a
+				# new one, the reply (if it ever comes) goes with the old.
+				self._conn.close(linger=0)
+				self._connect()
+				raise
+
+	async def _read_regs(self, commands):
+		return self._parse_read_regs(await self._transact(self._pkt_read_regs(commands)), commands)
+
+	async def _write_regs(self, commands):
+		self._parse_write_regs(await self._transact(self._pkt_write_regs(commands)))
+
+	async def _get_properties(self, properties):
+		pkt = self._pkt_get_properties(properties)
+		return self._parse_properties(await self._transact(pkt), pkt[1])
+
+	async def _get_property_section(self, section):
+		pkt = self._pkt_get_property_section(section)
+		return self._parse_properties(await self._transact(pkt), pkt[1])
+
+	async def _get_property_single(self, prop):
+		r = await self._get_properties([prop])
+		return r[0][1]
+
+	async def _set_properties(self, properties):
+		pkt = self._pkt_set_properties(properties)
+		return self._parse_properties(await self._transact(pkt), pkt[1])
+
+	async def _set_property_single(self, prop, val):
+		r = await self._set_properties([(prop, val)])
+		return r[0][1]
+
+	async def _stream_prep(self, ch1, ch2, start, end, timestep, tag, binstr, procstr, fmtstr, hdrstr, fname, ftype='csv', use_sd=True):
+		pkt = self._pkt_stream_prep(ch1, ch2, start, end, timestep, tag, binstr, procstr, fmtstr, hdrstr, fname, ftype, use_sd)
+		self._parse_stream_prep(await self._transact(pkt))
+
+	async def _stream_start(self):
+		return self._parse_stream_start(await self._transact(self._pkt_stream_start()))
+
+	async def _stream_stop(self):
+		return self._parse_stream_stop(await self._transact(self._pkt_stream_stop()))
+
+	async def _stream_status(self):
+		return self._parse_stream_status(await self._transact(self._pkt_stream_status()))
+
+	async def _fs_chk(self, mp, fname):
+		return struct.unpack("<I", self._fs_parse_reply(await self._transact(self._fs_pkt_name(3, mp, fname))))[0]
+
+	async def _fs_size(self, mp, fname):
+		return struct.unpack("<Q", self._fs_parse_reply(await self._transact(self._fs_pkt_name(4, mp, fname))))[0]
+
+	async def _fs_list(self, mp, calculate_checksums=False):
+		return self._fs_parse_list(await self._transact(self._fs_pkt_list(mp, calculate_checksums)))
+
+	async def _fs_free(self, mp):
+		t, f = struct.unpack("<QQ", self._fs_parse_reply(await self._transact(self._fs_packet(6, mp.encode('ascii')))))
+
+		return t, f
+
+	async def _fs_finalise(self, mp, fname, fsize):
+		self._fs_parse_reply(await self._transact(self._fs_pkt_name(7, mp, fname, struct.pack('<Q', fsize))))
+
+	async def _send_file(self, mp, localname):
+		self._set_timeout(short=False)
+		remotename = os.path.basename(localname)
+		i = 0
+
+		try:
+			with open(localname, 'rb') as f:
+				while True:
+					data = f.read(_FS_CHUNK_SIZE)
+
+					if not len(data):
+						break
+
+					pkt = self._fs_pkt_name(2, mp, remotename, struct.pack("<QQ", i, len(data)) + data)
+					self._fs_parse_reply(await self._transact(pkt))
+
+					i += len(data)
+		finally:
+			self._set_timeout(short=True)
+
+		# Once all chunks have been uploaded, finalise the file on the
+		# device making it available for use
+		await self._fs_finalise(mp, remotename, i)
+
+		return remotename
+
+	async def _receive_file(self, mp, fname, l):
+		self._set_timeout(short=False)
+		i = 0
+
+		try:
+			# A zero length implies transfer the entire file
+			if l == 0:
+				l = await self._fs_size(mp, fname)
+
+			with open(fname, "wb") as f:
+				while i < l:
+					to_transfer = min(l - i, _FS_CHUNK_SIZE)
+					pkt = self._fs_pkt_name(1, mp, fname, struct.pack("<QQ", i, to_transfer))
+
+					reply = self._fs_parse_reply(await self._transact(pkt))
+					f.write(reply[8:])
+
+					i += to_transfer
+		finally:
+			self._set_timeout(short=True)
+
+	async def datalogger_status(self):
+		""" :return: Status of the Moku's data logging session, as for :any:`datalogger_status` on an instrument
+		:rtype: :any:`DataloggerStatus` """
+		return DataloggerStatus(*await self._stream_status())
+
+	async def datalogger_stop(self):
+		""" Stop the current data logging session, if any.
+
+		:return: Status code of the stopped session (see :any:`datalogger_status`) """
+		return await self._stream_stop()
+
+	async def list_files(self, mp, calculate_checksums=False):
+		""" List the files on the given storage.
+
+		:type mp: str
+		:param mp: Mount point, 'i' for internal storage or 'e' for the SD card
+		:param calculate_checksums: Also return a CRC32 of each file, if supported by the Moku.
+		:return: [ (name, checksum, size), ... ] """
+		return await self._fs_list(mp, calculate_checksums)
+
+	async def send_file(self, mp, localname):
+		""" Upload a local file to the Moku.
+
+		:type mp: str
+		:param mp: Mount point to upload to
+		:param localname: Path of the file to upload, it's saved on the Moku under its base name
+		:return: Name of the file on the Moku """
+		return await self._send_file(mp, localname)
+
+	async def receive_file(self, mp, fname, length=0):
+		""" Download a file from the Moku to the same name in the current directory.
+
+		:type mp: str
+		:param mp: Mount point the file is on
+		:param fname: Name of the file
+		:param length: Number of bytes to download, zero for the whole file """
+		await self._receive_file(mp, fname, length)
+
+	async def get_serial(self):
+		""" :return: Serial number of connected Moku:Lab """
+		self.serial = await self._get_property_single('device.serial')
+		return self.serial
+
+	async def get_name(self):
+		""" :return: Name of connected Moku:Lab """
+		self.name = await self._get_property_single('system.name')
+		return self.name
+
+	async def set_name(self, name):
+		""" :param name: Set new name for the Moku:Lab. """
+		self.name = await self._set_property_single('system.name', name)
+
+	async def get_instrument_id(self):
+		""" :return: ID of the instrument currently running on the Moku:Lab (see :any:`pymoku.instruments.id_table`) """
+		return int((await self._get_property_single('system.instrument')).split(',')[0])
+
+	def close(self):
+		"""Close connection to the Moku:Lab."""
+		self._conn.close()
@@ -3,9 +3,18 @@
 # Python 3 str object for Python 2
 from builtins import str
 
-import os, time, datetime, math
+import os, time, datetime, math, tempfile
 import logging
-import re, struct
+import re, struct, mmap, zlib
+import multiprocessing, threading
+
+from string import Formatter
+
+from bisect import bisect_right
+from collections import deque
+from queue import Queue, Empty, Full
+
+import numpy as np
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +40,24 @@ class LIDataFileReader(object):
 		for record in f:
 			do_something(record)
 
+	For throughput, :any:`read_block` and :any:`iter_blocks` return many records at once as
+	NumPy arrays, along with their timestamps:
+
+	with LIDataFileReader('input.li') as f:
+		for t, (ch1, ) in f.iter_blocks(10000):
+			do_something(t, ch1)
+
+	Records may also be accessed at random, by index or slice, or with :any:`read_range`. The
+	first such access memory-maps the file and indexes its chunks, which can be done up front
+	by passing *use_mmap*. Slices return a NumPy array per channel, decoded straight from the
+	mapped file:
+
+	with LIDataFileReader('input.li', use_mmap=True) as f:
+		ch1, = f[1000:2000]
+
+	With *index_file*, the chunk index is saved alongside the data file (*input.li.idx*) and
+	reused on later opens for as long as the data file's size and modification time are unchanged.
+
 	:autoinstanceattribute:: pymoku.dataparser.LIDataFileReader.headers
 
 	:autoinstanceattribute:: pymoku.dataparser.LIDataFileReader.nch
@@ -45,17 +72,31 @@ class LIDataFileReader(object):
 
 	"""
 
-	def __init__(self, filename):
+	def __init__(self, filename, use_mmap=False, index_file=False, readahead=0):
 		"""
 
 		:raises :any:`InvalidFileException`: when file is corrupted or of the wrong version.
 		:type filename: str
 		:param filename: Input filename
+		:type use_mmap: bool
+		:param use_mmap: Memory-map and index the file on open, ready for random access.
+		:type index_file: bool
+		:param index_file: Load the chunk index from, and save it to, a sidecar file next to the input.
+			Worthwhile for large files that are randomly accessed more than once.
+		:type readahead: int
+		:param readahead: Number of chunks to read and decode ahead in a background thread, 0 to
+			read in the caller's thread. See :any:`readahead_stats`.
 		"""
 		self.records = []
 		self.cal = []
 		self.proc = []
+		self.filename = filename
 		self.file = open(filename, 'rb')
+		self._mmap = None
+		self._nread = 0
+		self._ra_thread = None
+		self._following = False
+		self._index_file = index_file
 		f = self.file
 
 		# Pre-define instance fields so we can attach docstrings.
@@ -82,9 +123,14 @@ class LIDataFileReader(object):
 			raise InvalidFileException("Bad Magic")
 
 		v = f.read(1)
-		if v != b'1':
+		if v not in (b'1', b'2'):
 			raise InvalidFileException("Unknown File Version %s" % v)
 
+		# Version 2 files have their chunks in compressed frames
+		self._compressed = v == b'2'
+		self._frame = b''
+		self._framepos = 0
+
 		pkthdr_len = struct.unpack("<H", f.read(2))[0]
 		self.chs, self.instr, self.instrv, self.deltat, self.starttime = struct.unpack("<BBHdQ", f.read(20))
 
@@ -97,6 +143,8 @@ class LIDataFileReader(object):
 		if (self.ch2):
 			self.nch += 1
 
+		self.records = [deque() for x in range(self.nch)]
+
 		log.debug("NCH %d INST: %d INSTV: %d DT: %f ST: %f", self.nch, self.instr, self.instrv, self.deltat, self.starttime)
 
 		# Do this nch times
@@ -129,44 +177,601 @@ class LIDataFileReader(object):
 		if f.tell() != pkthdr_len + 5:
 			raise InvalidFileException("Incorrect File Header Length (expected %d got %d)" % (pkthdr_len + 5, f.tell()))
 
+		self._data_start = f.tell()
+
 		self.parser = LIDataParser(self.ch1, self.ch2, self.rec, self.proc, self.fmt, self.hdr, self.deltat, self.starttime, self.cal)
 
+		if use_mmap:
+			self._build_index()
+
+		if readahead:
+			self._start_readahead(readahead)
+
+	def _start_readahead(self, depth):
+		# The read-ahead thread has its own parser so it can decode while the caller works on
+		# the records it's already been given. Decoded blocks are handed over through the queue.
+		self._ra_parser = LIDataParser(self.ch1, self.ch2, self.rec, self.proc, self.fmt, self.hdr, self.deltat, self.starttime, self.cal)
+		self._ra_queue = Queue(depth)
+		self._ra_stop = threading.Event()
+		self._ra_done = False
+		self._ra_stall = 0.0
+		self._ra_bytes = 0
+		self._ra_maxdepth = 0
+		self._ra_start = time.time()
+
+		self._ra_thread = threading.Thread(target=self._readahead_worker)
+		self._ra_thread.daemon = True
+		self._ra_thread.start()
+
+	def _readahead_worker(self):
+		parser = self._ra_parser
+		item = ()
+
+		# Runs until it's passed on the end of the file (None) or an error, or is stopped
+		while item is not None and not isinstance(item, Exception):
+			try:
+				c = self._read_chunk()
 
-	def _parse_chunk(self):
+				if c is None:
+					item = None
+				else:
+					ch, d = c
+					parser.parse(d, ch)
+
+					chidx = parser._chidx(ch)
+					item = (ch, len(d) + 3, parser._pblocks[chidx])
+					parser._pblocks[chidx] = []
+			except Exception as e:
+				item = e
+
+			while True:
+				if self._ra_stop.is_set():
+					return
+
+				try:
+					self._ra_queue.put(item, timeout=0.1)
+					break
+				except Full:
+					pass
+
+			self._ra_maxdepth = max(self._ra_maxdepth, self._ra_queue.qsize())
+
+	@property
+	def readahead_stats(self):
+		""" Read-ahead counters, or None if read-ahead isn't enabled.
+
+		:returns: dict with the current and maximum number of chunks waiting in the read-ahead
+			queue (*depth*, *max_depth*), the total time in seconds the reader has spent waiting
+			on the read-ahead thread (*stall_time*) and the amount of chunk data delivered so far
+			(*bytes*, *bytes_per_sec*).
+		"""
+		if self._ra_thread is None:
+			return None
+
+		return {
+			'depth': self._ra_queue.qsize(),
+			'max_depth': self._ra_maxdepth,
+			'stall_time': self._ra_stall,
+			'bytes': self._ra_bytes,
+			'bytes_per_sec': self._ra_bytes / max(time.time() - self._ra_start, 1e-9),
+		}
+
+	def _build_index(self, index=None):
+		# Map the file and find where each channel's data lives, either from the given or sidecar
+		# index or by walking the chunk headers.
+		if self._mmap is not None:
+			return
+
+		if self._compressed:
+			raise InvalidFormatException("Random access isn't supported on compressed files")
+
+		if self.parser._plan is None:
+			raise InvalidFormatException("Random access requires a record format that can be decoded in bulk (%s)" % self.rec)
+
+		self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		# The map only stays open once the index is complete, so a failure here is raised again
+		# by the next random access rather than leaving it to trip over a half-built index
+		try:
+			if index is None and self._index_file:
+				index = self._load_index()
+
+			if index is None:
+				chunks = self._scan_chunks()
+				self._set_index(*chunks)
+				runs = [ self._scan_records(ch) for ch in range(self.nch) ]
+
+				if self._index_file:
+					self._save_index(chunks, runs)
+			else:
+				chunks, runs = index
+				self._set_index(*chunks)
+
+			self._chunks = chunks
+			self._runs = [ self._run_table(ch, *r) for ch, r in enumerate(runs) ]
+		except:
+			self._mmap.close()
+			self._mmap = None
+			raise
+
+	def _scan_chunks(self):
+		# Returns the payload offset, length and channel index of every chunk in the file
+		offsets, lengths, chs = [], [], []
+
+		m = self._mmap
+		pos = self._data_start
+		end = len(m)
+
+		while pos + 3 <= end:
+			ch, _len = struct.unpack_from("<BH", m, pos)
+
+			if pos + 3 + _len > end:
+				raise InvalidFileException("Unexpected EOF while reading data")
+
+			offsets.append(pos + 3)
+			lengths.append(_len)
+			chs.append(self.parser._chidx(ch))
+
+			pos += 3 + _len
+
+		return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.uint16), np.array(chs, dtype=np.uint8)
+
+	def _set_index(self, offsets, lengths, chs):
+		# Per channel we keep the chunk payload offsets and the running byte count of that
+		# channel's data stream at the start of each chunk.
+		self._chunk_offsets = []
+		self._chunk_starts = []
+
+		for ch in range(self.nch):
+			sel = chs == ch
+			self._chunk_offsets.append(offsets[sel])
+			self._chunk_starts.append(np.concatenate(([0], np.cumsum(lengths[sel], dtype=np.int64))))
+
+	def _channel_pieces(self, chidx, pos, end):
+		# Yields the channel's data stream between byte positions pos and end, as views of the
+		# mapped chunk payloads.
+		starts = self._chunk_starts[chidx]
+		offsets = self._chunk_offsets[chidx]
+		m = memoryview(self._mmap)
+		i = bisect_right(starts, pos) - 1
+
+		while pos < end:
+			take = int(min(starts[i + 1], end) - pos)
+			off = int(offsets[i] + pos - starts[i])
+			yield m[off:off + take]
+			pos += take
+			i += 1
+
+	def _scan_records(self, chidx):
+		# Find where each run of good records lies in the channel's data stream, re-syncing after
+		# a failed literal exactly as the sequential parser does. Returns the number of the first
+		# record in each run and the byte position of each run. Formats without literals can't
+		# slip so they're a single run.
+		reclen = self.parser.recordlen // 8
+		end = int(self._chunk_starts[chidx][-1])
+		recs, posns = [0], [0]
+		pos = rec = 0
+
+		if any(lit for _, _, _, lit in self.parser._plan):
+			window = _SCAN_BLOCK
+
+			while end - pos >= reclen:
+				n = min((end - pos) // reclen, window)
+				buf = b''.join(self._channel_pieces(chidx, pos, pos + n * reclen))
+				_, fail = self.parser._decode_records(buf, 0, n)
+				bad = np.flatnonzero(fail >= 0)
+
+				if not len(bad):
+					rec += n
+					pos += n * reclen
+					window = min(window * 2, _SCAN_BLOCK)
+					continue
+
+				first = int(bad[0])
+				rec += first
+				pos += first * reclen + int(fail[first]) // 8 + 1
+				window = 1
+
+				# A run of garbage ends several empty runs in a row, only the last one counts
+				if recs[-1] == rec:
+					posns[-1] = pos
+				else:
+					recs.append(rec)
+					posns.append(pos)
+
+		return np.array(recs, dtype=np.int64), np.array(posns, dtype=np.int64)
 
-		dhdr = self.file.read(3)
-		if len(dhdr) != 3:
+	def _run_table(self, chidx, recs, posns):
+		# The last run carries on to the end of the channel's data
+		reclen = self.parser.recordlen // 8
+		nrecs = int(recs[-1] + (self._chunk_starts[chidx][-1] - posns[-1]) // reclen)
+
+		return recs, posns, nrecs
+
+	def _record_at(self, chidx, pos):
+		# Number of the first record that starts at or after byte pos of the channel's data stream
+		reclen = self.parser.recordlen // 8
+		recs, posns, nrecs = self._runs[chidx]
+		i = bisect_right(posns, pos) - 1
+		rec = int(recs[i]) - (int(posns[i]) - pos) // reclen
+
+		return min(rec, int(recs[i + 1]) if i + 1 < len(recs) else nrecs)
+
+	def _index_filename(self):
+		return self.filename + '.idx'
+
+	def _save_index(self, chunks, runs):
+		# Sidecar layout: header of magic, data file size and mtime, chunk count and run count;
+		# then per chunk the payload offset, payload length and channel index; then per run of
+		# records (see _scan_records) the channel index, first record number and byte position.
+		# It's written to a temporary file first so a reader never sees half of one.
+		st = os.fstat(self.file.fileno())
+		fname = self._index_filename()
+		offsets, lengths, chs = chunks
+
+		runch = np.concatenate([ np.full(len(r[0]), ch) for ch, r in enumerate(runs) ])
+		runrec = np.concatenate([ r[0] for r in runs ])
+		runpos = np.concatenate([ r[1] for r in runs ])
+
+		try:
+			fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(fname) + '.', dir=os.path.dirname(os.path.abspath(fname)))
+
+			try:
+				with os.fdopen(fd, 'wb') as f:
+					f.write(struct.pack("<4sQdQQ", b'LIX2', st.st_size, st.st_mtime, len(offsets), len(runch)))
+					for arr, dt in [(offsets, '<i8'), (lengths, '<u2'), (chs, 'u1'), (runch, 'u1'), (runrec, '<i8'), (runpos, '<i8')]:
+						f.write(arr.astype(dt).tobytes())
+
+				os.chmod(tmpname, 0o644)
+				os.replace(tmpname, fname)
+			except:
+				os.remove(tmpname)
+				raise
+		except (IOError, OSError):
+			# Read-only media and the like, we'll just have to scan again next time
+			log.debug("Can't save chunk index %s", fname, exc_info=True)
+
+	def _load_index(self):
+		try:
+			with open(self._index_filename(), 'rb') as f:
+				d = f.read()
+		except (IOError, OSError):
+			return None
+
+		hdrlen = struct.calcsize("<4sQdQQ")
+		st = os.fstat(self.file.fileno())
+
+		try:
+			magic, size, mtime, n, r = struct.unpack_from("<4sQdQQ", d)
+		except struct.error:
+			return None
+
+		if magic != b'LIX2' or size != st.st_size or mtime != st.st_mtime or len(d) != hdrlen + n * 11 + r * 17:
+			log.debug("Stale or invalid chunk index %s", self._index_filename())
 			return None
 
-		ch, _len = struct.unpack("<BH", dhdr)
+		offsets = np.frombuffer(d, dtype='<i8', count=n, offset=hdrlen).astype(np.int64)
+		lengths = np.frombuffer(d, dtype='<u2', count=n, offset=hdrlen + 8 * n).astype(np.uint16)
+		chs = np.frombuffer(d, dtype='u1', count=n, offset=hdrlen + 10 * n).astype(np.uint8)
+
+		pos = hdrlen + 11 * n
+		runch = np.frombuffer(d, dtype='u1', count=r, offset=pos)
+		runrec = np.frombuffer(d, dtype='<i8', count=r, offset=pos + r).astype(np.int64)
+		runpos = np.frombuffer(d, dtype='<i8', count=r, offset=pos + 9 * r).astype(np.int64)
+
+		runs = [ (runrec[runch == ch], runpos[runch == ch]) for ch in range(self.nch) ]
+		if not all(len(rr) and rr[0] == 0 for rr, _ in runs):
+			return None
+
+		return (offsets, lengths, chs), runs
+
+	def chunk_index(self):
+		""" Returns the chunk index of the file, indexing it first if required.
+
+		:rtype: [(offset, channel, first record), ...]
+		:return: Byte offset of each chunk's data, the channel it belongs to and the number of
+			the first record it holds.
+		"""
+		self._build_index()
+
+		index = []
+		for ch in range(self.nch):
+			starts = [ self._record_at(ch, int(b)) for b in self._chunk_starts[ch][:-1] ]
+			index.extend(zip(self._chunk_offsets[ch].tolist(), [ch] * len(starts), starts))
+
+		return sorted(index)
+
+	def __len__(self):
+		""" Number of time-aligned records in the file. Indexes the file if it hasn't been already. """
+		self._build_index()
+
+		return int(min([ r[2] for r in self._runs ]))
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			r = range(*key.indices(len(self)))
+			if not len(r):
+				return self.read_range(0, 0)
+
+			lo = min(r[0], r[-1])
+			return [ d[r[0] - lo::r.step] for d in self.read_range(lo, max(r[0], r[-1]) + 1) ]
+
+		n = len(self)
+		if key < 0:
+			key += n
+		if not 0 <= key < n:
+			raise IndexError("Record %d out of range" % key)
+
+		return [ d.tolist()[0] for d in self.read_range(key, key + 1) ]
+
+	def _read_channel_range(self, chidx, start, stop):
+		return _as_array(self._read_channel_cols(chidx, start, stop))
+
+	def _read_channel_cols(self, chidx, start, stop):
+		parser = self.parser
+		reclen = parser.recordlen // 8
+		recs, posns, nrecs = self._runs[chidx]
+
+		blocks = []
+		i = bisect_right(recs, start) - 1
+
+		# Records are contiguous within each run, which were all checked when the file was indexed
+		while start < stop:
+			last = min(stop, int(recs[i + 1]) if i + 1 < len(recs) else stop)
+			pos = int(posns[i] + (start - recs[i]) * reclen)
+			carry = b''
 
-		d = self.file.read(_len)
+			for piece in self._channel_pieces(chidx, pos, pos + (last - start) * reclen):
+				# Records straddling a chunk boundary are the only bytes copied, everything
+				# else is decoded directly from the mapping.
+				if len(carry):
+					need = reclen - len(carry)
+					carry += piece[:need].tobytes()
+					piece = piece[need:]
+
+					if len(carry) < reclen:
+						continue
+
+					blocks.append(parser._decode_records(carry, 0, 1)[0])
+					carry = b''
+
+				n = len(piece) // reclen
+				if n:
+					blocks.append(parser._decode_records(piece, 0, n)[0])
+				carry = piece[n * reclen:].tobytes()
+
+			start = last
+			i += 1
+
+		cols = []
+		for field, fn in enumerate(parser._procfns[chidx]):
+			if field >= len(parser._coltypes):
+				break
+
+			col = [ c[field] for c in blocks ]
+			col = np.concatenate(col) if len(col) else np.array([], dtype=parser._coltypes[field])
+			cols.append(fn(col))
+
+		return cols
+
+	def read_range(self, start, stop):
+		""" Read a range of records from anywhere in the file.
+
+		Records are numbered as they would be by :any:`read`, re-syncing after any that fail a
+		literal check. For record formats with literals, finding where those are means the whole
+		file is decoded once when it's first indexed.
+
+		:type start: int
+		:param start: Index of first record to read
+		:type stop: int
+		:param stop: Index one past the last record to read, clipped to the file length
+		:returns: [ch1_data, ...], one NumPy array per channel. A structured array with one
+			field per record element if the records have more than one element.
+		"""
+		stop = min(stop, len(self))
+		start = min(max(start, 0), stop)
+
+		return [ self._read_channel_range(ch, start, stop) for ch in range(self.nch) ]
+
+
+	def _read_framed(self, hdrfmt):
+		# Read a header, whose last field is the payload length, and the payload that follows.
+		# Returns (other header fields, payload) or None at the end of the file. When following
+		# a file that's still being written, an incomplete payload is left to be read again
+		# later rather than being an error.
+		start = self.file.tell()
+		hlen = struct.calcsize(hdrfmt)
+
+		hdr = self.file.read(hlen)
+		if len(hdr) == hlen:
+			fields = struct.unpack(hdrfmt, hdr)
+			d = self.file.read(fields[-1])
+
+			if len(d) == fields[-1]:
+				return fields[:-1], d
+			elif not self._following:
+				raise InvalidFileException("Unexpected EOF while reading data")
+
+		if self._following:
+			self.file.seek(start)
+
+		return None
+
+	def _read_frame(self):
+		# Read and decompress the next frame of a compressed file, False at the end of the file
+		f = self._read_framed("<BI")
+		if f is None:
+			return False
+
+		(codec, ), d = f
+
+		try:
+			self._frame = _decompress(codec, d)
+		except zlib.error:
+			raise InvalidFileException("Corrupt compressed frame")
+		self._framepos = 0
+
+		return True
+
+	def _read_frame_chunk(self):
+		while self._framepos == len(self._frame):
+			if not self._read_frame():
+				return None
+
+		pos = self._framepos
+		if pos + 3 > len(self._frame):
+			raise InvalidFileException("Chunk overruns compressed frame")
+
+		ch, _len = struct.unpack_from("<BH", self._frame, pos)
+		d = self._frame[pos + 3:pos + 3 + _len]
 
 		if len(d) != _len:
-			raise InvalidFileException("Unexpected EOF while reading data")
+			raise InvalidFileException("Chunk overruns compressed frame")
+
+		self._framepos = pos + 3 + _len
+
+		return ch, d
+
+	def _read_chunk(self):
+		if self._compressed:
+			return self._read_frame_chunk()
+
+		c = self._read_framed("<BH")
+		if c is None:
+			return None
+
+		(ch, ), d = c
+		return ch, d
+
+	def follow(self, block_size=65536, poll_interval=0.1, max_interval=2.0, timeout=None):
+		""" Follow a file that's still being written, yielding records as they're completed.
+
+		Records are read from the current position, as by :any:`iter_blocks`. When there's no
+		more data the file is polled for growth, starting at *poll_interval* and backing off to
+		*max_interval* while it stays idle. A partially written chunk is left until the rest of it
+		arrives.
+
+		:type block_size: int
+		:param block_size: Maximum number of records per block
+		:type poll_interval: float
+		:param poll_interval: Initial time in seconds to wait before checking for new data
+		:type max_interval: float
+		:param max_interval: Longest time in seconds to wait between checks
+		:type timeout: float
+		:param timeout: Stop once no new data has arrived for this many seconds, None to follow forever.
+		:returns: generator of (t, [ch1_data, ...]) as for :any:`read_block`.
+		"""
+		if self._ra_thread is not None:
+			raise ValueError("Can't follow a file with read-ahead enabled")
+
+		self._following = True
+		interval = poll_interval
+		last_data = time.time()
+
+		try:
+			while True:
+				got = False
+				size = os.fstat(self.file.fileno()).st_size
+
+				for b in self.iter_blocks(block_size):
+					got = True
+					yield b
+
+				if got:
+					interval = poll_interval
+					last_data = time.time()
+					continue
 
+				if timeout is not None and time.time() - last_data >= timeout:
+					return
+
+				# Only go back to the parser once the file has actually grown
+				while os.fstat(self.file.fileno()).st_size == size:
+					if timeout is not None and time.time() - last_data >= timeout:
+						return
+
+					time.sleep(interval)
+					interval = min(interval * 2, max_interval)
+		finally:
+			self._following = False
+
+	def _parse_chunk(self):
+		if self._ra_thread is not None:
+			return self._readahead_chunk()
+
+		c = self._read_chunk()
+		if c is None:
+			return None
+
+		ch, d = c
 		self.parser.parse(d, ch)
 
 		return ch
 
-	def _process_chunk(self):
-		ch = self._parse_chunk()
+	def _readahead_chunk(self):
+		if self._ra_done:
+			return None
 
-		if ch is None:
-			return False
+		try:
+			item = self._ra_queue.get_nowait()
+		except Empty:
+			t = time.time()
+			item = self._ra_queue.get()
+			self._ra_stall += time.time() - t
+
+		if item is None or isinstance(item, Exception):
+			self._ra_done = True
+
+			if item is not None:
+				raise item
+
+			return None
+
+		ch, nbytes, blocks = item
+		self.parser._pblocks[self.parser._chidx(ch)].extend(blocks)
+		self._ra_bytes += nbytes
+
+		return ch
 
-		self.records[ch].extend(self.parser.processed[ch])
+	def _move_processed(self):
+		for recs, new in zip(self.records, self.parser.processed):
+			recs.extend(new)
 
 		# Now that we've copied the records in to our own storage, free them from
 		# the parser.
 		self.parser.clear_processed()
 
+	def _unread_records(self):
+		# Hand records already copied out by read() back to the parser, as the first block
+		# of columns for their channel.
+		for recs, blocks in zip(self.records, self.parser._pblocks):
+			if not len(recs):
+				continue
+
+			if isinstance(recs[0], tuple):
+				cols = [ np.array(c) for c in zip(*recs) ]
+			else:
+				cols = [ np.array(list(recs)) ]
+
+			blocks.insert(0, cols)
+			recs.clear()
+
+	def _process_chunk(self):
+		ch = self._parse_chunk()
+
+		if ch is None:
+			return False
+
+		self._move_processed()
+
 		return True
 
 	def read(self):
 		""" Read a single record from the file
 		:returns: [ch1_record, ...]
 		"""
+		self._move_processed()
+
 		while not all([ len(r) >= 1 for r in self.records]):
 			if not self._process_chunk():
 				break
@@ -177,10 +782,75 @@ class LIDataFileReader(object):
 
 		rec = []
 		for r in self.records:
-			rec.append(r.pop(0))
+			rec.append(r.popleft())
+
+		self._nread += 1
 
 		return rec
 
+	def _take_block(self, n):
+		# Parse until n time-aligned records are ready on every channel, or the file runs out,
+		# then remove up to n of them from the parser. Returns the number of the first record
+		# and the columns of each channel, or (None, None) at the end of the file.
+		self._unread_records()
+		parser = self.parser
+		counts = [ sum([ len(b[0]) for b in blocks ]) for blocks in parser._pblocks ]
+
+		while min(counts) < n:
+			ch = self._parse_chunk()
+			if ch is None:
+				break
+
+			chidx = parser._chidx(ch)
+			blocks = parser._pblocks[chidx]
+			counts[chidx] = sum([ len(b[0]) for b in blocks ])
+
+		k = min(min(counts), n)
+		if not k:
+			return None, None
+
+		n0 = self._nread
+		self._nread += k
+
+		return n0, parser._take_processed(k)
+
+	def read_block(self, n):
+		""" Read a block of up to n time-aligned records from the file as arrays.
+
+		Shares its position in the file with :any:`read` so the two may be mixed.
+
+		:type n: int
+		:param n: Maximum number of records to read
+		:returns: (t, [ch1_data, ...]) where t is the absolute time of each record in seconds
+			(from :any:`starttime` and :any:`deltat`) and there's one NumPy array per channel.
+			Multi-element records, such as the Phasemeter's, give a structured array with one
+			field per element. None at the end of the file.
+		"""
+		n0, chcols = self._take_block(n)
+
+		if n0 is None:
+			return None
+
+		return self._times(n0, len(chcols[0][0])), [ _as_array(c) for c in chcols ]
+
+	def _times(self, n0, n):
+		# Absolute time of n records starting from record n0
+		return self.starttime + np.arange(n0, n0 + n) * self.deltat
+
+	def iter_blocks(self, block_size=65536):
+		""" Iterate over the rest of the file in blocks of records, as returned by :any:`read_block`.
+
+		:type block_size: int
+		:param block_size: Number of records per block. The last may be shorter.
+		"""
+		while True:
+			b = self.read_block(block_size)
+
+			if b is None:
+				return
+
+			yield b
+
 	def readall(self):
 		""" Returns an array containing all the data from the file.
 
@@ -195,18 +865,235 @@ class LIDataFileReader(object):
 
 	def close(self):
 		""" Safely close the file"""
+		if self._ra_thread is not None:
+			self._ra_stop.set()
+			self._ra_thread.join()
+			self._ra_thread = None
+
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
 		self.file.close()
 
-	def to_csv(self, fname):
+	def to_csv(self, fname, workers=None):
 		""" Dump the contents of this data file as a CSV.
 
+		Conversion starts from the reader's current position, so records already taken with
+		:any:`read` or :any:`read_block` are left out.
+
+		With *workers*, the file is split at chunk boundaries and the pieces are decoded and
+		formatted in that many processes. The reader's own position isn't moved in that case.
+		Record formats that can't be randomly accessed are always converted in this process.
+
 		:param fname: Output CSV filename.
+		:type workers: int
+		:param workers: Number of worker processes to use, None to convert in this process.
 		"""
-		try: os.remove(fname)
-		except OSError: pass
-		# Don't actually care about the chunk contents, just that it's been loaded
-		while self._parse_chunk() is not None:
-			self.parser.dump_csv(fname)
+		with open(fname, 'w') as f:
+			if self._use_workers(workers):
+				# Just the header, everything from the current position on comes from the workers
+				f.write(self.parser.dout)
+				self.parser.dout = ''
+
+				size = max((len(self) - self._nread) // (workers * 8), 4096)
+				for n0, csv in self._parallel_ranges(workers, size, True, self._nread):
+					f.write(csv)
+
+				return
+
+			# Records already parsed but not yet read go first, numbered on from those that were
+			self._unread_records()
+			self.parser.fmtdict['n'] = self._nread
+
+			# Don't actually care about the chunk contents, just that it's been loaded
+			while self._parse_chunk() is not None:
+				f.write(self.parser.dump_csv())
+
+			f.write(self.parser.dump_csv())
+
+	def _use_workers(self, workers):
+		if not workers or workers < 2:
+			return False
+
+		if self._compressed or self.parser._plan is None:
+			log.info("%s can't be converted in parallel, converting in one process", self.filename)
+			return False
+
+		return True
+
+	def _split_ranges(self, size, start=0):
+		# Split the file from record start in to ranges of at least size records (bar the last),
+		# cut where the first channel's chunks start.
+		n = len(self)
+
+		cuts = [start]
+		for b in [ self._record_at(0, int(p)) for p in self._chunk_starts[0][:-1] ]:
+			if b - cuts[-1] >= size and b < n:
+				cuts.append(b)
+
+		if n > cuts[-1]:
+			cuts.append(n)
+
+		return list(zip(cuts[:-1], cuts[1:]))
+
+	def _parallel_ranges(self, workers, size, csv, start=0):
+		# Decode (and optionally format) ranges of records from start in a process pool,
+		# yielding (first record number, result) in file order. Only a few ranges per worker
+		# are in flight at once so memory use stays bounded.
+		self._build_index()
+
+		ranges = deque(self._split_ranges(size, start))
+		pending = deque()
+		# Workers share this reader's index so they don't each have to scan the file again
+		pool = multiprocessing.Pool(workers, _worker_init, (self.filename, (self._chunks, [ r[:2] for r in self._runs ])))
+
+		try:
+			while len(ranges) or len(pending):
+				while len(ranges) and len(pending) < 2 * workers:
+					lo, hi = ranges.popleft()
+					pending.append((lo, pool.apply_async(_worker_convert, (lo, hi, csv))))
+
+				lo, res = pending.popleft()
+				yield lo, res.get()
+
+			pool.close()
+		finally:
+			pool.terminate()
+			pool.join()
+
+	def _column_dtypes(self):
+		# Output type of each processed field, found by running empty columns through the
+		# processing. Anything left as Python objects is exported as double.
+		dtypes = []
+		for ch in range(self.nch):
+			dts = []
+			for fn, t in zip(self.parser._procfns[ch], self.parser._coltypes):
+				dt = fn(np.array([], dtype=t)).dtype
+				dts.append(np.dtype(np.float64) if dt == object else dt)
+			dtypes.append(dts)
+
+		return dtypes
+
+	def _column_names(self, nfields):
+		# The CSV headers name the time column then each field of each channel in turn. If they
+		# don't line up with the data, fall back to generic names.
+		names = [ h.strip() for h in self.headers ]
+
+		if len(names) == 1 + sum(nfields) and len(set(names)) == len(names) and all(names):
+			return names
+
+		names = ['t']
+		for ch, n in enumerate(nfields):
+			if n == 1:
+				names.append('ch%d' % (ch + 1))
+			else:
+				names.extend([ 'ch%d_%d' % (ch + 1, i) for i in range(n) ])
+
+		return names
+
+	def _column_blocks(self, block_size, workers=None):
+		# Stream the file as blocks of time-aligned columns: (first record number, [time,
+		# ch1 field 0, ch1 field 1, ..., ch2 field 0, ...]).
+		if self._use_workers(workers):
+			blocks = self._parallel_ranges(workers, block_size, False, self._nread)
+		else:
+			blocks = iter(lambda: self._take_block(block_size), (None, None))
+
+		for n0, chcols in blocks:
+			cols = [ self._times(n0, len(chcols[0][0])) ]
+			for c in chcols:
+				cols.extend(c)
+
+			yield n0, cols
+
+	def export(self, path, format='hdf5', block_size=65536, workers=None):
+		""" Export the contents of this data file to columnar storage.
+
+		Records are decoded and written a block at a time so memory use is bounded regardless
+		of the length of the file. There's one column for time, in seconds since the epoch as
+		from :any:`read_block`, then one for each element of each channel's records, named
+		from :any:`headers`. As for :any:`to_csv`, the export starts from the reader's current
+		position.
+
+		- *hdf5* writes a chunked, gzip-compressed compound dataset *moku:datalog*, with the
+		  capture details as attributes. Requires h5py.
+		- *parquet* writes one Snappy-compressed row group per block, with the capture details
+		  as file metadata. Requires pyarrow.
+		- *npy* writes a structured NumPy array, readable with :any:`numpy.load`.
+
+		:type path: str
+		:param path: Output filename
+		:type format: str; {'hdf5', 'parquet', 'npy'}
+		:param format: Output format
+		:type block_size: int
+		:param block_size: Number of records to decode and write at once
+		:type workers: int
+		:param workers: Number of processes to decode with, as for :any:`to_csv`.
+
+		:raises ValueError: if the format isn't known.
+		:raises ImportError: if the format requires a library that isn't installed.
+		"""
+		if format not in ('hdf5', 'parquet', 'npy'):
+			raise ValueError("Unknown export format '%s'" % format)
+
+		dtypes = self._column_dtypes()
+		names = self._column_names([ len(d) for d in dtypes ])
+		dtype = np.dtype(list(zip(names, [np.float64] + [ d for dts in dtypes for d in dts ])))
+
+		attrs = {
+			'timestep': self.deltat,
+			'start_secs': self.starttime,
+			'start_time': datetime.datetime.fromtimestamp(self.starttime).strftime('%c'),
+			'instrument': self.instr,
+			'instrument_version': self.instrv,
+		}
+
+		def _rows(cols):
+			rows = np.empty(len(cols[0]), dtype=dtype)
+			for name, c in zip(names, cols):
+				rows[name] = c
+			return rows
+
+		if format == 'hdf5':
+			import h5py
+
+			with h5py.File(path, 'w') as f:
+				ds = f.create_dataset('moku:datalog', (0,), dtype=dtype, maxshape=(None,),
+					chunks=(min(block_size, 65536),), compression='gzip', shuffle=True)
+				ds.attrs.update(attrs)
+
+				n = 0
+				for n0, cols in self._column_blocks(block_size, workers):
+					ds.resize((n + len(cols[0]),))
+					ds[n:] = _rows(cols)
+					n += len(cols[0])
+
+		elif format == 'parquet':
+			import pyarrow as pa, pyarrow.parquet as pq
+
+			schema = pa.schema([ (n, pa.from_numpy_dtype(dtype[n])) for n in names ],
+				metadata={ k: str(v) for k, v in attrs.items() })
+
+			with pq.ParquetWriter(path, schema, compression='snappy') as w:
+				for n0, cols in self._column_blocks(block_size, workers):
+					w.write_table(pa.Table.from_arrays([ np.asarray(c, dtype=dtype[n]) for n, c in zip(names, cols) ], schema=schema))
+
+		elif format == 'npy':
+			# The record count isn't known until the end, so space for the largest possible
+			# header is reserved and it's rewritten once the data's in.
+			hdrlen = len(_npy_header(dtype, 2**63))
+
+			with open(path, 'wb') as f:
+				f.write(b' ' * hdrlen)
+				n = 0
+
+				for n0, cols in self._column_blocks(block_size, workers):
+					f.write(_rows(cols).tobytes())
+					n += len(cols[0])
+
+				f.seek(0)
+				f.write(_npy_header(dtype, n, hdrlen))
 
 	def __iter__(self):
 		return self
@@ -222,18 +1109,90 @@ class LIDataFileReader(object):
 	next = __next__ # Python 2/3 translation
 
 	def __enter__(self):
-		pass
+		return self
 
-	def __exit__(self):
+	def __exit__(self, *args):
 		self.close()
 
 
+# Number of records checked at once when looking for literal mismatches in a file being indexed
+_SCAN_BLOCK = 65536
+
+# Each conversion worker process keeps its own reader open on the file for the
+# life of the pool.
+_worker_reader = None
+
+def _worker_init(filename, index):
+	global _worker_reader
+	_worker_reader = LIDataFileReader(filename)
+	_worker_reader._build_index(index)
+
+def _worker_convert(start, stop, csv):
+	reader = _worker_reader
+	cols = [ reader._read_channel_cols(ch, start, stop) for ch in range(reader.nch) ]
+
+	if csv:
+		return reader.parser._format_columns(cols, start)
+
+	return cols
+
+def _npy_header(dtype, n, size=0):
+	# NPY v1.0 header for a 1D array of n elements of dtype, padded to size bytes (or the
+	# format's 64-byte alignment).
+	d = repr({ 'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (n,) })
+	size = size or -(-(len(d) + 11) // 64) * 64
+	d += ' ' * (size - len(d) - 11) + '\n'
+
+	return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(d)) + d.encode('latin1')
+
+# Compression codecs for version 2 LI files. Each compressed frame starts with the codec
+# ID and length, and holds a whole number of ordinary chunks.
+_LI_CODECS = { None: 0, 'zlib': 1, 'zstd': 2 }
+
+# Data collected in to each compressed frame if no buffer size is given
+_LI_FRAME_SIZE = 65536
+
+def _compressor(codec):
+	if codec == 1:
+		return zlib.compress
+	elif codec == 2:
+		import zstandard
+		return zstandard.ZstdCompressor().compress
+
+def _decompress(codec, data):
+	if codec == 1:
+		return zlib.decompress(data)
+	elif codec == 2:
+		import zstandard
+		return zstandard.ZstdDecompressor().decompress(data)
+	else:
+		raise InvalidFileException("Unknown compression codec %d" % codec)
+
+def _as_array(cols):
+	# Single-element records come back as a plain array, otherwise as a structured array
+	# with fields f0, f1, ...
+	if len(cols) == 1:
+		return cols[0]
+
+	arr = np.empty(len(cols[0]) if len(cols) else 0, dtype=[ ('f%d' % i, c.dtype) for i, c in enumerate(cols) ])
+	for i, c in enumerate(cols):
+		arr['f%d' % i] = c
+
+	return arr
+
+
 class LIDataFileWriter(object):
 	""" Eases the creation of LI format data files."""
-	def __init__(self, filename, instr, instrv, chs, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime):
+	def __init__(self, filename, instr, instrv, chs, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime, buffer_size=0, flush_interval=None, compression=None):
 		""" Create object and write the header information.
 		Not designed for general use, is likely to only be of utility in the Moku:Lab firmware.
 
+		By default every chunk is written as it's added. With a *buffer_size*, chunks are
+		collected and written out in blocks of that size, aligned to multiples of it in the
+		file. With *compression*, the collected chunks are compressed and written as one frame
+		whenever *buffer_size* bytes (64kB by default) have built up; such files are version 2
+		and can only be read sequentially.
+
 		:param filename: Output file name
 		:param instr: Numeric instrument identifier
 		:param instrv: Numberic instrument version
@@ -245,53 +1204,106 @@ class LIDataFileWriter(object):
 		:param calcoeffs: Array of calibration coefficients for the data being acquired
 		:param timestep: Time between records being captured
 		:param starttime: Time at which the record was started, seconds since Jan 1 1970
+		:param buffer_size: Number of bytes to collect before writing, 0 to write every chunk immediately
+		:param flush_interval: Time in seconds after which buffered data is written out, None for no limit. This is checked each time data is added, so data added last stays buffered until the next :any:`add_data`, :any:`flush` or :any:`finalize`.
+		:param compression: None, 'zlib' or 'zstd' (requires the zstandard package)
 		"""
+		if compression not in _LI_CODECS:
+			raise ValueError("Unknown compression '%s'" % compression)
+
+		self._codec = _LI_CODECS[compression]
+		self._buffer_size = buffer_size or (_LI_FRAME_SIZE if self._codec else 0)
+		self._flush_interval = flush_interval
+		self._compress = _compressor(self._codec)
+		self._buf = bytearray()
+		self._last_flush = time.time()
+
 		self.file = open(filename, 'wb')
+
+		def _b(s):
+			# Header strings may be given as text or bytes, they're stored as ASCII
+			return s.encode('ascii') if isinstance(s, str) else s
+
 		nch = 0
 		if (chs & 0x01):
 			nch +=1
 		if (chs & 0x02):
 			nch +=1
 		
-		self.file.write(b'LI1')
+		self.file.write(b'LI2' if self._codec else b'LI1')
 		hdr = struct.pack("<BBHdQ", chs, instr, instrv, timestep, starttime)
 
 		for i in range(nch):
 			hdr += struct.pack('<d', calcoeffs[i])
 
-		hdr += struct.pack("<H", len(binstr)) + binstr
+		hdr += struct.pack("<H", len(binstr)) + _b(binstr)
 
 		for i in range(nch):
-			hdr += struct.pack("<H", len(procstr[i])) + procstr[i]
-			
-		hdr += struct.pack("<H", len(fmtstr)) + fmtstr
-		hdr += struct.pack("<H", len(hdrstr)) + hdrstr
+			hdr += struct.pack("<H", len(procstr[i])) + _b(procstr[i])
+
+		hdr += struct.pack("<H", len(fmtstr)) + _b(fmtstr)
+		hdr += struct.pack("<H", len(hdrstr)) + _b(hdrstr)
 
 		self.file.write(struct.pack("<H", len(hdr)))
 		self.file.write(hdr)
 
+		self._pos = self.file.tell()
+
 	def add_data(self, data, ch, flush=False):
 		""" Append a data chunk to the open file.
 
 		:param data: Bytestring of new data
 		:param ch: Channel number to which the data belongs (0-indexed)
+		:param flush: Write out anything buffered and flush the file
 		"""
-		self.file.write(struct.pack("<BH", ch, len(data)))
-		self.file.write(data)
-
-		if flush:
-			self.file.flush()
+		self._buf += struct.pack("<BH", ch, len(data))
+		self._buf += data
+
+		if flush or self._flush_interval is not None and time.time() - self._last_flush >= self._flush_interval:
+			self.flush()
+		elif len(self._buf) >= self._buffer_size:
+			self._write_buffer(False)
+
+	def _write_buffer(self, partial):
+		# Write out the buffer, holding back anything past the last block boundary unless
+		# partial writes are allowed. Compressed frames are written whole.
+		if self._codec:
+			d = self._compress(bytes(self._buf))
+			self._buf = bytearray()
+			self.file.write(struct.pack("<BI", self._codec, len(d)) + d)
+			return
+
+		end = self._pos + len(self._buf)
+		if not partial and self._buffer_size:
+			end -= end % self._buffer_size
+
+		n = end - self._pos
+		if n > 0:
+			self.file.write(self._buf[:n])
+			del self._buf[:n]
+			self._pos = end
+
+	def flush(self):
+		""" Write out any buffered data and flush the file. """
+		if len(self._buf):
+			self._write_buffer(True)
+
+		self.file.flush()
+		self._last_flush = time.time()
 
 	def finalize(self):
 		"""
 		Save and close the file.
 		"""
+		if len(self._buf):
+			self._write_buffer(True)
+
 		self.file.close()
 
 	def __enter__(self):
-		pass
+		return self
 
-	def __exit__(self):
+	def __exit__(self, *args):
 		self.finalize()
 
 class LIDataParser(object):
@@ -346,6 +1358,139 @@ class LIDataParser(object):
 
 		return fmt
 
+	@staticmethod
+	def _compile_procfmt(procfmt):
+		""" Compiles the output of :any:`_parse_procstr` in to one callable per field, each of
+		which applies that field's operations to a whole column of values at once.
+
+		Integer and float columns go through the NumPy ufuncs. Anything else (unsigned 64-bit
+		or wider fields), an integer column whose values would overflow 64 bits, or a column that
+		would have to be floored or ceilinged in to an integer outside 64 bits, is processed
+		element-wise as Python numbers so the results don't wrap. So are square roots of columns
+		with negative values, so those raise ValueError rather than giving NaN. """
+		return [ LIDataParser._compile_clause(ops) for ops in procfmt ]
+
+	@staticmethod
+	def _compile_clause(ops):
+		def _div(v, lit):
+			# Integer division stays integer, as it always has
+			if v.dtype.kind in 'biu' and isinstance(lit, int):
+				return v // lit
+			return v / lit
+
+		def _pow(v, lit):
+			# NumPy won't raise integers to negative integer powers, Python gives a float
+			if v.dtype.kind in 'biu' and isinstance(lit, int) and lit < 0:
+				v = v.astype(np.float64)
+			return v ** lit
+
+		def _round(fn, v):
+			# Integers are already whole, and going via a float would lose precision
+			if v.dtype.kind in 'biu':
+				return v.astype(np.int64)
+			return fn(v).astype(np.int64)
+
+		def _pydiv(v, lit):
+			return v // lit if isinstance(v, int) and isinstance(lit, int) else v / lit
+
+		# Each operation in both vectorised and element-wise form
+		optable = {
+			'*' : (lambda v, lit: v * lit,					lambda v, lit: v * lit),
+			'/' : (_div,									_pydiv),
+			'+' : (lambda v, lit: v + lit,					lambda v, lit: v + lit),
+			'-' : (lambda v, lit: v - lit,					lambda v, lit: v - lit),
+			'&' : (lambda v, lit: v & lit,					lambda v, lit: v & lit),
+			's' : (lambda v, lit: np.sqrt(v),				lambda v, lit: math.sqrt(v)),
+			'f' : (lambda v, lit: _round(np.floor, v),		lambda v, lit: int(math.floor(v))),
+			'c' : (lambda v, lit: _round(np.ceil, v),		lambda v, lit: int(math.ceil(v))),
+			'^' : (_pow,									lambda v, lit: v**lit),
+		}
+
+		steps = []
+		for op, lit in ops:
+			try:
+				steps.append((op, ) + optable[op] + (lit,))
+			except KeyError:
+				raise InvalidFormatException("Don't recognize operation %s" % op)
+
+		if not len(steps):
+			return lambda col: col
+
+		def _pyapply(val, first=0):
+			for _, _, fn, lit in steps[first:]:
+				val = fn(val, lit)
+			return val
+
+		def _wraps(col, fn, lit):
+			# Python ints don't wrap but int64 does. The integer operations are all monotonic over
+			# a column's range, so trying them on its extremes is enough to tell.
+			if not len(col):
+				return False
+
+			for v in (int(col.min()), int(col.max())):
+				r = fn(v, lit)
+				if isinstance(r, int) and not -2**63 <= r < 2**63:
+					return True
+
+			return False
+
+		def _unsafe(col, op, pyfn, lit):
+			# Whether the NumPy form of an operation would give a different answer to Python's,
+			# either by wrapping or by quietly returning NaN where Python raises
+			if col.dtype.kind in 'bi' and op in '*/+-^' and isinstance(lit, int):
+				return _wraps(col, pyfn, lit)
+
+			if col.dtype.kind == 'f' and op in 'fc':
+				return len(col) and not (np.isfinite(col).all() and -2**63 <= col.min() and col.max() < 2**63)
+
+			if op == 's':
+				return len(col) and (col < 0).any()
+
+			return False
+
+		def _apply(col):
+			if col.dtype.kind not in 'bif':
+				return np.frompyfunc(_pyapply, 1, 1)(col.astype(object))
+
+			for i, (op, fn, pyfn, lit) in enumerate(steps):
+				# Columns the vectorised operation can't handle exactly are finished off element-wise
+				if _unsafe(col, op, pyfn, lit):
+					return np.frompyfunc(lambda v, i=i: _pyapply(v, i), 1, 1)(col.astype(object))
+
+				col = fn(col, lit)
+			return col
+
+		return _apply
+
+	@staticmethod
+	def _compile_binfmt(binfmt):
+		""" Builds a plan for decoding whole blocks of records at once from the output of
+		:any:`_parse_binstr`.
+
+		The plan is a list of (type, bit offset, bit length, literal) tuples, one per field. Returns
+		None if the format can't be decoded in bulk, in which case the bit-string walker must be used.
+		That's the case for records that aren't a whole number of bytes long, fields longer than
+		64 bits, types other than u, s, f, b and p, and literals that don't start on a byte boundary
+		(the walker re-syncs a byte at a time from the start of a failed literal). """
+		plan = []
+		offset = 0
+
+		for _type, _len, lit in binfmt:
+			if _type not in 'usfbp' or not 0 < _len <= 64:
+				return None
+			if _type == 'f' and _len not in (32, 64):
+				return None
+			if lit and offset % 8:
+				return None
+
+			plan.append((_type, offset, _len, lit))
+			offset += _len
+
+		if offset % 8:
+			return None
+
+		return plan
+
 
 	def __init__(self, ch1, ch2, binstr, procstr, fmtstr, hdrstr, deltat, starttime, calcoeffs):
 
@@ -354,6 +1499,24 @@ class LIDataParser(object):
 
 		self.binfmt = LIDataParser._parse_binstr(binstr)
 		self.recordlen = sum(list(zip(*self.binfmt))[1])
+		self._plan = LIDataParser._compile_binfmt(self.binfmt)
+
+		# Column types for decoded, non-padding fields. Anything that doesn't fit a native type
+		# (only possible through the bit-string walker) is kept as Python objects.
+		self._coltypes = []
+		for _type, _len, lit in self.binfmt:
+			if _type == 'p':
+				continue
+			elif _type == 'f' and _len in (32, 64):
+				self._coltypes.append(np.float64)
+			elif _type == 'b':
+				self._coltypes.append(bool)
+			elif _type == 's' and _len <= 64 or _type == 'u' and _len < 64:
+				self._coltypes.append(np.int64)
+			elif _type == 'u' and _len == 64:
+				self._coltypes.append(np.uint64)
+			else:
+				self._coltypes.append(object)
 		self.procstr = procstr
 
 		self.nch = 0
@@ -366,8 +1529,10 @@ class LIDataParser(object):
 			self.nch += 1
 
 		self.procfmt = []
+		self._procfns = []
 		for ch in range(self.nch):
 			self.procfmt.append(LIDataParser._parse_procstr(procstr[ch], calcoeffs[ch]))
+			self._procfns.append(LIDataParser._compile_procfmt(self.procfmt[ch]))
 
 		self.fmtdict = {
 			'T' : time.strftime('%c %Z', time.localtime(starttime)), # Standard repr plus explicit timezone
@@ -377,73 +1542,191 @@ class LIDataParser(object):
 		}
 		self.fmt = fmtstr
 		self.dout = hdrstr.format(**self.fmtdict)
+		self._fmtplan = self._compile_fmt()
 
 		# We should be doing this based on number of channels
-		self.dcache 	= ['' for x in range(self.nch)]
-		self.records 	= [[] for x in range(self.nch)]
-		self.processed 	= [[] for x in range(self.nch)]
+		# Bit-level decoder state: unconsumed bytes, bit cursor in to them, and the field
+		# index and values of the record being decoded.
+		self._bitbuf	= [bytearray() for x in range(self.nch)]
+		self._bitpos	= [0 for x in range(self.nch)]
+		self._currfield	= [0 for x in range(self.nch)]
 		self._currecord = [[] for x in range(self.nch)]
-		self._currfmt 	= [[] for x in range(self.nch)]
+
+		# Decoded records are held as blocks of columns, one NumPy array per non-padding
+		# field, until they're processed. The vectorised decoder holds back any trailing
+		# bytes that don't form a whole record yet. Processed records are held the same way
+		# until the consumer clears them.
+		self._blocks	= [[] for x in range(self.nch)]
+		self._bcache	= [b'' for x in range(self.nch)]
+		self._pblocks	= [[] for x in range(self.nch)]
+
+	@property
+	def records(self):
+		""" Decoded but unprocessed records for each channel, as lists of field values """
+		recs = []
+
+		for blocks in self._blocks:
+			recs.append([ list(r) for cols in blocks for r in zip(*[ c.tolist() for c in cols ]) ])
+
+		return recs
+
+	@property
+	def processed(self):
+		""" Processed records for each channel. Each record is a tuple of field values, or a
+		bare value for single-field records. """
+		recs = []
+
+		for blocks in self._pblocks:
+			chrecs = []
+			for cols in blocks:
+				if len(cols) > 1:
+					chrecs.extend(zip(*[ c.tolist() for c in cols ]))
+				else:
+					chrecs.extend(cols[0].tolist())
+			recs.append(chrecs)
+
+		return recs
 
 	def _process_records(self):
-		#for ch in [0, 1]:
 		for ch in range(self.nch):
-			for record in self.records[ch]:
-				rec = []
-				for field, ops in zip(record, self.procfmt[ch]):
-					val = field
-					for op, lit in ops:
-						if   op == '*': val *= lit
-						elif op == '/': val /= lit
-						elif op == '+': val += lit
-						elif op == '-': val -= lit
-						elif op == '&': val &= lit
-						elif op == 's': val = math.sqrt(val)
-						elif op == 'f': val = int(math.floor(val))
-						elif op == 'c': val = int(math.ceil(val))
-						elif op == '^': val = val**lit
-						else: raise InvalidFormatException("Don't recognize operation %s", op)
-
-					rec.append(val)
-
-				if len(rec) > 1:
-					self.processed[ch].append(tuple(rec))
-				else:
-					self.processed[ch].append(rec[0])
+			for cols in self._blocks[ch]:
+				pcols = [ fn(c) for c, fn in zip(cols, self._procfns[ch]) ]
+				if len(pcols):
+					self._pblocks[ch].append(pcols)
 
 		# Remove all processed records
-		self.records = [[] for x in range(self.nch)]
+		self._blocks = [[] for x in range(self.nch)]
+
+	def _compile_fmt(self):
+		# Compile the format string to a %-style template that formats a whole row in one go,
+		# plus the source of each row element: 'n', 't' or (channel index, field index). Format
+		# specs that %-formatting can't reproduce exactly are applied per column up front and
+		# substituted as strings. Returns None if the format string does anything but look up
+		# the values above, leaving str.format to handle (or reject) it a record at a time.
+		if self.nch == 2:
+			chmap = { 'ch1': 0, 'ch2': 1 }
+		else:
+			chmap = { 'ch1' if self.ch1 else 'ch2': 0 }
 
-	def _format_records(self):
-		new_data = []
+		try:
+			parsed = list(Formatter().parse(self.fmt))
+		except ValueError:
+			return None
 
-		# Single channel logging
-		if self.nch == 1:
-			for rec in self.processed[0]:
-				self.fmtdict['n'] += 1
-				self.fmtdict['t'] = (self.fmtdict['n'] - 1) * self.fmtdict['d']
-				if self.ch1:
-					new_data.append(self.fmt.format(ch1=rec, **self.fmtdict))
+		tmpl = []
+		cols = []
+		for lit, name, spec, conv in parsed:
+			tmpl.append(lit.replace('%', '%%'))
+
+			if name is None:
+				continue
+
+			m = re.match(r'^([A-Za-z_]\w*)(?:\[(\d+)\])?$', name)
+			if not m or '{' in spec or conv not in (None, 'r', 's'):
+				return None
+
+			key, idx = m.group(1), m.group(2)
+			convfn = { None: lambda v: v, 'r': repr, 's': str }[conv]
+
+			if key in ('T', 'd') and idx is None:
+				tmpl.append(format(convfn(self.fmtdict[key]), spec).replace('%', '%%'))
+				continue
+			elif key == 'n' and idx is None:
+				src, kind = key, 'i'
+			elif key == 't' and idx is None:
+				src, kind = key, 'i' if isinstance(self.fmtdict['d'], int) else 'f'
+			elif key in chmap:
+				chidx = chmap[key]
+				nfields = min(len(self._procfns[chidx]), len(self._coltypes))
+				# Multi-field records are tuples that must be indexed, single-field records
+				# are bare values that can't be.
+				if (idx is None) != (nfields == 1) or idx is not None and int(idx) >= nfields:
+					return None
+
+				# What %-formatting accepts depends on the field's type once it's been processed
+				src = (chidx, int(idx or 0))
+				kind = self._procfns[chidx][src[1]](np.array([], dtype=self._coltypes[src[1]])).dtype.kind
+			else:
+				return None
+
+			if conv is None and (spec == '' or re.match(r'^[+ ]?#?0?\d*(\.\d+)?[eEfFgG]$', spec) or
+				kind in 'iub' and re.match(r'^[+ ]?0?\d*d$', spec)):
+				tmpl.append('%' + (spec or 's'))
+				cols.append((src, None))
+			else:
+				tmpl.append('%s')
+				cols.append((src, lambda v, spec=spec, convfn=convfn: format(convfn(v), spec)))
+
+		return ''.join(tmpl), cols
+
+	def _format_columns(self, cols, n0):
+		# Format the processed columns of each channel (all the same length) as CSV rows,
+		# numbering them from n0.
+		n = min([ len(c[0]) for c in cols if len(c) ] or [0])
+
+		if not n:
+			return ''
+
+		if self._fmtplan is not None:
+			tmpl, plan = self._fmtplan
+
+			vals = []
+			for src, fn in plan:
+				if src == 'n':
+					col = np.arange(n0 + 1, n0 + n + 1)
+				elif src == 't':
+					col = np.arange(n0, n0 + n) * self.fmtdict['d']
 				else:
-					new_data.append(self.fmt.format(ch2=rec, **self.fmtdict))
+					col = cols[src[0]][src[1]][:n]
+
+				col = col.tolist()
+				vals.append(col if fn is None else [ fn(v) for v in col ])
+
+			if len(vals):
+				return ''.join(map(tmpl.__mod__, zip(*vals)))
+			else:
+				return (tmpl % ()) * n
 
-			self.dout += ''.join(new_data)
+		# Records are tuples of field values, or bare values for single-field records
+		recs = []
+		for c in cols:
+			c = [ x[:n].tolist() for x in c ]
+			recs.append(list(zip(*c)) if len(c) > 1 else c[0])
 
-			return len(self.processed[0])
+		if self.nch == 1:
+			names = ['ch1' if self.ch1 else 'ch2']
 		else:
-			i = 0
-			for rec1, rec2 in zip(*self.processed):
-				self.fmtdict['n'] += 1
-				self.fmtdict['t'] = (self.fmtdict['n'] - 1) * self.fmtdict['d']
-				new_data.append(self.fmt.format(ch1=rec1, ch2=rec2, **self.fmtdict))
-				i += 1
+			names = ['ch1', 'ch2']
+
+		fmtdict = dict(self.fmtdict)
+		new_data = []
+		for i, chrecs in enumerate(zip(*recs)):
+			fmtdict['n'] = n0 + i + 1
+			fmtdict['t'] = (fmtdict['n'] - 1) * fmtdict['d']
+			fmtdict.update(zip(names, chrecs))
+			new_data.append(self.fmt.format(**fmtdict))
+
+		return ''.join(new_data)
+
+	def _format_records(self):
+		counts = [ sum([ len(b[0]) for b in blocks ]) for blocks in self._pblocks ]
+		n = min(counts) if len(counts) else 0
+
+		if not n:
+			return 0
+
+		cols = [ [ np.concatenate(c) for c in zip(*blocks) ] for blocks in self._pblocks ]
+		self.dout += self._format_columns(cols, self.fmtdict['n'])
 
-			self.dout += ''.join(new_data)
+		self.fmtdict['n'] += n
+		self.fmtdict['t'] = (self.fmtdict['n'] - 1) * self.fmtdict['d']
 
-			return i
+		return n
 
 	def set_coeff(self, ch, coeff):
 		self.procfmt[ch] = LIDataParser._parse_procstr(self.procstr[ch], coeff)
+		self._procfns[ch] = LIDataParser._compile_procfmt(self.procfmt[ch])
+		self._fmtplan = self._compile_fmt()
 
 	def dump_csv(self, fname=None):
 		""" Write out incremental CSV output from new data"""
@@ -466,88 +1749,217 @@ class LIDataParser(object):
 		Called by the data consumer to indicate that it's no longer of use (e.g. has been
 		written to a file or otherwise processed)."""
 		if _len is None:
-			self.processed = [[] for x in range(self.nch)]
+			self._pblocks = [[] for x in range(self.nch)]
 		else:
 			# Clear out the raw and processed records so we can stream
 			# chunk at a time
-			for i in range(len(self.processed)):
-				self.processed[i] = self.processed[i][_len:]
+			for blocks in self._pblocks:
+				n = _len
+				while n and len(blocks):
+					blen = len(blocks[0][0])
+					if blen <= n:
+						blocks.pop(0)
+						n -= blen
+					else:
+						blocks[0] = [ c[n:] for c in blocks[0] ]
+						n = 0
+
+	def _take_processed(self, n):
+		# Remove the first n processed records of every channel, returning them as lists of
+		# columns. All channels must have at least n records ready.
+		ret = []
+		for blocks in self._pblocks:
+			nfields = len(blocks[0]) if len(blocks) else len(self._coltypes)
+			ret.append([ np.concatenate([ b[i] for b in blocks ])[:n] for i in range(nfields) ])
 
-	def _parse(self, data, ch):
-		# Manipulation is done on a string of ASCII '0' and '1'. Tried using
-		# the bitarray package but that's ~3x slower than the string version and
-		# the bitstring package is around 7x slower.
+		self.clear_processed(n)
 
+		return ret
+
+	def _chidx(self, ch):
 		# Convert channel number to processing array index
 		if ch == 0 or self.nch == 1:
-			chidx = 0
+			return 0
 		elif ch == 1:
-			chidx = 1
+			return 1
 
-		# This is all hard-coded little-endian; we reverse the bitstrings at the
-		# byte level here, then reverse them again at the field level below to
-		# correctly parse the fields LE.
-		self.dcache[chidx] += ''.join([ "{:08b}".format(d)[::-1] for d in bytearray(data) ])
+	def _parse(self, data, ch):
+		chidx = self._chidx(ch)
 
-		while True:
-			if not len(self._currfmt[chidx]):
-				self._currfmt[chidx] = self.binfmt[:]
+		if self._plan is not None:
+			self._parse_vectorised(data, chidx)
+		else:
+			self._parse_bits(data, chidx)
+
+	def _decode_records(self, buf, pos, n):
+		# Decodes n whole records from buf starting at byte pos. Returns the list of columns
+		# for the non-padding fields, and an array giving the bit offset of the first failed
+		# literal in each record, or -1 if the record matched.
+		reclen = self.recordlen // 8
+		recs = np.frombuffer(buf, dtype=np.uint8, count=n * reclen, offset=pos).reshape(n, reclen)
+
+		cols = []
+		fail = np.full(n, -1, dtype=np.int64)
+		checks = []
+
+		for _type, offset, _len, lit in self._plan:
+			start, shift = offset // 8, offset % 8
+			nbytes = (shift + _len + 7) // 8
+
+			# Gather the bytes spanned by the field in to a 64-bit little-endian word. Aligned
+			# power-of-two fields can be read directly, everything else is shifted and masked.
+			if not shift and _len in (8, 16, 32, 64):
+				raw = np.ascontiguousarray(recs[:, start:start + nbytes]).view('<u%d' % nbytes)[:, 0].astype(np.uint64)
+			else:
+				raw = np.zeros(n, dtype=np.uint64)
+				for i in range(min(nbytes, 8)):
+					raw |= recs[:, start + i].astype(np.uint64) << np.uint64(8 * i)
+
+				raw >>= np.uint64(shift)
+
+				if nbytes > 8:
+					raw |= recs[:, start + 8].astype(np.uint64) << np.uint64(64 - shift)
 
-				if len(self._currecord[chidx]):
-					self.records[chidx].append(self._currecord[chidx])
-				self._currecord[chidx] = []
+				if _len < 64:
+					raw &= np.uint64((1 << _len) - 1)
+
+			if _type in 'up':
+				val = raw.astype(np.int64) if _len < 64 else raw
+			elif _type == 's':
+				if _len < 64:
+					sign = 1 << (_len - 1)
+					val = (raw.astype(np.int64) ^ sign) - sign
+				else:
+					val = raw.view(np.int64)
+			elif _type == 'f':
+				if _len == 32:
+					# Don't warn on NaN bit patterns, they're passed through as they are
+					with np.errstate(invalid='ignore'):
+						val = raw.astype(np.uint32).view(np.float32).astype(np.float64)
+				else:
+					val = raw.view(np.float64)
+			elif _type == 'b':
+				# Matches the walker, a boolean is only true if it's a single set bit
+				val = raw != 0 if _len == 1 else np.zeros(n, dtype=bool)
+
+			if lit:
+				checks.append((offset, val != lit))
+
+			if _type != 'p':
+				cols.append(val)
+
+		# The walker checks fields in order, so it's the first failed literal that counts
+		for offset, mismatch in reversed(checks):
+			fail[mismatch] = offset
+
+		return cols, fail
+
+	def _parse_vectorised(self, data, chidx):
+		buf = self._bcache[chidx] + bytes(data)
+		reclen = self.recordlen // 8
+		pos = 0
+
+		# Number of records to attempt at once. Starts at "everything", drops back after a
+		# literal mismatch then grows again so a run of garbage doesn't cost a full decode
+		# per dropped byte.
+		window = len(buf)
+
+		while len(buf) - pos >= reclen:
+			n = min((len(buf) - pos) // reclen, window)
+			cols, fail = self._decode_records(buf, pos, n)
+
+			bad = np.flatnonzero(fail >= 0)
+
+			if not len(bad):
+				if len(cols):
+					self._blocks[chidx].append(cols)
+				pos += n * reclen
+				window *= 2
+				continue
+
+			# Keep the good records before the mismatch then, like the walker, drop the
+			# partial record and a byte from the start of the failed literal.
+			first = bad[0]
+			if first and len(cols):
+				self._blocks[chidx].append([ c[:first] for c in cols ])
+
+			log.debug("Literal mismatch, dropped partial record at byte %d", pos + first * reclen)
+			pos += int(first * reclen + fail[first] // 8 + 1)
+			window = 1
+
+		self._bcache[chidx] = buf[pos:]
+
+	def _parse_bits(self, data, chidx):
+		# Field-at-a-time decoder for formats that the vectorised decoder can't handle. Works
+		# on a bit cursor in to a buffer of the channel's unconsumed bytes; the field index
+		# and values of a partially decoded record carry over to the next call. Consumed bytes
+		# are only dropped from the buffer once per call so this is linear in the data length.
+		done = []
+		buf = self._bitbuf[chidx]
+		buf += data
+
+		pos = self._bitpos[chidx]
+		field = self._currfield[chidx]
+		record = self._currecord[chidx]
+		nbits = len(buf) * 8
 
-			_type, _len, lit = self._currfmt[chidx][0]
+		while True:
+			_type, _len, lit = self.binfmt[field]
 
-			if len(self.dcache[chidx]) < _len:
+			if nbits - pos < _len:
 				break
 
-			# TODO: This is hard-coded little endian. Need to correctly handle the endianness specifier
-			# in the binary format string.
-			candidate = self.dcache[chidx][:_len][::-1]
+			# This is all hard-coded little-endian, the first bit of the stream is the LSB of
+			# the first byte and the first bit of each field is its LSB.
+			# TODO: Need to correctly handle the endianness specifier in the binary format string.
+			start = pos >> 3
+			raw = (int.from_bytes(bytes(buf[start:(pos + _len + 7) >> 3]), 'little') >> (pos & 7)) & ((1 << _len) - 1)
 
 			if _type in 'up':
-				val = int(candidate, 2)
+				val = raw
 			elif _type == 's':
-				val = int(candidate, 2)
-
-				if candidate[0] == '1':
-					val -= (1 << _len)
+				val = raw - (1 << _len) if raw >> (_len - 1) else raw
 			elif _type == 'f':
 				if _len == 32:
-					fmtstr = 'If'
+					val = struct.unpack('<f', struct.pack('<I', raw))[0]
 				elif _len == 64:
-					fmtstr = 'Qd'
+					val = struct.unpack('<d', struct.pack('<Q', raw))[0]
 				else:
 					raise InvalidFormatException("Can't have a floating point spec with bit length other than 32/64 bits")
-
-				bitpattern = struct.pack(fmtstr[0], int(candidate, 2))
-				val = struct.unpack(fmtstr[1], bitpattern)[0]
 			elif _type == 'b':
-				val = candidate == '1'
+				val = _len == 1 and raw == 1
 			else:
 				raise InvalidFormatException("Don't know how to handle '%s' types" % _type)
 
 			if not lit or val == lit:
 				if _type != 'p':
-					self._currecord[chidx].append(val)
-				self._currfmt[chidx] = self._currfmt[chidx][1:]
+					record.append(val)
+
+				# Move past the whole successfully-matched field.
+				pos += _len
+				field += 1
 
-				# Drop off the whole successfully-matched field.
-				self.dcache[chidx] = self.dcache[chidx][_len:]
+				if field == len(self.binfmt):
+					if len(record):
+						done.append(record)
+					record = []
+					field = 0
 			else:
 				# If we fail a literal match, drop the entire pattern and start again
-				log.debug("Literal mismatch (%d != %d), dropped partial record %s", val, lit, str(self._currecord[chidx]))
-				self._currecord[chidx] = []
-				self._currfmt[chidx] = []
+				log.debug("Literal mismatch (%d != %d), dropped partial record %s", val, lit, str(record))
+				record = []
+				field = 0
 
 				# Drop off a byte, assuming that that is the base granulatity at which the data has been captured
-				self.dcache[chidx] = self.dcache[chidx][8:]
-			
+				pos = min(pos + 8, nbits)
 
-		if len(self._currecord[chidx]) and not len(self._currfmt[chidx]):
-			self.records[chidx].append(self._currecord[chidx])
+		del buf[:pos >> 3]
+		self._bitpos[chidx] = pos & 7
+		self._currfield[chidx] = field
+		self._currecord[chidx] = record
 
+		if len(done):
+			self._blocks[chidx].append([ np.array(c, dtype=t) for c, t in zip(zip(*done), self._coltypes) ])
 
 	def parse(self, data, ch):
 		""" Parse a chunk of data.
@@ -14,6 +14,7 @@ from . import _frame_instrument
 _this_module = sys.modules[__name__]
 
 DataFrame = _frame_instrument.DataFrame
+DataloggerStatus = _frame_instrument.DataloggerStatus
 VoltsFrame = _oscilloscope.VoltsFrame
 
 MokuInstrument = _instrument.MokuInstrument
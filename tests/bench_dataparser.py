@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Parser throughput against chunk size. Run directly, not collected by pytest.
+#
+# Time per record should be flat as chunks get bigger, for both the vectorised decoder and
+# the bit-level decoder used for formats the vectorised one can't handle.
+
+import sys, os, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pymoku.dataparser import LIDataParser
+
+formats = [
+	("vectorised", "<s32:u16:p16"),
+	("bit-level", "<u10:s13,5:p1"),
+]
+
+def bench(binstr, chunklen, total=1 << 20):
+	parser = LIDataParser(True, False, binstr, [""], "", "", 1, 0, [1])
+	data = bytes(bytearray(random.getrandbits(8) for _ in range(chunklen)))
+
+	start = time.time()
+	for i in range(max(total // chunklen, 1)):
+		parser.parse(data, 0)
+		parser.clear_processed()
+
+	return (time.time() - start) / (max(total // chunklen, 1) * chunklen)
+
+if __name__ == '__main__':
+	random.seed(0)
+	print("%-12s %10s %12s" % ("decoder", "chunk (B)", "ns/byte"))
+
+	for name, binstr in formats:
+		total = 1 << 22 if name == "vectorised" else 1 << 18
+		for chunklen in [64, 1024, 16384, 65535]:
+			print("%-12s %10d %12.1f" % (name, chunklen, bench(binstr, chunklen, total) * 1e9))
@@ -2,7 +2,8 @@
 
 
 import pytest
-import sys, os
+import sys, os, struct
+import numpy as np
 sys.path.append('..')
 
 import logging
@@ -11,25 +12,28 @@ logging.basicConfig(level=logging.DEBUG)
 from pymoku.dataparser import *
 
 binfmt_data = [
-	("<s32", "\x00\x00\x00\x00", [[0]]), # Simple signed unpack
-	("<s32", "\x00\x00\x00\x00\xFF\xFF\xFF\xFF\x00\x11\x22\x33", [[0], [-1], [0x33221100]]), # Simple signed unpack
-	("<u32", "\x00\x00\x00\x00\xFF\xFF\xFF\xFF\x00\x11\x22\x33", [[0], [0xFFFFFFFF], [0x33221100]]), # Simple unsigned unpack
-	("<u32:s32", "\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF", [[0xFFFFFFFF, -1], [0xFFFFFFFF, -1]]), # Record unpack
-	("<u24:u24", "\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xAA\xBB", [[0x221100, 0x554433], [0x887766, 0xBBAA99]]), # Odd length records
-	("<u24:u24", "\x00\x11\x22\x33\x44\x55\x66\x77\x88", [[0x221100, 0x554433]]), # Incomplete number of records in input string
-	("<f32", "\x00\x00\x80\xBF", [[-1.0]]), # Single precision float
-	("<f64", "\x00\x00\x00\x00\x00\x00\xF0\xBF", [[-1.0]]), # Double precision float
-	("<b1:u6:b1", "\xFF\x00", [[True, 0x3F, True], [False, 0, False]]), # Booleans, non-byte-length integers
-	("<p1:u6:p1", "\xFF\x00", [[0x3F], [0]]), # Padding fields
-	("<p8,0xFF:u8", "\x00\x00\xFF\x01\x00\xFF\x02\xFF\x03\x10", [[0x01], [0x02], [0x03]]), # Simple alignment byte
-	("<u8,0xFF:u8", "\x00\x00\xFF\x01\x00\xFF\x02\xFF\x03\x10", [[0xFF, 0x01], [0xFF, 0x02], [0xFF, 0x03]]), # Recorded alignment byte
-	("<p2,3:u6", "\x00\xFF\x00\xFF\x00\xFF", [[0x3F], [0x3F], [0x3F]]), # Alignment bits
-	("<u8:p8,0xFF:u8", "\x01\xFF\x02\xFF\x03\xFF\x00\x00\x00\x04\xFF\x05", [[1, 2], [4, 5]]), # Alignment in the middle of a field
+	("<s32", b"\x00\x00\x00\x00", [[0]]), # Simple signed unpack
+	("<s32", b"\x00\x00\x00\x00\xFF\xFF\xFF\xFF\x00\x11\x22\x33", [[0], [-1], [0x33221100]]), # Simple signed unpack
+	("<u32", b"\x00\x00\x00\x00\xFF\xFF\xFF\xFF\x00\x11\x22\x33", [[0], [0xFFFFFFFF], [0x33221100]]), # Simple unsigned unpack
+	("<u32:s32", b"\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF", [[0xFFFFFFFF, -1], [0xFFFFFFFF, -1]]), # Record unpack
+	("<u24:u24", b"\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xAA\xBB", [[0x221100, 0x554433], [0x887766, 0xBBAA99]]), # Odd length records
+	("<u24:u24", b"\x00\x11\x22\x33\x44\x55\x66\x77\x88", [[0x221100, 0x554433]]), # Incomplete number of records in input string
+	("<f32", b"\x00\x00\x80\xBF", [[-1.0]]), # Single precision float
+	("<f64", b"\x00\x00\x00\x00\x00\x00\xF0\xBF", [[-1.0]]), # Double precision float
+	("<b1:u6:b1", b"\xFF\x00", [[True, 0x3F, True], [False, 0, False]]), # Booleans, non-byte-length integers
+	("<p1:u6:p1", b"\xFF\x00", [[0x3F], [0]]), # Padding fields
+	("<p8,0xFF:u8", b"\x00\x00\xFF\x01\x00\xFF\x02\xFF\x03\x10", [[0x01], [0x02], [0x03]]), # Simple alignment byte
+	("<u8,0xFF:u8", b"\x00\x00\xFF\x01\x00\xFF\x02\xFF\x03\x10", [[0xFF, 0x01], [0xFF, 0x02], [0xFF, 0x03]]), # Recorded alignment byte
+	("<p2,3:u6", b"\x00\xFF\x00\xFF\x00\xFF", [[0x3F], [0x3F], [0x3F]]), # Alignment bits
+	("<u8:p8,0xFF:u8", b"\x01\xFF\x02\xFF\x03\xFF\x00\x00\x00\x04\xFF\x05", [[1, 2], [4, 5]]), # Alignment in the middle of a field
+	("<u4:u8", b"\x21\x43\x65", [[1, 0x32], [4, 0x65]]), # Records that aren't whole bytes, bit-string walker
+	("<s64:u64", b"\xFF" * 16, [[-1, 0xFFFFFFFFFFFFFFFF]]), # Full width integers
+	("<u12:s20", b"\x21\x43\x65\x87", [[0x321, -0x789AC]]), # Unaligned fields
 ]
 
 @pytest.mark.parametrize("fmt,din,expected", binfmt_data)
 def test_binfmts(fmt, din, expected):
-	dut = LIDataParser(1, fmt, "", "", "", 0, 0, [1, 1])
+	dut = LIDataParser(True, True, fmt, ["", ""], "", "", 0, 0, [1, 1])
 	# Use the internal parser method so the records don't get processed and removed before
 	# we've had a chance to check them
 
@@ -37,43 +41,94 @@ def test_binfmts(fmt, din, expected):
 		dut._parse(din, ch)
 		assert dut.records[ch] == expected
 
+walker_data = [
+	("<p8,0xFF:u8", b"\x00\x00\xFF\x01\x00\xFF\x02\xFF\x03\x10" * 20),
+	("<u8:p8,0xFF:u8", b"\x01\xFF\x02\xFF\x03\xFF\x00\x00\x00\x04\xFF\x05" * 20),
+	("<p16,0xAAAA:u24:s15:p1,0:f32", b"\xAA\xAA\x01\x02\x03\xFF\xFF\x00\x00\x80\xBF\xAA" * 20),
+]
+
+@pytest.mark.parametrize("fmt,din", walker_data)
+def test_vectorised_matches_walker(fmt, din):
+	vec = LIDataParser(True, False, fmt, [""], "", "", 0, 0, [1])
+	bits = LIDataParser(True, False, fmt, [""], "", "", 0, 0, [1])
+
+	# Feed the data in uneven pieces so records and literals straddle calls
+	for i in range(0, len(din), 7):
+		vec._parse_vectorised(din[i:i + 7], 0)
+		bits._parse_bits(din[i:i + 7], 0)
+
+	assert vec.records == bits.records
+
+
 procfmt_data = [
-	("<s32", "", "\x01\x00\x00\x00", [1]), # No-op, single element tuple
-	("<s32:f32", ":", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(1,-1.0)]), # No-op
-	("<s32:f32", "*-1e2:*1e-1", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(-100,-0.1)]), # Exponential notation
-	("<s32:f32", "*2:*2", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(2,-2.0)]), # Multiplication
-	("<s32:f32", "*-2:*-2", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(-2,2.0)]), # Multiplication by negative
-	("<s32:f32", "*C:*C", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(2,-2.0)]), # Multiplication by calibration coefficient (hard-coded to two in the fixture)
-	("<s32:f32", "/2:/2", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(0,-0.5)]), # integer division
-	("<s32:f32", "/2.0:/2.0", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(0.5,-0.5)]), # fp division
-	("<s32:f32", "+0x01:-0x01", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(2, -2)]), # Hex literals, addition and subtraction
-	("<s32:f32", "&0:f&0", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(0, 0)]), # Masking and float-to-int conversion by floor operation
-	("<s32:f32", "s:*-1s", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, 1)]), # Square root, compound operations
-	("<s32:f32", "+1^2:-1^2", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(4, 4)]), # Square root, compound operations
-	("<s32:f32", "*0.5f:*-0.5c", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(0, 1)]), # Floor and ceiling operations
-	("<s32:f32", "+1+1-2:-1-1+2", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -1.0)]), # Multiple operations
-	("<s32:f32", "+1+1-2:-1-1+2e-1-5", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -7.8)]), # Multiple operations
-	("<s32:f32", "+1 +1 -2:-1 -1 +2e-1 -5", "\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -7.8)]), # Spaces between operations
-	("<s32:f32", "+1+1-2:-1-1+2", "\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF", [(1, -1.0),(1, -1.0)]), # Multiple records, including partial
+	("<s32", "", b"\x01\x00\x00\x00", [1]), # No-op, single element tuple
+	("<s32:f32", ":", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(1,-1.0)]), # No-op
+	("<s32:f32", "*-1e2:*1e-1", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(-100,-0.1)]), # Exponential notation
+	("<s32:f32", "*2:*2", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(2,-2.0)]), # Multiplication
+	("<s32:f32", "*-2:*-2", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(-2,2.0)]), # Multiplication by negative
+	("<s32:f32", "*C:*C", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(2,-2.0)]), # Multiplication by calibration coefficient (hard-coded to two in the fixture)
+	("<s32:f32", "/2:/2", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(0,-0.5)]), # integer division
+	("<s32:f32", "/2.0:/2.0", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(0.5,-0.5)]), # fp division
+	("<s32:f32", "+0x01:-0x01", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(2, -2)]), # Hex literals, addition and subtraction
+	("<s32:f32", "&0:f&0", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(0, 0)]), # Masking and float-to-int conversion by floor operation
+	("<s32:f32", "s:*-1s", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, 1)]), # Square root, compound operations
+	("<s32:f32", "+1^2:-1^2", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(4, 4)]), # Square root, compound operations
+	("<s32:f32", "*0.5f:*-0.5c", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(0, 1)]), # Floor and ceiling operations
+	("<s32:f32", "+1+1-2:-1-1+2", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -1.0)]), # Multiple operations
+	("<s32:f32", "+1+1-2:-1-1+2e-1-5", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -7.8)]), # Multiple operations
+	("<s32:f32", "+1 +1 -2:-1 -1 +2e-1 -5", b"\x01\x00\x00\x00\x00\x00\x80\xBF", [(1, -7.8)]), # Spaces between operations
+	("<s32:f32", "+1+1-2:-1-1+2", b"\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF", [(1, -1.0),(1, -1.0)]), # Multiple records, including partial
+	("<u64", "*-1", b"\xFF" * 8, [-0xFFFFFFFFFFFFFFFF]), # Full width unsigned doesn't wrap
+	("<s32:s32", "/2:^-1", b"\x03\x00\x00\x00\x02\x00\x00\x00", [(1, 0.5)]), # Integer division, negative integer power
+	("<s32:s32", "*0x100000000*0x100000000:^3+1", b"\x03\x00\x00\x00\x00\x00\x20\x00", [(3 << 64, (1 << 63) + 1)]), # Integer results too big for 64 bits don't wrap
+	("<f32", "f", b"\xECx\xAD\x60", [100000002004087734272]), # Floor of a float too big for 64 bits doesn't wrap
+	("<f32", "c*2", b"\xECx\xAD\xE0", [-200000004008175468544]), # Nor does ceiling
+	("<s64", "f", b"\x01\x00\x00\x00\x00\x00\x00\x40", [(1 << 62) + 1]), # Floor of an integer is exact
 ]
 
 @pytest.mark.parametrize("_bin,proc,din,expected", procfmt_data)
 def test_procfmts(_bin, proc, din, expected):
-	dut = LIDataParser(1, _bin, proc, "", "", 0, 0, [2, 2])
+	dut = LIDataParser(True, True, _bin, [proc, proc], "", "", 0, 0, [2, 2])
 
 	for ch in [0, 1]:
 		dut.parse(din, ch)
 		assert dut.processed[ch] == expected
 
+procfmt_error_data = [
+	("<f32", "f", b"\x00\x00\x80\x7F", OverflowError), # Floor of infinity
+	("<f32", "c", b"\x00\x00\xC0\x7F", ValueError), # Ceiling of NaN
+	("<s32", "s", b"\xFF\xFF\xFF\xFF", ValueError), # Square root of a negative
+]
+
+@pytest.mark.parametrize("_bin,proc,din,exc", procfmt_error_data)
+def test_procfmt_errors(_bin, proc, din, exc):
+	# These have no numeric answer so must raise as the Python operations do, rather than
+	# coming out as NaN or a wrapped integer
+	dut = LIDataParser(True, False, _bin, [proc], "", "", 0, 0, [1])
+
+	with pytest.raises(exc):
+		dut.parse(din + din, 0)
+
+
+def test_set_coeff():
+	dut = LIDataParser(True, False, "<s32", ["*C"], "", "", 0, 0, [2])
+	dut.parse(b"\x03\x00\x00\x00", 0)
+
+	# New calibration coefficient applies to records parsed after the change
+	dut.set_coeff(0, 0.5)
+	dut.parse(b"\x03\x00\x00\x00", 0)
+
+	assert dut.processed[0] == [6, 1.5]
+
 
 # File contents are hand-crafted, hence the small number of test cases!
 write_binfile_data = [
-	(1, 1, 1, "", "", "", "", [1], 1, 0, '',
-		'LI1\x20\x00\x01\x01\x01\x00\x00\x00\x80\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00'),
-	(1, 1, 1, "A", "B", "C", "D", [1], 1, 0, '',
-		'LI1\x24\x00\x01\x01\x01\x00\x00\x00\x80\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x01\x00A\x01\x00B\x01\x00C\x01\x00D'),
-	(1, 1, 1, "", "", "", "", [1], 1, 0, '\x00\x00\x00\x00',
-		'LI1\x20\x00\x01\x01\x01\x00\x00\x00\x80\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x04\x00\x00\x00\x00\x00\x01\x04\x00\x00\x00\x00\x00'),
+	(1, 1, 1, "", [""], "", "", [1], 1, 0, b'',
+		b'LI1\x24\x00\x01\x01\x01\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00'),
+	(1, 1, 1, "A", ["B"], "C", "D", [1], 1, 0, b'',
+		b'LI1\x28\x00\x01\x01\x01\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x01\x00A\x01\x00B\x01\x00C\x01\x00D'),
+	(1, 1, 1, "", [""], "", "", [1], 1, 0, b'\x00\x00\x00\x00',
+		b'LI1\x24\x00\x01\x01\x01\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF0\x3F\x00\x00\x00\x00\x00\x00\x00\x00\x00\x04\x00\x00\x00\x00\x00\x01\x04\x00\x00\x00\x00\x00'),
 ]
 
 @pytest.mark.parametrize("instr,instrv,nch,binstr,procstr,fmtstr,hdrstr,calcoeffs,timestep,starttime,data,expected", write_binfile_data)
@@ -85,30 +140,32 @@ def test_binfile_write(instr, instrv, nch, binstr, procstr, fmtstr, hdrstr, calc
 
 	writer.finalize()
 
-	with open("test.dat") as f:
+	with open("test.dat", "rb") as f:
 		assert f.read() == expected
 
 	os.remove("test.dat")
 
 
 roundtrip_binfile_data = [
-	(1, 1, 1, "", "", "", "", [1], 1, 0, [''], [], "", True),
-	(1, 1, 1, "<s32", "", "{ch1}\r\n", "Header\r\n", [1], 1, 0, [''], [], "Header\r\n", False),
-	(1, 1, 1, "<s32", "", "{ch1}\r\n", "Header\r\n", [1], 1, 0, ['\x00\x00\x00\x00'], [[0]], "Header\r\n0\r\n", False),
-	(1, 1, 1, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -1.0)],[(1, -1.0)]],
+	(1, 1, 1, "", [""], "", "", [1], 1, 0, [b''], [], "", True),
+	(1, 1, 1, "<s32", [""], "{ch1}\r\n", "Header\r\n", [1], 1, 0, [b''], [], "Header\r\n", False),
+	(1, 1, 1, "<s32", [""], "{ch1}\r\n", "Header\r\n", [1], 1, 0, [b'\x00\x00\x00\x00'], [[0]], "Header\r\n0\r\n", False),
+	(1, 1, 1, "<s32:f32", ["+1+1-2:-1-1+2"], "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
+		[b"\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -1.0)],[(1, -1.0)]],
 		"Header\r\n1,-1.0\r\n1,-1.0\r\n", False), # Multiple records, including partial
-	(1, 1, 1, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00\x80", "\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -1.0)],[(1, -1.0)]],
+	(1, 1, 1, "<s32:f32", ["+1+1-2:-1-1+2"], "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
+		[b"\x01\x00\x00\x00\x00\x00\x80", b"\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -1.0)],[(1, -1.0)]],
 		"Header\r\n1,-1.0\r\n1,-1.0\r\n", False), # same again, split data
-	(1, 1, 2, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]},{ch2[0]},{ch2[1]}\r\n", "Header\r\n", [1, 1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00\xA0\xC0\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -5.0),(1, -5.0)],[(1, -1.0),(1, -1.0)]],
+	(1, 1, 2, "<s32:f32", ["+1+1-2:-1-1+2", "+1+1-2:-1-1+2"], "{ch1[0]},{ch1[1]},{ch2[0]},{ch2[1]}\r\n", "Header\r\n", [1, 1], 1, 0,
+		[b"\x01\x00\x00\x00\x00\x00\xA0\xC0\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"], [[(1, -5.0),(1, -5.0)],[(1, -1.0),(1, -1.0)]],
 		"Header\r\n1,-5.0,1,-5.0\r\n1,-1.0,1,-1.0\r\n", False), # Two channels
 ]
 
 @pytest.mark.parametrize("instr,instrv,nch,binstr,procstr,fmtstr,hdrstr,calcoeffs,timestep,starttime,din,dout,csv,supposedtobeborked", roundtrip_binfile_data)
 def test_binfile_roundtrip(instr, instrv, nch, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime, din, dout, csv, supposedtobeborked):
-	writer = LIDataFileWriter("test.dat", instr, instrv, nch, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime)
+	# Channel selection flags, enable the first nch channels
+	chs = (1 << nch) - 1
+	writer = LIDataFileWriter("test.dat", instr, instrv, chs, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime)
 
 	# Input data format is binary, output format is records
 	for d in din:
@@ -141,26 +198,419 @@ def test_binfile_roundtrip(instr, instrv, nch, binstr, procstr, fmtstr, hdrstr,
 			# Reinitialise the reader from the beginning of the data file
 			reader = LIDataFileReader("test.dat")
 			reader.to_csv("test.csv")
-			assert open("test.csv").read() == csv
+			with open("test.csv", "rb") as f:
+				assert f.read() == csv.encode('ascii')
 
 # TODO: Two-channel tests
 
 
+def _write_chunked(fname, nrecs, chunklens, binstr="<s32:f32", procstr=["*2:", "*3:"], fmtstr="", hdrstr="", starttime=0, **kwargs):
+	# Two channel file of s32:f32 records split in to chunks of the given lengths. Records
+	# straddle chunk boundaries unless the lengths happen to be multiples of 8 bytes.
+	data = b''.join([ struct.pack("<if", i, -i / 2.0) for i in range(nrecs) ])
+
+	writer = LIDataFileWriter(fname, 1, 1, 3, binstr, procstr, fmtstr, hdrstr, [1, 1], 0.5, starttime, **kwargs)
+	i = 0
+	while i < len(data):
+		_len = chunklens[i % len(chunklens)]
+		for ch in [0, 1]:
+			writer.add_data(data[i:i + _len], ch)
+		i += _len
+
+	writer.finalize()
+
+@pytest.mark.parametrize("chunklens", [[8], [5, 13, 1], [1000]])
+def test_random_access(chunklens):
+	_write_chunked("test.dat", 100, chunklens)
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	with LIDataFileReader("test.dat", use_mmap=True) as reader:
+		assert len(reader) == 100
+		assert reader[0] == records[0]
+		assert reader[-1] == records[-1]
+
+		ch1, ch2 = reader[10:20]
+		assert ch1.tolist() == [ r[0] for r in records[10:20] ]
+		assert ch2.tolist() == [ r[1] for r in records[10:20] ]
+
+		ch1, ch2 = reader.read_range(90, 200)
+		assert ch1.tolist() == [ r[0] for r in records[90:] ]
+
+		ch1, ch2 = reader[50:10:-7]
+		assert ch2.tolist() == [ r[1] for r in records[50:10:-7] ]
+
+	assert not os.path.exists("test.dat.idx")
+	os.remove("test.dat")
+
+def test_random_access_truncated():
+	_write_chunked("test.dat", 100, [1000])
+
+	with open("test.dat", "r+b") as f:
+		f.truncate(os.path.getsize("test.dat") - 10)
+
+	# The failure to index the file is reported every time, not just the first
+	with LIDataFileReader("test.dat") as reader:
+		for i in range(2):
+			with pytest.raises(InvalidFileException):
+				reader[0]
+
+	os.remove("test.dat")
+
+def _write_corrupted(fname, nrecs, fmtstr="", hdrstr=""):
+	# Two channel file of <p32,0xAAAAAAAA:s32 records, with stray bytes and garbage in the middle
+	# of one channel or the other, that the parser has to re-sync after.
+	recs = [ b"\xAA" * 4 + struct.pack("<i", i) for i in range(nrecs) ]
+	data = [ b''.join(recs), b''.join(recs) ]
+	data[0] = data[0][:803] + b"\x01" + data[0][803:]
+	data[1] = data[1][:4000] + b"\xAA\x02\x03" * 5 + data[1][4000:]
+	data[0] = data[0][:len(data[0]) // 2] + b"\xAA" * 7 + data[0][len(data[0]) // 2:]
+
+	writer = LIDataFileWriter(fname, 1, 1, 3, "<p32,0xAAAAAAAA:s32", ["*2", ""], fmtstr, hdrstr, [1, 1], 0.5, 0)
+	for ch in [0, 1]:
+		for i in range(0, len(data[ch]), 997):
+			writer.add_data(data[ch][i:i + 997], ch)
+	writer.finalize()
+
+def test_random_access_resync():
+	_write_corrupted("test.dat", 5000)
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	with LIDataFileReader("test.dat", use_mmap=True) as reader:
+		assert len(reader) == len(records)
+		assert reader[-1] == records[-1]
+
+		ch1, ch2 = reader.read_range(0, len(records))
+		assert ch1.tolist() == [ r[0] for r in records ]
+		assert ch2.tolist() == [ r[1] for r in records ]
+
+		ch1, ch2 = reader[2345:2600]
+		assert ch2.tolist() == [ r[1] for r in records[2345:2600] ]
+
+	# The re-sync points are kept in the sidecar index along with the chunks
+	for i in range(2):
+		with LIDataFileReader("test.dat", index_file=True) as reader:
+			if i:
+				reader._scan_records = None
+			assert reader.read_range(0, len(records))[0].tolist() == [ r[0] for r in records ]
+
+	os.remove("test.dat")
+	os.remove("test.dat.idx")
+
+def test_chunk_index():
+	_write_chunked("test.dat", 100, [5, 13, 1])
+
+	with LIDataFileReader("test.dat", use_mmap=True, index_file=True) as reader:
+		index = reader.chunk_index()
+		records = reader.read_range(0, 100)
+
+	assert os.path.exists("test.dat.idx")
+	assert index[0][1:] == (0, 0) and index[1][1:] == (1, 0)
+
+	# Second open must come from the sidecar, not a rescan
+	with LIDataFileReader("test.dat", use_mmap=False, index_file=True) as reader:
+		reader._scan_chunks = None
+		reader._scan_records = None
+		reader._build_index()
+		assert reader.chunk_index() == index
+		assert all((a == b).all() for a, b in zip(reader.read_range(0, 100), records))
+
+	# Changing the data file invalidates the index
+	with open("test.dat", "ab") as f:
+		f.write(b"\x00\x08\x00" + b"\x00" * 8)
+
+	with LIDataFileReader("test.dat", use_mmap=True, index_file=True) as reader:
+		assert len(reader.chunk_index()) == len(index) + 1
+
+	os.remove("test.dat")
+	os.remove("test.dat.idx")
+
+@pytest.mark.parametrize("block_size", [1, 7, 1000])
+def test_export_npy(block_size):
+	_write_chunked("test.dat", 100, [5, 13, 1], starttime=1500000000)
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	with LIDataFileReader("test.dat") as reader:
+		reader.export("test.npy", format='npy', block_size=block_size)
+		deltat, starttime = reader.deltat, reader.starttime
+
+	d = np.load("test.npy")
+	assert d.dtype.names == ('t', 'ch1_0', 'ch1_1', 'ch2_0', 'ch2_1')
+	assert len(d) == len(records)
+	assert np.allclose(d['t'], starttime + np.arange(100) * deltat)
+	assert d['ch1_0'].tolist() == [ r[0][0] for r in records ]
+	assert d['ch2_1'].tolist() == [ r[1][1] for r in records ]
+
+	os.remove("test.dat")
+	os.remove("test.npy")
+
+@pytest.mark.parametrize("fmt", ['hdf5', 'parquet'])
+def test_export_columnar(fmt):
+	pytest.importorskip({ 'hdf5': 'h5py', 'parquet': 'pyarrow' }[fmt])
+	_write_chunked("test.dat", 100, [5, 13, 1])
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	# From the start, and from part way through
+	for skip in [0, 10]:
+		with LIDataFileReader("test.dat") as reader:
+			reader.read_block(skip)
+			reader.export("test.out", format=fmt, block_size=30)
+
+		if fmt == 'hdf5':
+			import h5py
+			with h5py.File("test.out", 'r') as f:
+				d = f['moku:datalog'][:]
+		else:
+			import pyarrow.parquet as pq
+			d = pq.read_table("test.out").to_pandas().to_records()
+
+		assert d['ch2_1'].tolist() == [ r[1][1] for r in records[skip:] ]
+
+	os.remove("test.dat")
+	os.remove("test.out")
+
+def test_buffered_write():
+	_write_chunked("test.dat", 1000, [5, 13, 1])
+	_write_chunked("test2.dat", 1000, [5, 13, 1], buffer_size=512)
+
+	with open("test.dat", "rb") as f1, open("test2.dat", "rb") as f2:
+		assert f1.read() == f2.read()
+
+	os.remove("test.dat")
+	os.remove("test2.dat")
+
+def test_flush_interval():
+	writer = LIDataFileWriter("test.dat", 1, 1, 1, "<s32", ["*2"], "", "", [1], 0.5, 0, buffer_size=4096, flush_interval=0)
+	writer.flush()
+	size = os.path.getsize("test.dat")
+	writer.add_data(b"\x00" * 8, 0)
+	assert os.path.getsize("test.dat") == size + 11
+	writer.finalize()
+
+	os.remove("test.dat")
+
+@pytest.mark.parametrize("compression", ['zlib', 'zstd'])
+def test_compressed_roundtrip(compression):
+	if compression == 'zstd':
+		pytest.importorskip('zstandard')
+
+	_write_chunked("test.dat", 1000, [5, 13, 1])
+	_write_chunked("test2.dat", 1000, [5, 13, 1], buffer_size=1000, compression=compression)
+	assert os.path.getsize("test2.dat") < os.path.getsize("test.dat")
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	with LIDataFileReader("test2.dat") as reader:
+		assert reader.readall() == records
+
+	with LIDataFileReader("test2.dat") as reader:
+		with pytest.raises(InvalidFormatException):
+			reader.read_range(0, 10)
+
+	os.remove("test.dat")
+	os.remove("test2.dat")
+
+def test_compressed_frames():
+	# Without a buffer size, compressed data still goes out in large frames rather than one per chunk
+	_write_chunked("test.dat", 1000, [5, 13, 1], compression='zlib')
+
+	with open("test.dat", "rb") as f:
+		d = f.read()
+
+	pos = 5 + struct.unpack_from("<H", d, 3)[0]
+	frames = 0
+	while pos < len(d):
+		codec, _len = struct.unpack_from("<BI", d, pos)
+		pos += 5 + _len
+		frames += 1
+
+	assert frames == 1
+
+	with LIDataFileReader("test.dat") as reader:
+		assert len(reader.readall()) == 1000
+
+	os.remove("test.dat")
+
+def test_read_block():
+	_write_chunked("test.dat", 100, [5, 13, 1])
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+
+	with LIDataFileReader("test.dat") as reader:
+		blocks = list(reader.iter_blocks(30))
+		assert [ len(t) for t, d in blocks ] == [30, 30, 30, 10]
+		assert np.allclose(np.concatenate([ t for t, d in blocks ]), reader.starttime + np.arange(100) * reader.deltat)
+
+		ch1 = np.concatenate([ d[0] for t, d in blocks ])
+		assert ch1['f0'].tolist() == [ r[0][0] for r in records ]
+		assert ch1['f1'].tolist() == [ r[0][1] for r in records ]
+
+		assert reader.read_block(10) is None
+
+	# Mixed with single record reads
+	with LIDataFileReader("test.dat") as reader:
+		assert reader.read() == records[0]
+		t, (ch1, ch2) = reader.read_block(10)
+		assert t[0] == reader.starttime + reader.deltat
+		assert ch2.tolist() == [ r[1] for r in records[1:11] ]
+		assert reader.read() == records[11]
+
+	os.remove("test.dat")
+
+def test_readahead():
+	_write_chunked("test.dat", 1000, [5, 13, 1])
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+		assert reader.readahead_stats is None
+
+	with LIDataFileReader("test.dat", readahead=4) as reader:
+		assert reader.read() == records[0]
+		t, (ch1, ch2) = reader.read_block(500)
+		assert ch2.tolist() == [ r[1] for r in records[1:501] ]
+		assert reader.readall() == records[501:]
+
+		stats = reader.readahead_stats
+		assert stats['bytes'] == os.path.getsize("test.dat") - reader._data_start
+		assert 1 <= stats['max_depth'] <= 4
+
+	# Closing with the queue full mustn't hang
+	with LIDataFileReader("test.dat", readahead=2) as reader:
+		reader.read()
+
+	os.remove("test.dat")
+
+def test_follow():
+	import threading, time
+	_write_chunked("test.dat", 300, [5, 13, 1])
+
+	with open("test.dat", "rb") as f:
+		d = f.read()
+
+	with LIDataFileReader("test.dat") as reader:
+		records = reader.readall()
+		start = reader._data_start
+
+	# Write the header and data out a few bytes at a time, splitting chunks and records
+	def _writer():
+		with open("test.dat", "wb") as f:
+			f.write(d[:start])
+			f.flush()
+			for i in range(start, len(d), 97):
+				f.write(d[i:i + 97])
+				f.flush()
+				time.sleep(0.002)
+
+	with open("test.dat", "wb") as f:
+		f.write(d[:start])
+
+	with LIDataFileReader("test.dat") as reader:
+		t = threading.Thread(target=_writer)
+		t.start()
+		blocks = list(reader.follow(block_size=50, poll_interval=0.001, max_interval=0.01, timeout=0.5))
+		t.join()
+
+	assert sum([ len(b[0]) for b in blocks ]) == len(records)
+	assert np.concatenate([ b[1][1] for b in blocks ]).tolist() == [ r[1] for r in records ]
+
+	os.remove("test.dat")
+
+def test_parallel_convert():
+	_write_chunked("test.dat", 20000, [5, 13, 1, 1000], fmtstr="{n},{t},{ch1[0]},{ch1[1]:.8e},{ch2[1]}\r\n", hdrstr="Header {T}\r\n")
+
+	for workers in [None, 3]:
+		with LIDataFileReader("test.dat") as reader:
+			reader.to_csv("test%s.csv" % workers, workers=workers)
+		with LIDataFileReader("test.dat") as reader:
+			reader.export("test%s.npy" % workers, format='npy', block_size=999, workers=workers)
+
+	with open("testNone.csv") as f1, open("test3.csv") as f2:
+		assert f1.read() == f2.read()
+
+	assert (np.load("testNone.npy") == np.load("test3.npy")).all()
+
+	for f in ["test.dat", "testNone.csv", "test3.csv", "testNone.npy", "test3.npy"]:
+		os.remove(f)
+
+def test_convert_partial():
+	# Conversion carries on from wherever the reader has got to
+	_write_chunked("test.dat", 20000, [5, 13, 1, 1000], fmtstr="{n},{t},{ch1[0]},{ch1[1]:.8e},{ch2[1]}\r\n", hdrstr="Header {T}\r\n")
+
+	with LIDataFileReader("test.dat") as reader:
+		reader.to_csv("test.csv")
+	with LIDataFileReader("test.dat") as reader:
+		reader.export("test.npy", format='npy')
+
+	with open("test.csv") as f:
+		lines = f.read().split("\n")
+	full = np.load("test.npy")
+
+	def _skip(reader):
+		for i in range(3):
+			reader.read()
+		reader.read_block(7)
+
+	for workers in [None, 3]:
+		with LIDataFileReader("test.dat") as reader:
+			_skip(reader)
+			reader.to_csv("test%s.csv" % workers, workers=workers)
+		with LIDataFileReader("test.dat") as reader:
+			_skip(reader)
+			reader.export("test%s.npy" % workers, format='npy', block_size=999, workers=workers)
+
+		with open("test%s.csv" % workers) as f:
+			assert f.read().split("\n") == lines[:1] + lines[11:]
+
+		assert (np.load("test%s.npy" % workers) == full[10:]).all()
+
+	for f in ["test.dat", "test.csv", "test.npy", "testNone.csv", "test3.csv", "testNone.npy", "test3.npy"]:
+		os.remove(f)
+
+def test_parallel_convert_resync():
+	# Parallel conversion has to re-sync after corrupt data just as sequential conversion does
+	_write_corrupted("test.dat", 20000, fmtstr="{n},{t},{ch1},{ch2}\r\n", hdrstr="Header {T}\r\n")
+
+	for workers in [None, 3]:
+		with LIDataFileReader("test.dat") as reader:
+			reader.to_csv("test%s.csv" % workers, workers=workers)
+		with LIDataFileReader("test.dat") as reader:
+			reader.export("test%s.npy" % workers, format='npy', block_size=999, workers=workers)
+
+	with open("testNone.csv") as f1, open("test3.csv") as f2:
+		csv = f1.read()
+		assert csv == f2.read()
+
+	assert csv.count("\n") == 1 + 19999
+	assert (np.load("testNone.npy") == np.load("test3.npy")).all()
+
+	for f in ["test.dat", "testNone.csv", "test3.csv", "testNone.npy", "test3.npy"]:
+		os.remove(f)
+
+
 stream_csv_data = [
 	(1, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"],
+		[b"\x01\x00\x00\x00\x00\x00\x80\xBF\x01\x00\x00\x00\x00\x00\x80\xBF\x00\x80\xBF"],
 		"Header\r\n1,-1.0\r\n1,-1.0\r\n"), # Multiple records, including partial
 	(1, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]}\r\n", "Header\r\n", [1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00", "\x80\xBF\x02\x00\x00\x00","\x00\x00\x80\xBF\x00\x80\xBF"],
+		[b"\x01\x00\x00\x00\x00\x00", b"\x80\xBF\x02\x00\x00\x00",b"\x00\x00\x80\xBF\x00\x80\xBF"],
 		"Header\r\n1,-1.0\r\n2,-1.0\r\n"), # same again, split data, non-record aligned
-	(2, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]},{ch2[0]},{ch2[1]}\r\n", "Header\r\n", [1], 1, 0,
-		["\x01\x00\x00\x00\x00\x00", "\x80\xBF\x02\x00\x00\x00","\x00\x00\x80\xBF\x00\x80\xBF"],
+	(2, "<s32:f32", "+1+1-2:-1-1+2", "{ch1[0]},{ch1[1]},{ch2[0]},{ch2[1]}\r\n", "Header\r\n", [1, 1], 1, 0,
+		[b"\x01\x00\x00\x00\x00\x00", b"\x80\xBF\x02\x00\x00\x00",b"\x00\x00\x80\xBF\x00\x80\xBF"],
 		"Header\r\n1,-1.0,1,-1.0\r\n2,-1.0,2,-1.0\r\n"), # Two channels
 ]
 
 @pytest.mark.parametrize("nch,binstr,procstr,fmtstr,hdrstr,calcoeffs,timestep,starttime,din,csv", stream_csv_data)
 def test_stream_csv(nch, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, starttime, din, csv):
-	parser = LIDataParser(nch, binstr, procstr, fmtstr, hdrstr, timestep, starttime, calcoeffs)
+	parser = LIDataParser(True, nch == 2, binstr, [procstr] * nch, fmtstr, hdrstr, timestep, starttime, calcoeffs)
 
 	try: os.remove("test.csv")
 	except OSError: pass
@@ -171,10 +621,46 @@ def test_stream_csv(nch, binstr, procstr, fmtstr, hdrstr, calcoeffs, timestep, s
 
 		parser.dump_csv("test.csv")
 
-	with open("test.csv") as f:
-		assert f.read() == csv
+	with open("test.csv", "rb") as f:
+		assert f.read() == csv.encode('ascii')
 
 	os.remove("test.csv")
 
+@pytest.mark.parametrize("fmtstr", [
+	"{t},{ch1[0]},{ch1[1]}\r\n",
+	"{n:05d} {T} {d} {t:+012.4f} %{ch1[1]!r}% {ch2[0]:.8e}\r\n",
+	"{t:.10e}, {ch1[1]:>10.3f}|{ch2[1]:g}|{ch2[0]:,}\r\n",
+])
+def test_bulk_csv_format(fmtstr):
+	# The compiled formatter must give exactly what str.format would
+	out = []
+	for bulk in [True, False]:
+		parser = LIDataParser(True, True, "<s32:f32", ["*2:", "/3:-1"], fmtstr, "Start {T}\r\n", 0.1, 1e9, [1.0, 1.0])
+		assert parser._fmtplan is not None
+		if not bulk:
+			parser._fmtplan = None
+
+		csv = ''
+		for i in range(5):
+			d = b''.join([ struct.pack("<if", j, j / 7.0) for j in range(i * 13, i * 17) ])
+			parser.parse(d + b'\x01', 0)
+			parser.parse(d, 1)
+			csv += parser.dump_csv()
+		out.append(csv)
+
+	assert out[0] == out[1]
+
+def test_bulk_csv_processed_type():
+	# Integer format specs apply to the processed values, a scaled integer field is a float
+	parser = LIDataParser(True, False, "<s32", ["*0.5"], "{ch1:d}\r\n", "", 0.1, 0, [1.0])
+	parser.parse(struct.pack("<i", 3), 0)
+
+	with pytest.raises(ValueError):
+		parser.dump_csv()
+
+	parser = LIDataParser(True, False, "<s32", ["*2"], "{ch1:d}\r\n", "", 0.1, 0, [1.0])
+	parser.parse(struct.pack("<i", 3), 0)
+	assert parser.dump_csv() == "6\r\n"
+
 if __name__ == '__main__':
 	pytest.main()
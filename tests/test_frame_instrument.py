@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+
+import pytest
+import sys, threading
+sys.path.append('..')
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from pymoku import InvalidOperationException
+from pymoku._frame_instrument import ScaleCache, FrameBasedInstrument
+from pymoku._oscilloscope import Oscilloscope
+from pymoku import _specan
+from pymoku._specan import SpecAn
+
+class _FakeMoku(object):
+	# Accepts register writes and nothing else
+	def _write_regs(self, regs):
+		pass
+
+def _counted(calls, scales):
+	def _calculate():
+		calls.append(scales)
+		return scales
+
+	return _calculate
+
+def test_scale_cache_get():
+	c = ScaleCache()
+	for s in [254, 255, 0, 1]:
+		c.put(s, s, lambda: s)
+
+	# Rendering a frame from state 0 means none from earlier states are still to come
+	assert c.get(0) == 0
+	assert 254 not in c and 255 not in c
+	assert 0 in c and 1 in c and len(c) == 2
+
+	# Unknown states don't disturb anything
+	assert c.get(7) is None
+	assert len(c) == 2
+
+	assert c.get(1) == 1
+	assert len(c) == 1 and c[1] == 1
+
+def test_scale_cache_fingerprint():
+	c = ScaleCache()
+	calls = []
+
+	assert c.put(254, 'a', _counted(calls, 'A')) == 'A'
+	assert c.put(255, 'b', _counted(calls, 'B')) == 'B'
+
+	# Same configuration after the state ID wraps, no recalculation
+	assert c.put(0, 'a', _counted(calls, 'X')) == 'A'
+	assert calls == ['A', 'B']
+
+	# A reused state ID with a new configuration replaces the old entry
+	assert c.put(254, 'c', _counted(calls, 'C')) == 'C'
+	assert c[254] == 'C' and calls == ['A', 'B', 'C']
+	assert list(c._states) == [255, 0, 254]
+
+	# Once retired, a configuration has to be calculated again
+	c.get(254)
+	assert c.put(1, 'a', _counted(calls, 'A2')) == 'A2'
+	assert calls == ['A', 'B', 'C', 'A2']
+
+def test_scale_cache_maxlen():
+	c = ScaleCache(maxlen=4)
+	for s in range(10):
+		c.put(s, s, lambda: s)
+
+	assert len(c) == 4
+	assert list(c._states) == [6, 7, 8, 9]
+
+	c.clear()
+	assert len(c) == 0 and c.get(9) is None
+
+def test_scales_across_commits():
+	o = Oscilloscope()
+	o._moku = _FakeMoku()
+	calls = []
+	o._calculate_scales = _counted(calls, (1.0, 1.0))
+
+	# Flip between two configurations for long enough that the state ID wraps
+	for n in range(300):
+		o.framerate = 10 if n % 2 else 20
+		o.commit()
+
+	assert len(calls) == 2
+	assert len(o.scales) == o.scales.maxlen
+	assert o.scales.get(o._stateid) == (1.0, 1.0)
+	assert len(o.scales) == 1
+
+def test_specan_scales_fingerprint():
+	s = SpecAn()
+	s._moku = _FakeMoku()
+	calls = []
+	s._calculate_scales = _counted(calls, {})
+
+	s.set_defaults()
+	s.commit()
+	s.commit(force=True)
+	assert len(calls) == 1
+
+	# Display units aren't held in a register but still change the scales
+	s.set_dbmscale(not s.dbmscale)
+	s.commit()
+	assert len(calls) == 2
+
+def test_numpy_frames():
+	o = Oscilloscope()
+	o.set_numpy_frames()
+	assert o.frame_kwargs == { 'scales': o.scales, 'use_numpy': True }
+
+	o.set_numpy_frames(False)
+	assert not o.frame_class(**o.frame_kwargs).use_numpy
+
+	# Instruments without frames say so rather than failing on the missing frame class
+	with pytest.raises(InvalidOperationException):
+		FrameBasedInstrument().set_numpy_frames()
+
+def test_specan_corrections_shared(monkeypatch):
+	monkeypatch.setattr(_specan, '_SA_CORR_CACHE_SIZE', 4)
+	_specan._sa_corr_cache.clear()
+
+	s1, s2 = SpecAn(), SpecAn()
+	f1, c1 = s1._calculate_corrections(4, 0, 1, 0, True)
+	f2, c2 = s2._calculate_corrections(4, 0, 1, 0, True)
+
+	# One set of corrections between them, which neither can change
+	assert c1 is c2
+	with pytest.raises(ValueError):
+		c1[0] = 0
+
+	f1[0] = -1
+	assert f2[0] != -1
+
+	errs = []
+	def _worker(n):
+		try:
+			for i in range(200):
+				SpecAn()._calculate_corrections(4, (n * i) % 7, 1, 0, True)
+		except Exception as e:
+			errs.append(e)
+
+	ts = [ threading.Thread(target=_worker, args=(n,)) for n in range(8) ]
+	for t in ts: t.start()
+	for t in ts: t.join()
+
+	assert not errs
+	assert len(_specan._sa_corr_cache) == 4
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+
+import pytest
+import sys, random
+sys.path.append('..')
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from pymoku import NotDeployedException, ValueOutOfRangeException
+from pymoku._instrument import *
+from pymoku._instrument import _RegAccessor, _CompoundRegAccessor
+from pymoku._oscilloscope import Oscilloscope
+from pymoku._specan import SpecAn
+from pymoku._siggen import SignalGenerator, REG_SG_FREQ1_H, REG_SG_FREQ1_L, _SG_FREQSCALE
+
+class _FakeMoku(object):
+	# Just enough of a Moku to commit to, recording each register write
+	def __init__(self):
+		self.writes = []
+
+	def _write_regs(self, regs):
+		self.writes.append(list(regs))
+
+def _committed():
+	i = MokuInstrument()
+	i.attach_moku(_FakeMoku())
+	i.framerate = 10
+	i.offset = -5
+	i.commit()
+	return i
+
+def test_commit_writes_changes():
+	i = _committed()
+
+	assert i._moku.writes == [[(REG_FRATE, i._remoteregs[REG_FRATE]), (REG_OFFSET, i._remoteregs[REG_OFFSET]), (REG_STATE, 1 | 1 << 16)]]
+	assert i.offset == -5 and i.state_id == 1 and i.state_id_alt == 1
+	assert i._localregs == [None] * 128 and not i._dirty
+	assert i.commit_stats == { 'commits': 1, 'writes': 1, 'registers': 3, 'suppressed': 0 }
+
+def test_commit_suppressed():
+	i = _committed()
+
+	# Nothing set at all
+	i.commit()
+
+	# Set, but to the values already on the device
+	i.framerate = 10
+	i.offset = -5
+	i.commit()
+
+	assert len(i._moku.writes) == 1
+	assert i.state_id == 1
+	assert not i._dirty
+	assert i.commit_stats == { 'commits': 3, 'writes': 1, 'registers': 3, 'suppressed': 2 }
+
+	# Only the register that changed goes out, with a new state
+	i.framerate = 10
+	i.offset = 7
+	i.commit()
+
+	assert i._moku.writes[-1] == [(REG_OFFSET, 7), (REG_STATE, 2 | 2 << 16)]
+	assert i.commit_stats == { 'commits': 4, 'writes': 2, 'registers': 5, 'suppressed': 3 }
+
+def test_commit_forced():
+	i = _committed()
+
+	i.framerate = 10
+	i.commit(force=True)
+
+	assert i._moku.writes[-1] == [(REG_FRATE, i._remoteregs[REG_FRATE]), (REG_STATE, 2 | 2 << 16)]
+	assert i.state_id == 2
+
+	# With nothing set, a forced commit still moves the device to a new state
+	i.commit(force=True)
+
+	assert i._moku.writes[-1] == [(REG_STATE, 3 | 3 << 16)]
+	assert i.commit_stats == { 'commits': 3, 'writes': 3, 'registers': 6, 'suppressed': 0 }
+
+def test_commit_state_wraps():
+	i = _committed()
+
+	for n in range(256):
+		i.offset = n
+		i.commit()
+
+	assert i.state_id == 1 and i.state_id_alt == 1
+	assert i._moku.writes[-1][-1] == (REG_STATE, 1 | 1 << 16)
+
+def test_commit_not_deployed():
+	i = MokuInstrument()
+	i.framerate = 10
+
+	with pytest.raises(NotDeployedException):
+		i.commit()
+
+
+def _reg_value(i, reg):
+	# What an accessor on the given register(s) works from: the local value if one has been set,
+	# otherwise the one from the device
+	if isinstance(reg, (list, tuple)):
+		return [ _reg_value(i, r) for r in reg ]
+
+	v = i._localregs[reg]
+	return v if v is not None else i._remoteregs[reg] or 0
+
+def _randomised(cls, seed):
+	i = cls()
+	rng = random.Random(seed)
+	i._remoteregs = [ rng.getrandbits(32) for r in range(128) ]
+	return i
+
+instruments = [MokuInstrument, Oscilloscope, SpecAn, SignalGenerator]
+
+@pytest.mark.parametrize("cls", instruments)
+def test_accessor_get(cls):
+	i = _randomised(cls, 1)
+	for r in range(0, 128, 3):
+		i._localregs[r] = r * 0x01010101
+
+	for name, (reg, set_xform, get_xform) in sorted(cls._accessor_dict.items()):
+		assert isinstance(getattr(cls, name), _CompoundRegAccessor if isinstance(reg, tuple) else _RegAccessor)
+		assert getattr(i, name) == get_xform(_reg_value(i, reg)), name
+
+@pytest.mark.parametrize("cls", instruments)
+def test_accessor_set(cls):
+	i = _randomised(cls, 1)
+	values = _randomised(cls, 2)
+
+	for name, (reg, set_xform, get_xform) in sorted(cls._accessor_dict.items()):
+		i._localregs = [None] * 128
+		i._dirty.clear()
+
+		if set_xform is None:
+			with pytest.raises(AttributeError):
+				setattr(i, name, 0)
+			continue
+
+		# Some of these will be out of range for the setter, which must then leave the registers alone
+		value = getattr(values, name)
+		try:
+			new = set_xform(value, _reg_value(i, reg))
+		except Exception as e:
+			new = e
+
+		if new is None or isinstance(new, Exception):
+			with pytest.raises(ValueOutOfRangeException if new is None else type(new)):
+				setattr(i, name, value)
+
+			assert i._localregs == [None] * 128 and not i._dirty
+			continue
+
+		setattr(i, name, value)
+
+		regs = list(reg) if isinstance(reg, tuple) else [reg]
+		new = list(new) if isinstance(reg, tuple) else [new]
+		assert [ i._localregs[r] for r in regs ] == new, name
+		assert sum(l is not None for l in i._localregs) == len(regs)
+		assert i._dirty == set(regs)
+
+def test_accessor_contents():
+	i = MokuInstrument()
+	i._remoteregs[REG_AINCTL] = 0xFF
+
+	i.state_id = 5
+	i.state_id_alt = 7
+	i.relays_ch1 = 0
+
+	assert i._localregs[REG_STATE] == 5 | 7 << 16
+	assert i._localregs[REG_AINCTL] == 0xF8
+	assert i.relays_ch2 == 7 and i.en_in_ch1
+	assert i._dirty == set([REG_STATE, REG_AINCTL])
+
+	with pytest.raises(AttributeError):
+		i.instr_id = 1
+
+	with pytest.raises(ValueOutOfRangeException):
+		i.x_mode = 3
+
+	assert i._localregs[REG_OUTLEN] is None
+
+	sg = SignalGenerator()
+	sg.out1_frequency = 1e6
+	f = int(1e6 / _SG_FREQSCALE)
+
+	assert (sg._localregs[REG_SG_FREQ1_H], sg._localregs[REG_SG_FREQ1_L]) == (f >> 32, f & 0xFFFFFFFF)
+	assert sg.out1_frequency == f * _SG_FREQSCALE